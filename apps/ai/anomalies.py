@@ -0,0 +1,189 @@
+"""
+Streaming anomaly scoring.
+
+Every (user, category) has one ``CategorySpendingStats`` row with running
+statistics of expense amounts:
+
+* count / mean / m2: Welford's online mean and variance,
+* median / mad: a frugal streaming estimate of the median and the median
+  absolute deviation, which outliers barely move. Each insert nudges them
+  towards the new amount by a step proportional to the current spread.
+
+A new expense is scored against the statistics *before* it is added, then
+folded in, so each insert costs one locked row read and one write. The score
+is the classic z-score while the sketch warms up and the robust z-score
+(median/MAD) after that. Only spending above the usual range raises an alert.
+"""
+import logging
+import math
+
+import numpy as np
+import pandas as pd
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from apps.expenses.models import Expense
+from .models import AnomalyAlert, CategorySpendingStats
+
+logger = logging.getLogger(__name__)
+
+# Scales the MAD to a standard deviation for normally distributed amounts
+MAD_SCALE = 1.4826
+# Step size of the streaming median/MAD, relative to the current spread
+SKETCH_RATE = 0.1
+MIN_STEP = 0.01
+# Inserts before the median/MAD sketch is trusted over mean/variance
+ROBUST_MIN_SAMPLES = 30
+
+
+def _std(stats):
+    return math.sqrt(stats.m2 / (stats.count - 1)) if stats.count > 1 else 0.0
+
+
+def update_stats(stats, amount):
+    """Fold one amount into the running statistics, in place"""
+    if stats.count == 0:
+        stats.count, stats.mean, stats.m2 = 1, amount, 0.0
+        stats.median, stats.mad = amount, 0.0
+        return stats
+
+    step = SKETCH_RATE * max(_std(stats), stats.mad * MAD_SCALE, MIN_STEP)
+
+    stats.count += 1
+    delta = amount - stats.mean
+    stats.mean += delta / stats.count
+    stats.m2 += delta * (amount - stats.mean)
+
+    stats.median += math.copysign(min(step, abs(amount - stats.median)), amount - stats.median)
+    deviation = abs(amount - stats.median)
+    stats.mad += math.copysign(min(step, abs(deviation - stats.mad)), deviation - stats.mad)
+    return stats
+
+
+def score(stats, amount):
+    """Return (score, expected_range) for an amount against the stats, or (None, None) while warming up"""
+    if stats.count < settings.ANOMALY_MIN_SAMPLES:
+        return None, None
+
+    if stats.count >= ROBUST_MIN_SAMPLES and stats.mad * MAD_SCALE > MIN_STEP:
+        center, spread = stats.median, stats.mad * MAD_SCALE
+    else:
+        center, spread = stats.mean, _std(stats)
+    if spread <= MIN_STEP:
+        # Every past amount was the same
+        return None, None
+
+    threshold = settings.ANOMALY_Z_THRESHOLD
+    expected_range = {
+        'min': round(max(center - threshold * spread, 0), 2),
+        'max': round(center + threshold * spread, 2),
+    }
+    return (amount - center) / spread, expected_range
+
+
+def _severity(value):
+    if value >= 8:
+        return 'critical'
+    if value >= 5:
+        return 'high'
+    return 'medium'
+
+
+def score_expense(expense):
+    """Score a newly written expense, update its category stats and alert inline; returns the alert"""
+    amount = float(expense.amount)
+
+    with transaction.atomic():
+        stats, _ = CategorySpendingStats.objects.select_for_update().get_or_create(
+            user_id=expense.user_id,
+            category_id=expense.category_id
+        )
+        value, expected_range = score(stats, amount)
+        update_stats(stats, amount)
+        stats.save()
+
+        if value is None or value < settings.ANOMALY_Z_THRESHOLD:
+            return None
+
+        alert = AnomalyAlert.objects.create(
+            user_id=expense.user_id,
+            expense=expense,
+            anomaly_score=round(value, 3),
+            expected_range=expected_range,
+            actual_amount=expense.amount,
+            severity=_severity(value)
+        )
+
+    _notify(alert)
+    return alert
+
+
+def _notify(alert):
+    """Push the alert to the user's notification socket after commit"""
+    notification = {
+        'type': 'anomaly_alert',
+        'anomaly_alert_id': alert.id,
+        'expense_id': alert.expense_id,
+        'anomaly_score': alert.anomaly_score,
+        'expected_range': alert.expected_range,
+        'actual_amount': float(alert.actual_amount),
+        'severity': alert.severity,
+    }
+
+    def _send():
+        try:
+            async_to_sync(get_channel_layer().group_send)(
+                f"notifications_{alert.user_id}",
+                {'type': 'new_notification', 'notification': notification}
+            )
+        except Exception as e:
+            # The alert is stored either way
+            logger.warning(f"Could not push anomaly alert {alert.id}: {str(e)}")
+
+    transaction.on_commit(_send)
+
+
+def rebuild_stats(user_ids):
+    """Seed the running statistics of existing users from their history; returns the number of rows"""
+    history = pd.DataFrame.from_records(
+        list(Expense.objects.filter(
+            user_id__in=user_ids,
+            expense_type='expense'
+        ).values_list('user_id', 'category_id', 'amount')),
+        columns=['user_id', 'category_id', 'amount']
+    )
+    if history.empty:
+        return 0
+
+    history['amount'] = history['amount'].astype(float)
+    grouped = history.groupby(['user_id', 'category_id'])['amount']
+    median = grouped.transform('median')
+    stats = pd.DataFrame({
+        'count': grouped.size(),
+        'mean': grouped.mean(),
+        'm2': grouped.var(ddof=0) * grouped.size(),
+        'median': grouped.median(),
+        'mad': (history['amount'] - median).abs().groupby([history['user_id'], history['category_id']]).median(),
+    }).reset_index()
+
+    rows = [
+        CategorySpendingStats(
+            user_id=row.user_id,
+            category_id=row.category_id,
+            count=row.count,
+            mean=row.mean,
+            m2=float(np.nan_to_num(row.m2)),
+            median=row.median,
+            mad=row.mad,
+        )
+        for row in stats.itertuples(index=False)
+    ]
+    CategorySpendingStats.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['user', 'category'],
+        update_fields=['count', 'mean', 'm2', 'median', 'mad', 'updated_at'],
+    )
+    return len(rows)
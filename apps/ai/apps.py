@@ -5,3 +5,6 @@ class AiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.ai'
     verbose_name = 'AI Features'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,149 @@
+"""
+Back-testing of spending predictions against what users actually spent.
+
+``score_matured_predictions`` joins every matured, unscored daily prediction
+to the actual spend of that (user, category, day) in one grouped query and
+writes ``actual_amount`` / ``is_accurate`` back with ``bulk_update``.
+
+``compute_metrics`` then aggregates the scored predictions per model version
+and category (MAE, RMSE, MAPE, bias, hit rate) with vectorized pandas
+operations and stores them on ``MLModelVersion``, so forecasting models can
+be compared on evidence.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.expenses.models import Expense
+from .models import AIExpensePrediction, MLModelVersion
+
+MODEL_NAME = 'spending_forecast'
+# Expenses are often entered a day or two late
+SETTLE_DAYS = 2
+METRICS_WINDOW_DAYS = 90
+# A prediction is accurate within 20% of the actual spend or $5, whichever is larger
+RELATIVE_TOLERANCE = 0.2
+ABSOLUTE_TOLERANCE = 5.0
+BATCH_SIZE = 2000
+
+
+def score_matured_predictions(today=None):
+    """Fill actual_amount and is_accurate for matured daily predictions; returns the count"""
+    today = today or timezone.now().date()
+    cutoff = today - timedelta(days=SETTLE_DAYS)
+
+    pending = pd.DataFrame.from_records(
+        list(AIExpensePrediction.objects.filter(
+            prediction_type='daily',
+            prediction_date__lt=cutoff,
+            actual_amount__isnull=True
+        ).values_list('id', 'user_id', 'category', 'prediction_date', 'predicted_amount')),
+        columns=['id', 'user_id', 'category', 'date', 'predicted']
+    )
+    if pending.empty:
+        return 0
+
+    actual = pd.DataFrame.from_records(
+        list(Expense.objects.filter(
+            user_id__in=pending['user_id'].unique().tolist(),
+            expense_type='expense',
+            transaction_date__gte=pending['date'].min(),
+            transaction_date__lt=cutoff
+        ).values_list('user_id', 'category__name', 'transaction_date').annotate(total=Sum('amount'))),
+        columns=['user_id', 'category', 'date', 'actual']
+    )
+
+    scored = pending.merge(actual, on=['user_id', 'category', 'date'], how='left')
+    scored['actual'] = scored['actual'].fillna(0).astype(float)
+    predicted = scored['predicted'].astype(float)
+    tolerance = np.maximum(scored['actual'] * RELATIVE_TOLERANCE, ABSOLUTE_TOLERANCE)
+    scored['accurate'] = (predicted - scored['actual']).abs() <= tolerance
+
+    AIExpensePrediction.objects.bulk_update(
+        [
+            AIExpensePrediction(id=row.id, actual_amount=round(row.actual, 2), is_accurate=bool(row.accurate))
+            for row in scored.itertuples(index=False)
+        ],
+        ['actual_amount', 'is_accurate'],
+        batch_size=BATCH_SIZE
+    )
+    return len(scored)
+
+
+def _error_metrics(frame, keys):
+    """MAE, RMSE, MAPE (over days with spend), bias and hit rate per group"""
+    frame = frame.assign(
+        error=frame['predicted'] - frame['actual'],
+        abs_pct=np.where(
+            frame['actual'] > 0,
+            (frame['predicted'] - frame['actual']).abs() / frame['actual'].where(frame['actual'] > 0),
+            np.nan
+        ),
+    )
+    frame['squared'] = frame['error'] ** 2
+    frame['abs_error'] = frame['error'].abs()
+
+    grouped = frame.groupby(keys)
+    metrics = pd.DataFrame({
+        'count': grouped.size(),
+        'mae': grouped['abs_error'].mean(),
+        'rmse': np.sqrt(grouped['squared'].mean()),
+        'mape': grouped['abs_pct'].mean() * 100,
+        'bias': grouped['error'].mean(),
+        'accuracy': grouped['accurate'].mean(),
+    })
+    # Object dtype keeps the counts integral and lets missing MAPE serialize as null
+    return metrics.round(4).astype(object).where(metrics.notna(), None)
+
+
+def compute_metrics(today=None):
+    """Aggregate scored predictions into MLModelVersion rows; returns them"""
+    today = today or timezone.now().date()
+
+    scored = pd.DataFrame.from_records(
+        list(AIExpensePrediction.objects.filter(
+            prediction_type='daily',
+            actual_amount__isnull=False,
+            prediction_date__gte=today - timedelta(days=METRICS_WINDOW_DAYS)
+        ).values_list('model_version', 'category', 'predicted_amount', 'actual_amount', 'is_accurate')),
+        columns=['model_version', 'category', 'predicted', 'actual', 'accurate']
+    )
+    if scored.empty:
+        return []
+
+    scored['predicted'] = scored['predicted'].astype(float)
+    scored['actual'] = scored['actual'].astype(float)
+    scored['accurate'] = scored['accurate'].astype(float)
+
+    overall = _error_metrics(scored, ['model_version'])
+    by_category = _error_metrics(scored, ['model_version', 'category'])
+
+    versions = []
+    for model_version, row in overall.iterrows():
+        categories = by_category.loc[model_version]
+        version, _ = MLModelVersion.objects.update_or_create(
+            model_name=MODEL_NAME,
+            version=model_version,
+            defaults={
+                'accuracy': row['accuracy'],
+                'training_data_size': int(row['count']),
+                'metrics': {
+                    'window_days': METRICS_WINDOW_DAYS,
+                    'overall': row.to_dict(),
+                    'categories': {
+                        category: values.to_dict() for category, values in categories.iterrows()
+                    },
+                },
+            }
+        )
+        versions.append(version)
+    return versions
+
+
+def run_backtest(today=None):
+    scored = score_matured_predictions(today)
+    versions = compute_metrics(today)
+    return {'scored': scored, 'model_versions': [version.version for version in versions]}
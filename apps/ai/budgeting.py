@@ -0,0 +1,152 @@
+"""
+Batch budget recommendations.
+
+One grouped query returns monthly spend per (user, category) over the last
+complete months for every user in a chunk. From those real monthly totals
+(months without spend count as zero) the recommendation is:
+
+* projected: the least-squares trend line extended one month ahead, kept
+  within +/-50% of the mean month,
+* buffer: a multiple of the monthly standard deviation, so volatile
+  categories get more headroom and steady ones (rent) very little.
+
+Rows are upserted on (user, category); recommendations for categories the
+user no longer spends in are removed unless they were accepted.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from apps.expenses.models import Expense
+from .models import SmartBudgetRecommendation
+
+HISTORY_MONTHS = 6
+BUFFER_STDDEVS = 0.75
+MIN_BUFFER = 0.05
+MAX_TREND_CHANGE = 0.5
+BATCH_SIZE = 1000
+
+
+def _month_starts(today, months):
+    """First day of each of the last ``months`` complete months, oldest first"""
+    first = today.replace(day=1)
+    starts = []
+    for _ in range(months):
+        first = (first - timedelta(days=1)).replace(day=1)
+        starts.append(first)
+    return starts[::-1]
+
+
+def load_monthly_spend(user_ids, months):
+    """Monthly spend per (user, category), one column per month, zero-filled"""
+    rows = Expense.objects.filter(
+        user_id__in=user_ids,
+        expense_type='expense',
+        category__isnull=False,
+        transaction_date__gte=months[0],
+        transaction_date__lt=(months[-1] + timedelta(days=32)).replace(day=1)
+    ).annotate(
+        month=TruncMonth('transaction_date')
+    ).values_list('user_id', 'category__name', 'month').annotate(total=Sum('amount'))
+
+    frame = pd.DataFrame.from_records(list(rows), columns=['user_id', 'category', 'month', 'total'])
+    if frame.empty:
+        return frame
+    frame['total'] = frame['total'].astype(float)
+    return frame.pivot_table(
+        index=['user_id', 'category'], columns='month', values='total', aggfunc='sum', fill_value=0.0
+    ).reindex(columns=months, fill_value=0.0)
+
+
+def compute_recommendations(monthly):
+    """Recommendation figures per (user, category) from a months-as-columns frame"""
+    values = monthly.values
+    n_months = values.shape[1]
+    mean = values.mean(axis=1)
+    std = values.std(axis=1)
+
+    offsets = np.arange(n_months) - (n_months - 1) / 2
+    slope = ((values - mean[:, None]) * offsets).sum(axis=1) / max((offsets ** 2).sum(), 1)
+    projected = np.clip(
+        mean + slope * (n_months + 1) / 2,
+        mean * (1 - MAX_TREND_CHANGE),
+        mean * (1 + MAX_TREND_CHANGE)
+    )
+    buffer = np.maximum(BUFFER_STDDEVS * std, MIN_BUFFER * projected)
+
+    variation = np.divide(std, mean, out=np.zeros_like(std), where=mean > 0)
+    active_share = (values > 0).sum(axis=1) / n_months
+
+    result = pd.DataFrame({
+        'average': mean.round(2),
+        'previous': values[:, -1].round(2),
+        'projected': projected.round(2),
+        'recommended': (projected + buffer).round(2),
+        'trend': np.divide(slope, mean, out=np.zeros_like(slope), where=mean > 0).round(3),
+        'variation': variation.round(3),
+        'confidence': (0.5 + 0.45 * active_share * (1 - np.minimum(variation, 1))).round(2),
+        'risk': np.select([variation < 0.25, variation < 0.6], ['low', 'medium'], 'high'),
+    }, index=monthly.index)
+    return result[result['average'] > 0]
+
+
+def _reasoning(row, n_months):
+    text = f"You spent an average of ${row.average:.2f} a month on {row.category} over the last {n_months} months"
+    if abs(row.trend) >= 0.05:
+        direction = 'rising' if row.trend > 0 else 'falling'
+        text += f", {direction} about {abs(row.trend) * 100:.0f}% a month"
+    return text + f". The budget includes ${row.recommended - row.projected:.2f} of headroom for month-to-month swings."
+
+
+def generate_recommendations(user_ids, today=None):
+    """Compute and upsert budget recommendations for a chunk of users; returns the number of rows"""
+    today = today or timezone.now().date()
+    months = _month_starts(today, HISTORY_MONTHS)
+    run_started = timezone.now()
+
+    monthly = load_monthly_spend(user_ids, months)
+    rows = []
+    if not monthly.empty:
+        recommendations = compute_recommendations(monthly).reset_index()
+        rows = [
+            SmartBudgetRecommendation(
+                user_id=row.user_id,
+                category=row.category,
+                recommended_amount=row.recommended,
+                current_spending=row.average,
+                previous_spending=row.previous,
+                reasoning=_reasoning(row, HISTORY_MONTHS),
+                confidence_level=row.confidence,
+                risk_level=row.risk,
+            )
+            for row in recommendations.itertuples(index=False)
+        ]
+        # An accepted recommendation is the user's budget now; nightly runs must not rewrite it
+        accepted = set(
+            SmartBudgetRecommendation.objects.filter(
+                user_id__in=user_ids, is_accepted=True
+            ).values_list('user_id', 'category')
+        )
+        rows = [row for row in rows if (row.user_id, row.category) not in accepted]
+
+    SmartBudgetRecommendation.objects.bulk_create(
+        rows,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['user', 'category'],
+        update_fields=[
+            'recommended_amount', 'current_spending', 'previous_spending', 'reasoning',
+            'confidence_level', 'risk_level', 'updated_at'
+        ],
+    )
+
+    SmartBudgetRecommendation.objects.filter(
+        user_id__in=user_ids,
+        is_accepted=False,
+        updated_at__lt=run_started
+    ).delete()
+    return len(rows)
@@ -0,0 +1,192 @@
+"""
+Per-user expense categorizer.
+
+Expenses are turned into hashed character n-gram features (title, merchant and
+an amount bucket) with a stateless ``HashingVectorizer``, so no vocabulary has
+to be stored or kept in sync. The model is multinomial naive Bayes, whose
+state is just per-class sample and feature counts. Counts are additive, which
+makes incremental training a matter of adding the counts of new expenses,
+and a category the user starts using is just a new row.
+
+The classes are the user's own categories, and feature counts are kept as a
+sparse matrix: a user's expenses touch a few hundred of the feature slots per
+category, so the stored and loaded model grows with the user's data, not with
+the category table times the hashing width. Inference stays sparse too: the
+smoothed log probability splits into a sparse per-feature term and a
+per-class constant, so predicting one expense is a sparse row times a sparse
+matrix, well under a millisecond. Loaded models are kept in a per-process LRU.
+"""
+import io
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+MODEL_NAME = 'category_classifier'
+MODEL_VERSION = 'nb-v2'
+N_FEATURES = 2 ** 12
+ALPHA = 0.1
+
+_vectorizer = HashingVectorizer(
+    analyzer='char_wb',
+    ngram_range=(3, 4),
+    n_features=N_FEATURES,
+    alternate_sign=False,
+    norm=None,
+    lowercase=True,
+)
+
+
+def expense_text(title, merchant='', amount=None):
+    """Flatten the features of one expense into a single string"""
+    text = f'{title or ""} {merchant or ""}'
+    if amount:
+        # Order-of-magnitude bucket: coffee vs groceries vs rent
+        text += f' amt{int(math.log2(float(amount) + 1))}'
+    return text
+
+
+def vectorize(texts):
+    return _vectorizer.transform(texts)
+
+
+def count_samples(texts, labels):
+    """(classes, class_count, feature_count) of a labelled batch; feature_count is sparse, classes x features"""
+    classes, rows = np.unique(np.asarray(labels, dtype=np.int64), return_inverse=True)
+    indicator = sparse.csr_matrix(
+        (np.ones(len(labels), dtype=np.float32), (rows, np.arange(len(labels)))),
+        shape=(len(classes), len(labels))
+    )
+    feature_count = (indicator @ vectorize(texts)).astype(np.float32).tocsr()
+    class_count = np.asarray(indicator.sum(axis=1), dtype=np.float32).ravel()
+    return classes.tolist(), class_count, feature_count
+
+
+class CategoryModel:
+    """Naive Bayes counts for one user, ready for prediction"""
+
+    def __init__(self, classes=(), class_count=None, feature_count=None):
+        self.classes = list(classes)
+        self.class_count = np.zeros(len(self.classes), dtype=np.float32) if class_count is None else class_count
+        self.feature_count = (
+            sparse.csr_matrix((len(self.classes), N_FEATURES), dtype=np.float32)
+            if feature_count is None else feature_count
+        )
+        self._prepare()
+
+    def _prepare(self):
+        # log((n_cf + a) / (n_c + aF)) = log1p(n_cf / a) + log(a / (n_c + aF)): sparse term plus class constant
+        ratio = self.feature_count.copy()
+        ratio.data = np.log1p(ratio.data / ALPHA)
+        self._feature_log_ratio = ratio.T.tocsr()
+        totals = np.asarray(self.feature_count.sum(axis=1)).ravel() + ALPHA * N_FEATURES
+        self._class_log_base = (math.log(ALPHA) - np.log(totals)).astype(np.float32)
+        total = max(self.class_count.sum(), 1)
+        with np.errstate(divide='ignore'):
+            # Unused classes get -inf and are never predicted
+            self._class_log_prior = np.log(self.class_count / total).astype(np.float32)
+
+    @property
+    def sample_count(self):
+        return int(self.class_count.sum())
+
+    def add_counts(self, classes, class_count, feature_count):
+        """Add a batch's counts; categories the model has not seen become new classes"""
+        index = {class_id: row for row, class_id in enumerate(self.classes)}
+        new = [class_id for class_id in classes if class_id not in index]
+        if new:
+            self.classes.extend(new)
+            index.update({class_id: len(index) + i for i, class_id in enumerate(new)})
+            self.class_count = np.concatenate([self.class_count, np.zeros(len(new), dtype=np.float32)])
+            self.feature_count = sparse.vstack([
+                self.feature_count, sparse.csr_matrix((len(new), N_FEATURES), dtype=np.float32)
+            ]).tocsr()
+
+        rows = [index[class_id] for class_id in classes]
+        placement = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, np.arange(len(rows)))),
+            shape=(len(self.classes), len(rows))
+        )
+        self.class_count = self.class_count + placement @ class_count
+        self.feature_count = (self.feature_count + placement @ feature_count).tocsr()
+        self._prepare()
+
+    def predict(self, text, top=3):
+        """Return ``[(class, probability), ...]`` best first"""
+        features = vectorize([text])
+        scores = np.asarray((features @ self._feature_log_ratio).todense()).ravel()
+        scores = scores + features.sum() * self._class_log_base + self._class_log_prior
+        if not len(scores) or not np.isfinite(scores.max()):
+            return []
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = np.argsort(probabilities)[::-1][:top]
+        return [
+            (self.classes[index], float(probabilities[index]))
+            for index in best if self.class_count[index] > 0
+        ]
+
+    def dumps(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            classes=np.asarray(self.classes, dtype=np.int64),
+            class_count=self.class_count,
+            data=self.feature_count.data,
+            indices=self.feature_count.indices,
+            indptr=self.feature_count.indptr,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        with np.load(io.BytesIO(bytes(data))) as arrays:
+            classes = arrays['classes'].tolist()
+            feature_count = sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']), shape=(len(classes), N_FEATURES)
+            )
+            return cls(classes, arrays['class_count'], feature_count)
+
+
+class ModelLRU:
+    """Small per-process LRU of loaded models with a freshness TTL"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                return None
+            loaded_at, model = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                del self._models[key]
+                return None
+            self._models.move_to_end(key)
+            return model
+
+    def put(self, key, model):
+        with self._lock:
+            self._models[key] = (time.monotonic(), model)
+            self._models.move_to_end(key)
+            while len(self._models) > self.max_size:
+                self._models.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._models.pop(key, None)
+
+
+model_cache = ModelLRU(
+    max_size=getattr(settings, 'CATEGORY_MODEL_CACHE_SIZE', 256),
+    ttl=getattr(settings, 'CATEGORY_MODEL_CACHE_TTL', 300),
+)
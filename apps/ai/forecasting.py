@@ -0,0 +1,208 @@
+"""
+Batch spending predictions.
+
+One grouped query returns daily spend per (user, category) for every user in
+a chunk. The features are then computed for all series at once with pandas
+and numpy:
+
+* level: a blend of the last eight weeks and the whole history,
+* weekly seasonality: mean spend per weekday relative to the overall mean,
+* monthly seasonality: mean spend per week-of-month (rent and bills cluster
+  early in the month),
+* trend: least-squares slope of the weekly totals.
+
+Every series gets one daily prediction per day of the horizon. Rows are
+upserted on (user, category, prediction_date, model_version), so re-running
+the job replaces earlier predictions instead of adding to them. The
+Holt-Winters forecasts are stored through the same path
+(``holtwinters.generate_predictions``), so back-testing compares both models.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.expenses.models import Expense
+from apps.users.versioning import bump_versions_many
+from .models import AIExpensePrediction
+
+MODEL_VERSION = 'seasonal-v1'
+HISTORY_DAYS = 182
+RECENT_DAYS = 56
+HORIZON_DAYS = 30
+RECENT_WEIGHT = 0.7
+MAX_MONTHLY_TREND = 0.5
+MIN_DAILY_AMOUNT = 0.01
+BATCH_SIZE = 1000
+
+SERIES_KEYS = ['user_id', 'category']
+
+
+def _week_of_month(days):
+    # 0: days 1-7, 1: 8-14, 2: 15-21, 3: 22 onwards
+    return np.minimum((np.asarray(days) - 1) // 7, 3)
+
+
+def load_daily_spend(user_ids, start, end):
+    """Daily spend per (user, category) in [start, end) from one grouped query"""
+    rows = Expense.objects.filter(
+        user_id__in=user_ids,
+        expense_type='expense',
+        transaction_date__gte=start,
+        transaction_date__lt=end
+    ).values_list('user_id', 'category__name', 'transaction_date').annotate(total=Sum('amount'))
+
+    frame = pd.DataFrame.from_records(
+        list(rows), columns=['user_id', 'category', 'date', 'total']
+    )
+    frame['date'] = pd.to_datetime(frame['date'])
+    frame['total'] = frame['total'].astype(float)
+    return frame
+
+
+def compute_features(daily, start, end):
+    """Per-series features, one row per (user, category)"""
+    history = pd.date_range(start, end - timedelta(days=1), freq='D')
+    n_days = len(history)
+
+    daily = daily.assign(
+        weekday=daily['date'].dt.weekday,
+        week_of_month=_week_of_month(daily['date'].dt.day),
+        week=(daily['date'] - pd.Timestamp(start)).dt.days // 7,
+        recent=daily['date'] >= pd.Timestamp(end - timedelta(days=RECENT_DAYS)),
+    )
+    grouped = daily.groupby(SERIES_KEYS)
+
+    features = pd.DataFrame({
+        'total': grouped['total'].sum(),
+        'recent_total': daily[daily['recent']].groupby(SERIES_KEYS)['total'].sum(),
+        'active_days': grouped['date'].nunique(),
+    }).fillna({'recent_total': 0.0})
+
+    long_run = features['total'] / n_days
+    recent = features['recent_total'] / RECENT_DAYS
+    features['daily_level'] = RECENT_WEIGHT * recent + (1 - RECENT_WEIGHT) * long_run
+
+    # Seasonal factors: mean spend per weekday / week-of-month slot over the
+    # mean daily spend, counting the days with no spend in each slot
+    weekday_days = pd.Series(history.weekday).value_counts().reindex(range(7), fill_value=0)
+    weekday_means = daily.pivot_table(
+        index=SERIES_KEYS, columns='weekday', values='total', aggfunc='sum', fill_value=0.0
+    ).reindex(columns=range(7), fill_value=0.0) / weekday_days.clip(lower=1).values
+    features[[f'weekday_{d}' for d in range(7)]] = (
+        weekday_means.div(long_run, axis=0).reindex(features.index).fillna(1.0).values
+    )
+
+    slot_days = pd.Series(_week_of_month(history.day)).value_counts().reindex(range(4), fill_value=0)
+    slot_means = daily.pivot_table(
+        index=SERIES_KEYS, columns='week_of_month', values='total', aggfunc='sum', fill_value=0.0
+    ).reindex(columns=range(4), fill_value=0.0) / slot_days.clip(lower=1).values
+    features[[f'month_slot_{s}' for s in range(4)]] = (
+        slot_means.div(long_run, axis=0).reindex(features.index).fillna(1.0).values
+    )
+
+    # Trend: least-squares slope of weekly totals, relative to the mean week
+    n_weeks = max(n_days // 7, 1)
+    weekly = daily[daily['week'] < n_weeks].pivot_table(
+        index=SERIES_KEYS, columns='week', values='total', aggfunc='sum', fill_value=0.0
+    ).reindex(columns=range(n_weeks), fill_value=0.0).reindex(features.index, fill_value=0.0)
+    weeks = np.arange(n_weeks) - (n_weeks - 1) / 2
+    values = weekly.values
+    slope = ((values - values.mean(axis=1, keepdims=True)) * weeks).sum(axis=1) / max((weeks ** 2).sum(), 1)
+    mean_week = values.mean(axis=1)
+    relative = np.divide(slope, mean_week, out=np.zeros_like(slope), where=mean_week > 0)
+    # Per-day growth, capped at +/-50% a month
+    features['trend'] = np.clip(relative * 4.345, -MAX_MONTHLY_TREND, MAX_MONTHLY_TREND) / 30
+
+    features['confidence'] = np.round(
+        0.5 + 0.45 * np.minimum(features['active_days'] / 60, 1.0), 2
+    )
+    return features[features['daily_level'] > 0]
+
+
+def predict(features, first_day, horizon=HORIZON_DAYS):
+    """Daily predictions for every series over the horizon, as a long frame"""
+    days = pd.date_range(first_day, periods=horizon, freq='D')
+    weekday = features[[f'weekday_{d}' for d in range(7)]].values[:, days.weekday]
+    month_slot = features[[f'month_slot_{s}' for s in range(4)]].values[:, _week_of_month(days.day)]
+    ahead = np.arange(1, horizon + 1)
+
+    amounts = (
+        features['daily_level'].values[:, None]
+        * weekday
+        * month_slot
+        * np.clip(1 + features['trend'].values[:, None] * ahead, 0, None)
+    )
+
+    index = features.index
+    return pd.DataFrame({
+        'user_id': np.repeat(index.get_level_values('user_id'), horizon),
+        'category': np.repeat(index.get_level_values('category'), horizon),
+        'prediction_date': np.tile(days.date, len(index)),
+        'predicted_amount': amounts.ravel().round(2),
+        'confidence_score': np.repeat(features['confidence'].values, horizon),
+        'daily_level': np.repeat(features['daily_level'].values.round(2), horizon),
+        'trend': np.repeat(features['trend'].values.round(5), horizon),
+        'weekday_factor': weekday.ravel().round(3),
+        'month_factor': month_slot.ravel().round(3),
+    })
+
+
+def generate_predictions(user_ids, today=None):
+    """Compute and upsert predictions for a chunk of users; returns the number of rows"""
+    today = today or timezone.now().date()
+    start = today - timedelta(days=HISTORY_DAYS)
+    run_started = timezone.now()
+
+    daily = load_daily_spend(user_ids, start, today)
+    rows = []
+    if not daily.empty:
+        predictions = predict(compute_features(daily, start, today), today)
+        predictions = predictions[predictions['predicted_amount'] >= MIN_DAILY_AMOUNT]
+        rows = [
+            AIExpensePrediction(
+                user_id=row.user_id,
+                category=row.category,
+                prediction_date=row.prediction_date,
+                predicted_amount=row.predicted_amount,
+                confidence_score=row.confidence_score,
+                prediction_type='daily',
+                model_version=MODEL_VERSION,
+                features_used={
+                    'daily_level': row.daily_level,
+                    'trend': row.trend,
+                    'weekday_factor': row.weekday_factor,
+                    'month_factor': row.month_factor,
+                },
+            )
+            for row in predictions.itertuples(index=False)
+        ]
+
+    return store_predictions(user_ids, rows, MODEL_VERSION, today, run_started)
+
+
+def store_predictions(user_ids, rows, model_version, today, run_started):
+    """Upsert one model version's daily predictions for a chunk of users and drop the ones it stopped making"""
+    AIExpensePrediction.objects.bulk_create(
+        rows,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['user', 'category', 'prediction_date', 'model_version'],
+        update_fields=[
+            'predicted_amount', 'confidence_score', 'prediction_type', 'features_used', 'updated_at'
+        ],
+    )
+
+    # Future predictions this run did not refresh (spending stopped) are stale
+    AIExpensePrediction.objects.filter(
+        user_id__in=user_ids,
+        model_version=model_version,
+        prediction_date__gte=today,
+        updated_at__lt=run_started
+    ).delete()
+
+    # bulk_create skips post_save, so invalidate cached predictions here
+    bump_versions_many(user_ids, 'predictions')
+    return len(rows)
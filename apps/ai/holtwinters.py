@@ -0,0 +1,283 @@
+"""
+Per-category Holt-Winters spending forecasts with prediction intervals.
+
+A user's history becomes a dense categories x days spend matrix, and
+additive damped-trend Holt-Winters with weekly seasonality (ETS(A,Ad,A)) is
+run over it for every category and every candidate smoothing parameter set
+at once: each time step is a handful of NumPy operations on
+(parameter sets x categories) arrays. Each category keeps the parameters with
+the lowest one-step-ahead squared error.
+
+The fitted state (parameters, level, trend, seasonal indices, residual
+variance) is cached per user. When new days complete, the state is advanced
+over just those days with the chosen parameters; the parameters are searched
+again when past days changed, new categories appear or the fit gets old.
+Forecasting from a state is closed form, for any horizon.
+
+The nightly prediction run stores the daily forecasts as
+``AIExpensePrediction`` rows under ``MODEL_VERSION``, so they are back-tested
+like the batch seasonal model.
+"""
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.expenses.models import Expense
+from config.cache import CacheNamespace
+from .forecasting import HORIZON_DAYS, MIN_DAILY_AMOUNT, load_daily_spend, store_predictions
+from .models import AIExpensePrediction
+
+MODEL_VERSION = 'holt-winters-v1'
+SEASON = 7
+MAX_HISTORY_DAYS = 5 * 365
+MIN_HISTORY_DAYS = 2 * SEASON
+REFIT_DAYS = 28
+DAMPING = 0.98
+
+ALPHAS = (0.02, 0.05, 0.1, 0.2, 0.3)
+BETAS = (0.0, 0.002, 0.01)
+GAMMAS = (0.02, 0.05, 0.1, 0.2)
+PARAMETER_GRID = np.array([
+    (alpha, beta, gamma) for alpha, beta, gamma in product(ALPHAS, BETAS, GAMMAS) if beta <= alpha
+])
+
+Z_SCORES = {0.8: 1.2816, 0.95: 1.96}
+
+state_cache = CacheNamespace('holt_winters', timeout=60 * 60 * 24 * 7)
+
+
+@dataclass
+class FittedState:
+    """Holt-Winters state of every category of one user, as of the end of ``fitted_through``"""
+    categories: list
+    params: np.ndarray  # (categories, 3): alpha, beta, gamma
+    level: np.ndarray
+    trend: np.ndarray
+    season: np.ndarray  # (categories, 7), indexed by weekday
+    sse: np.ndarray
+    errors: np.ndarray  # Number of one-step errors in ``sse``
+    totals: np.ndarray  # Spend per category up to fitted_through, to detect edits
+    start: date
+    fitted_through: date
+    fitted_at: date = field(default_factory=lambda: timezone.now().date())
+    version: str = MODEL_VERSION
+
+    @property
+    def sigma(self):
+        return np.sqrt(self.sse / np.maximum(self.errors, 1))
+
+
+def _smooth(values, first_weekday, alpha, beta, gamma, level, trend, season, sse, warmup=0):
+    """
+    Run ETS(A,Ad,A) over ``values`` (categories x days), updating the state arrays in place.
+
+    ``alpha``/``beta``/``gamma``/``level``/``trend``/``sse`` broadcast as
+    (sets, categories) and ``season`` as (sets, categories, 7), so one pass
+    evaluates every parameter set for every category.
+    """
+    for t in range(values.shape[1]):
+        weekday = (first_weekday + t) % SEASON
+        damped = DAMPING * trend
+        error = values[:, t] - (level + damped + season[..., weekday])
+        level += damped + alpha * error
+        trend[...] = damped + beta * error
+        season[..., weekday] += gamma * error
+        if t >= warmup:
+            sse += error * error
+
+
+def _initial_state(values, first_weekday):
+    """Level, trend and weekday indices from the first two weeks"""
+    first, second = values[:, :SEASON], values[:, SEASON:2 * SEASON]
+    level = first.mean(axis=1)
+    trend = (second.mean(axis=1) - level) / SEASON
+    # Rotate the first week's deviations so index 0 is Monday
+    season = np.roll(first - level[:, None], first_weekday, axis=1)
+    return level, trend, season
+
+
+def _spend_matrix(user_id, start, end):
+    """(categories, matrix) of daily spend in [start, end)"""
+    daily = load_daily_spend([user_id], start, end)
+    if daily.empty:
+        return [], np.zeros((0, (end - start).days))
+    matrix = daily.pivot_table(
+        index='category', columns='date', values='total', aggfunc='sum', fill_value=0.0
+    ).reindex(columns=pd.date_range(start, end - timedelta(days=1), freq='D'), fill_value=0.0)
+    return list(matrix.index), matrix.values.astype(np.float64)
+
+
+def fit(user_id, today=None):
+    """Search the smoothing parameters of every category and return the fitted state, or None"""
+    today = today or timezone.now().date()
+    first_expense = Expense.objects.filter(
+        user_id=user_id, expense_type='expense'
+    ).order_by('transaction_date').values_list('transaction_date', flat=True).first()
+    if first_expense is None:
+        return None
+
+    start = max(first_expense, today - timedelta(days=MAX_HISTORY_DAYS))
+    if (today - start).days < MIN_HISTORY_DAYS:
+        return None
+
+    # Only complete days are fitted; today is still being spent
+    categories, values = _spend_matrix(user_id, start, today)
+    if not categories:
+        return None
+
+    sets, n_categories = len(PARAMETER_GRID), len(categories)
+    alpha, beta, gamma = (PARAMETER_GRID[:, i, None] for i in range(3))
+    level, trend, season = _initial_state(values, start.weekday())
+    level = np.tile(level, (sets, 1))
+    trend = np.tile(trend, (sets, 1))
+    season = np.tile(season, (sets, 1, 1))
+    sse = np.zeros((sets, n_categories))
+
+    _smooth(values, start.weekday(), alpha, beta, gamma, level, trend, season, sse, warmup=2 * SEASON)
+
+    best = sse.argmin(axis=0)
+    columns = np.arange(n_categories)
+    return FittedState(
+        categories=categories,
+        params=PARAMETER_GRID[best],
+        level=level[best, columns],
+        trend=trend[best, columns],
+        season=season[best, columns],
+        sse=sse[best, columns],
+        errors=np.full(n_categories, max(values.shape[1] - 2 * SEASON, 0)),
+        totals=values.sum(axis=1).round(2),
+        start=start,
+        fitted_through=today - timedelta(days=1),
+    )
+
+
+def advance(state, user_id, today):
+    """Fold the days completed since the state was fitted into it, in place; None if it needs a refit"""
+    start = state.fitted_through + timedelta(days=1)
+    categories, values = _spend_matrix(user_id, start, today)
+    if set(categories) - set(state.categories):
+        return None
+
+    matrix = np.zeros((len(state.categories), values.shape[1]))
+    for row, category in zip(values, categories):
+        matrix[state.categories.index(category)] = row
+
+    alpha, beta, gamma = state.params.T
+    _smooth(matrix, start.weekday(), alpha, beta, gamma, state.level, state.trend, state.season, state.sse)
+    state.errors += matrix.shape[1]
+    state.totals = (state.totals + matrix.sum(axis=1)).round(2)
+    state.fitted_through = today - timedelta(days=1)
+    return state
+
+
+def _history_unchanged(state, user_id):
+    """True when spend up to fitted_through still matches what was fitted (no edits or backdating)"""
+    totals = dict(
+        Expense.objects.filter(
+            user_id=user_id,
+            expense_type='expense',
+            transaction_date__gte=state.start,
+            transaction_date__lte=state.fitted_through
+        ).values_list('category__name').annotate(total=Sum('amount'))
+    )
+    if set(totals) - set(state.categories):
+        return False
+    current = np.array([float(totals.get(category, 0)) for category in state.categories])
+    return np.allclose(current, state.totals, atol=0.01)
+
+
+def get_state(user_id, today=None):
+    """Cached fitted state, advanced to yesterday; refitted when stale"""
+    today = today or timezone.now().date()
+    state = state_cache.get('state', user_id)
+
+    if (
+        state is None
+        or state.version != MODEL_VERSION
+        or (today - state.fitted_at).days >= REFIT_DAYS
+        or not _history_unchanged(state, user_id)
+    ):
+        state = fit(user_id, today)
+    elif state.fitted_through < today - timedelta(days=1):
+        state = advance(state, user_id, today) or fit(user_id, today)
+    else:
+        return state
+
+    if state is not None:
+        state_cache.set('state', user_id, value=state)
+    return state
+
+
+def forecast(state, first_day, horizon, levels=(0.8, 0.95)):
+    """
+    Point forecasts and prediction intervals for ``horizon`` days from ``first_day``.
+
+    Returns ``(mean, std, intervals)``: (categories x days) arrays and
+    ``{level: (lower, upper)}``. Daily spend cannot be negative, so means and
+    lower bounds are clipped at zero.
+    """
+    # Days ahead of the fitted state; the state may be a day or more old
+    ahead = np.arange(1, horizon + 1) + (first_day - state.fitted_through).days - 1
+    weekdays = (first_day.weekday() + np.arange(horizon)) % SEASON
+
+    # The damped trend contributes DAMPING^1 + ... + DAMPING^h times the trend h days ahead
+    trend_factor = np.cumsum(DAMPING ** np.arange(1, ahead[-1] + 1))[ahead - 1]
+    mean = state.level[:, None] + state.trend[:, None] * trend_factor + state.season[:, weekdays]
+
+    # h-step variance of ETS(A,Ad,A): sigma^2 * (1 + c_1^2 + ... + c_{h-1}^2)
+    alpha, beta, gamma = (state.params[:, i, None] for i in range(3))
+    j = np.arange(1, ahead[-1])
+    c = alpha + beta * DAMPING * (1 - DAMPING ** j) / (1 - DAMPING) + gamma * (j % SEASON == 0)
+    cumulative = np.concatenate([np.zeros((len(state.categories), 1)), np.cumsum(c ** 2, axis=1)], axis=1)
+    std = state.sigma[:, None] * np.sqrt(1 + cumulative[:, ahead - 1])
+
+    mean = np.maximum(mean, 0)
+    intervals = {
+        level: (np.maximum(mean - Z_SCORES[level] * std, 0), mean + Z_SCORES[level] * std)
+        for level in levels
+    }
+    return mean, std, intervals
+
+
+def generate_predictions(user_ids, today=None, horizon=HORIZON_DAYS):
+    """Upsert the daily forecasts of a chunk of users as predictions; returns the number of rows"""
+    today = today or timezone.now().date()
+    run_started = timezone.now()
+    days = [today + timedelta(days=offset) for offset in range(horizon)]
+
+    rows = []
+    for user_id in user_ids:
+        state = get_state(user_id, today)
+        if state is None:
+            continue
+        mean, std, intervals = forecast(state, today, horizon, levels=(0.8,))
+        lower, upper = intervals[0.8]
+        for i, category in enumerate(state.categories):
+            for j, day in enumerate(days):
+                amount = round(float(mean[i, j]), 2)
+                if amount < MIN_DAILY_AMOUNT:
+                    continue
+                rows.append(AIExpensePrediction(
+                    user_id=user_id,
+                    category=category,
+                    prediction_date=day,
+                    predicted_amount=amount,
+                    confidence_score=round(amount / (amount + float(std[i, j])), 2),
+                    prediction_type='daily',
+                    model_version=MODEL_VERSION,
+                    features_used={
+                        'std': round(float(std[i, j]), 2),
+                        'lower_80': round(float(lower[i, j]), 2),
+                        'upper_80': round(float(upper[i, j]), 2),
+                        'alpha': float(state.params[i, 0]),
+                        'beta': float(state.params[i, 1]),
+                        'gamma': float(state.params[i, 2]),
+                    },
+                ))
+
+    return store_predictions(user_ids, rows, MODEL_VERSION, today, run_started)
@@ -1,6 +1,5 @@
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.contrib.postgres.fields import JSONField
 
 User = get_user_model()
 
@@ -20,7 +19,7 @@ class AIExpensePrediction(models.Model):
         ('monthly', 'Monthly'),
         ('yearly', 'Yearly')
     ], default='monthly')
-    features_used = JSONField(default=dict)
+    features_used = models.JSONField(default=dict)
     model_version = models.CharField(max_length=20, default='v1.0')
     is_accurate = models.BooleanField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -28,6 +27,12 @@ class AIExpensePrediction(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'category', 'prediction_date', 'model_version'],
+                name='unique_ai_prediction_per_day'
+            ),
+        ]
         indexes = [
             models.Index(fields=['user', 'prediction_date']),
             models.Index(fields=['category', 'prediction_type']),
@@ -48,13 +53,13 @@ class UserSpendingPattern(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     location = models.CharField(max_length=200, blank=True)
     payment_method = models.CharField(max_length=20, blank=True)
-    weather_data = JSONField(default=dict, blank=True)
+    weather_data = models.JSONField(default=dict, blank=True)
     transaction_type = models.CharField(max_length=20, choices=[
         ('expense', 'Expense'),
         ('income', 'Income')
     ], default='expense')
     merchant = models.CharField(max_length=200, blank=True)
-    tags = JSONField(default=list, blank=True)
+    tags = models.JSONField(default=list, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -66,6 +71,36 @@ class UserSpendingPattern(models.Model):
         ]
 
 
+class SpendingCube(models.Model):
+    """Per-user spend by category, day of week and hour, as compressed NumPy arrays"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='spending_cube')
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.email} - spending cube"
+
+
+class SpendingCubeDelta(models.Model):
+    """Change to one cube cell from an expense write, waiting to be folded into the user's SpendingCube"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='spending_cube_deltas')
+    category_id = models.IntegerField()
+    day = models.PositiveSmallIntegerField()
+    hour = models.PositiveSmallIntegerField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    count = models.SmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.category_id} {self.day}/{self.hour}: {self.amount}"
+
+
 class SmartBudgetRecommendation(models.Model):
     """Model for AI-generated budget recommendations"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='budget_recommendations')
@@ -88,8 +123,13 @@ class SmartBudgetRecommendation(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'category'],
+                name='unique_budget_recommendation_per_category'
+            ),
+        ]
         indexes = [
-            models.Index(fields=['user', 'category']),
             models.Index(fields=['risk_level', 'confidence_level']),
         ]
 
@@ -106,7 +146,7 @@ class AnomalyAlert(models.Model):
         ('location', 'Unusual Location'),
         ('category', 'Unusual Category')
     ], default='amount')
-    expected_range = JSONField(default=dict)
+    expected_range = models.JSONField(default=dict)
     actual_amount = models.DecimalField(max_digits=10, decimal_places=2)
     severity = models.CharField(max_length=10, choices=[
         ('low', 'Low'),
@@ -131,9 +171,11 @@ class MLModelVersion(models.Model):
     model_name = models.CharField(max_length=50)
     version = models.CharField(max_length=20)
     accuracy = models.FloatField()
-    precision = models.FloatField()
-    recall = models.FloatField()
-    f1_score = models.FloatField()
+    # Classification metrics; regression models report theirs in ``metrics``
+    precision = models.FloatField(null=True, blank=True)
+    recall = models.FloatField(null=True, blank=True)
+    f1_score = models.FloatField(null=True, blank=True)
+    metrics = models.JSONField(default=dict, blank=True)
     training_data_size = models.IntegerField()
     is_active = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -149,13 +191,33 @@ class MLModelVersion(models.Model):
         return f"{self.model_name} - {self.version}"
 
 
+class CategorySpendingStats(models.Model):
+    """Running amount statistics per user and category for streaming anomaly scoring"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_spending_stats')
+    category = models.ForeignKey('expenses.Category', on_delete=models.CASCADE, related_name='spending_stats')
+    count = models.IntegerField(default=0)
+    mean = models.FloatField(default=0.0)
+    m2 = models.FloatField(default=0.0)  # Sum of squared deviations from the mean
+    median = models.FloatField(default=0.0)
+    mad = models.FloatField(default=0.0)  # Median absolute deviation
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category'], name='unique_spending_stats_per_category'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.category_id} ({self.count} expenses)"
+
+
 class SmartCategoryPrediction(models.Model):
     """Model for AI-powered expense categorization"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='category_predictions')
     expense = models.ForeignKey('expenses.Expense', on_delete=models.CASCADE, related_name='category_predictions')
     predicted_category = models.CharField(max_length=100)
     confidence_score = models.FloatField()
-    alternative_categories = JSONField(default=list)
+    alternative_categories = models.JSONField(default=list)
     is_correct = models.BooleanField(null=True, blank=True)
     feedback_provided = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -166,3 +228,28 @@ class SmartCategoryPrediction(models.Model):
             models.Index(fields=['user', 'predicted_category']),
             models.Index(fields=['confidence_score']),
         ]
+
+
+class UserCategoryModel(models.Model):
+    """Serialized per-user expense categorization model"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='category_model')
+    model_version = models.CharField(max_length=20)
+    model_data = models.BinaryField()
+    training_samples = models.IntegerField(default=0)
+    trained_through = models.BigIntegerField(default=0)  # Highest Expense id learned from
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.email} - {self.model_version} ({self.training_samples} samples)"
+
+
+class AIInsightSnapshot(models.Model):
+    """Precomputed per-user insights the AI chat answers from"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='insight_snapshot')
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.email} - {self.updated_at}"
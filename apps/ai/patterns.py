@@ -0,0 +1,216 @@
+"""
+Per-user spend cube: category x day of week x hour of day.
+
+The cube is dense NumPy arrays of amounts and counts stored compressed in one
+``SpendingCube`` row per user, so the heatmap is a single row read. Expense
+writes only insert ``SpendingCubeDelta`` rows; a debounced task folds all of
+a user's pending deltas into the cube with one decompress/recompress, and the
+heatmap adds the few deltas still pending so it is never behind.
+
+Cube writes (rebuilds and folds) are serialized per user by locking the
+user's row. A rebuild reads the history and the deltas it supersedes in one
+query, so a delta is deleted exactly when its expense is in the history.
+
+Expenses only have a transaction date. The hour comes from when the expense
+was entered if that was on the transaction day; backdated expenses go to an
+extra "untimed" hour slot so they still count in the day-of-week totals.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.db import models, transaction
+from django.utils import timezone
+
+from apps.expenses.models import Category, Expense
+from .models import SpendingCube, SpendingCubeDelta
+
+User = get_user_model()
+
+DAYS = 7
+HOURS = 24
+UNTIMED = HOURS  # Index of the extra slot for expenses without a time
+
+
+def expense_slot(transaction_date, created_at):
+    """(day of week, hour slot) of an expense"""
+    created_at = timezone.localtime(created_at) if created_at else None
+    if created_at and created_at.date() == transaction_date:
+        return transaction_date.weekday(), created_at.hour
+    return transaction_date.weekday(), UNTIMED
+
+
+def dumps(categories, amounts, counts):
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer,
+        categories=np.asarray(categories, dtype=np.int64),
+        amounts=amounts,
+        counts=counts,
+    )
+    return buffer.getvalue()
+
+
+def loads(data):
+    with np.load(io.BytesIO(bytes(data))) as arrays:
+        return arrays['categories'].tolist(), arrays['amounts'], arrays['counts']
+
+
+def _empty(n_categories):
+    shape = (n_categories, DAYS, HOURS + 1)
+    return np.zeros(shape, dtype=np.float64), np.zeros(shape, dtype=np.int32)
+
+
+def _history(user_id):
+    """
+    (expense rows, pending delta ids) of a user from one UNION query.
+
+    One statement reads from one snapshot: a delta committed between two
+    separate reads would be counted in the history and still be pending.
+    """
+    expenses = Expense.objects.filter(user_id=user_id, expense_type='expense').annotate(
+        delta_id=models.Value(None, output_field=models.IntegerField())
+    ).order_by().values_list('category_id', 'transaction_date', 'created_at', 'amount', 'delta_id')
+    deltas = SpendingCubeDelta.objects.filter(user_id=user_id).annotate(
+        delta_category_id=models.F('category_id'),
+        delta_date=models.Value(None, output_field=models.DateField()),
+        delta_created_at=models.Value(None, output_field=models.DateTimeField()),
+        delta_amount=models.Value(None, output_field=models.DecimalField()),
+        delta_id=models.F('id'),
+    ).order_by().values_list('delta_category_id', 'delta_date', 'delta_created_at', 'delta_amount', 'delta_id')
+
+    rows = pd.DataFrame.from_records(
+        list(deltas.union(expenses, all=True)),
+        columns=['category_id', 'transaction_date', 'created_at', 'amount', 'delta_id']
+    )
+    pending = rows['delta_id'].notna()
+    return rows[~pending].drop(columns='delta_id'), rows.loc[pending, 'delta_id'].astype(int).tolist()
+
+
+def build_cube(history):
+    """Cube arrays from a user's expense rows (category_id, transaction_date, created_at, amount)"""
+    categories = sorted(history['category_id'].unique().tolist())
+    amounts, counts = _empty(len(categories))
+    if history.empty:
+        return categories, amounts, counts
+
+    slots = np.array([
+        expense_slot(row.transaction_date, row.created_at)
+        for row in history.itertuples(index=False)
+    ])
+    index = (
+        history['category_id'].map({category: i for i, category in enumerate(categories)}).values,
+        slots[:, 0],
+        slots[:, 1],
+    )
+    np.add.at(amounts, index, history['amount'].astype(float).values)
+    np.add.at(counts, index, 1)
+    return categories, amounts, counts
+
+
+def _lock_user(user_id):
+    """Serialize cube writes of a user until the end of the transaction"""
+    User.objects.select_for_update().filter(pk=user_id).exists()
+
+
+def rebuild_cube(user_id):
+    """Store a freshly built cube for a user, dropping the deltas it already includes"""
+    with transaction.atomic():
+        _lock_user(user_id)
+        history, pending = _history(user_id)
+        cube, _ = SpendingCube.objects.update_or_create(
+            user_id=user_id,
+            defaults={'data': dumps(*build_cube(history))}
+        )
+        SpendingCubeDelta.objects.filter(id__in=pending).delete()
+    return cube
+
+
+def expense_delta(user_id, category_id, transaction_date, created_at, amount, sign=1):
+    """Unsaved delta adding (sign=1) or removing (sign=-1) one expense"""
+    day, hour = expense_slot(transaction_date, created_at)
+    return SpendingCubeDelta(
+        user_id=user_id, category_id=category_id, day=day, hour=hour, amount=sign * amount, count=sign
+    )
+
+
+def _fold(categories, amounts, counts, deltas):
+    """Add (category_id, day, hour, amount, count) deltas to cube arrays, growing them for new categories"""
+    categories = list(categories)
+    new = sorted({category_id for category_id, *_ in deltas} - set(categories))
+    if new:
+        categories.extend(new)
+        extra_amounts, extra_counts = _empty(len(new))
+        amounts = np.concatenate([amounts, extra_amounts])
+        counts = np.concatenate([counts, extra_counts])
+    else:
+        amounts, counts = amounts.copy(), counts.copy()
+
+    if deltas:
+        rows = {category_id: i for i, category_id in enumerate(categories)}
+        index = (
+            np.array([rows[category_id] for category_id, *_ in deltas]),
+            np.array([day for _, day, _, _, _ in deltas]),
+            np.array([hour for _, _, hour, _, _ in deltas]),
+        )
+        np.add.at(amounts, index, np.array([float(amount) for *_, amount, _ in deltas]))
+        np.add.at(counts, index, np.array([count for *_, count in deltas]))
+    return categories, amounts, counts
+
+
+def _pending(user_id):
+    return list(SpendingCubeDelta.objects.filter(user_id=user_id).order_by('id').values_list(
+        'id', 'category_id', 'day', 'hour', 'amount', 'count'
+    ))
+
+
+def apply_deltas(user_id):
+    """Fold a user's pending deltas into their cube; returns the number applied"""
+    with transaction.atomic():
+        _lock_user(user_id)
+        cube = SpendingCube.objects.filter(user_id=user_id).first()
+        if cube is None:
+            # First write for this user: the cube is built from history, which
+            # already includes every committed delta
+            rebuild_cube(user_id)
+            return 0
+
+        pending = _pending(user_id)
+        if not pending:
+            return 0
+        categories, amounts, counts = _fold(*loads(cube.data), [row[1:] for row in pending])
+        cube.data = dumps(categories, amounts, counts)
+        cube.save(update_fields=['data', 'updated_at'])
+        SpendingCubeDelta.objects.filter(id__in=[row[0] for row in pending]).delete()
+    return len(pending)
+
+
+def get_heatmap(user, category=None):
+    """Day x hour spend (and untimed spend per day) for all categories or one category name"""
+    from .tasks import schedule_cube_update
+
+    cube = SpendingCube.objects.filter(user=user).first()
+    if cube is None:
+        # Not built yet: answer empty and let the worker build it from history
+        schedule_cube_update(user.pk)
+        categories, (amounts, counts) = [], _empty(0)
+    else:
+        categories, amounts, counts = _fold(*loads(cube.data), [row[1:] for row in _pending(user.pk)])
+    names = dict(Category.objects.filter(id__in=categories).values_list('id', 'name'))
+
+    if category is not None:
+        selected = [i for i, category_id in enumerate(categories) if names.get(category_id) == category]
+        amounts, counts = amounts[selected], counts[selected]
+
+    total_amounts = amounts.sum(axis=0)
+    total_counts = counts.sum(axis=0)
+    return {
+        'categories': [names.get(category_id) for category_id in categories],
+        'category': category,
+        'amounts': total_amounts[:, :HOURS].round(2).tolist(),
+        'counts': total_counts[:, :HOURS].tolist(),
+        'untimed_amounts': total_amounts[:, UNTIMED].round(2).tolist(),
+        'untimed_counts': total_counts[:, UNTIMED].tolist(),
+        'updated_at': cube.updated_at if cube else None,
+    }
@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import AIExpensePrediction, UserSpendingPattern, SmartBudgetRecommendation, AnomalyAlert
+from .models import (
+    AIExpensePrediction, UserSpendingPattern, SmartBudgetRecommendation, AnomalyAlert, MLModelVersion
+)
 
 
 class AIExpensePredictionSerializer(serializers.ModelSerializer):
@@ -37,6 +39,13 @@ class AnomalyAlertSerializer(serializers.ModelSerializer):
         return ExpenseSerializer(obj.expense).data
 
 
+class MLModelVersionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MLModelVersion
+        fields = '__all__'
+        read_only_fields = ('id', 'created_at')
+
+
 class AIChatRequestSerializer(serializers.Serializer):
     message = serializers.CharField(max_length=1000)
     context = serializers.JSONField(default=dict, required=False)
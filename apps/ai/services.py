@@ -1,11 +1,23 @@
+import logging
 import numpy as np
 from datetime import datetime, timedelta
+from django.conf import settings
 from django.db.models import Sum, Avg, Count
 from django.utils import timezone
 import pandas as pd
 
 from apps.expenses.models import Expense, Category
-from .models import AIExpensePrediction, UserSpendingPattern, SmartBudgetRecommendation, AnomalyAlert
+from apps.users.versioning import version_token
+from config.cache import CacheNamespace
+from . import budgeting, categorizer, forecasting, holtwinters, snapshots
+from .models import (
+    AIExpensePrediction, UserSpendingPattern, SmartBudgetRecommendation, AnomalyAlert,
+    SmartCategoryPrediction, UserCategoryModel, AIInsightSnapshot
+)
+
+logger = logging.getLogger(__name__)
+
+ai_cache = CacheNamespace('ai', timeout=60 * 60)
 
 
 class AIPredictionService:
@@ -16,125 +28,136 @@ class AIPredictionService:
     
     def generate_predictions(self):
         """Generate expense predictions based on historical data"""
-        # Get user's last 3 months of expenses
-        three_months_ago = timezone.now() - timedelta(days=90)
-        expenses = Expense.objects.filter(
+        # Same batch path as the nightly run, for a chunk of one
+        forecasting.generate_predictions([self.user.pk])
+        holtwinters.generate_predictions([self.user.pk])
+        return AIExpensePrediction.objects.filter(
             user=self.user,
-            transaction_date__gte=three_months_ago
-        )
-        
-        if not expenses.exists():
-            return []
-        
-        # Calculate patterns
-        category_spending = expenses.values('category__name').annotate(
-            total=Sum('amount'),
-            avg=Avg('amount'),
-            count=Count('id')
-        )
-        
-        predictions = []
-        
-        for category_data in category_spending:
-            category_name = category_data['category__name']
-            avg_amount = float(category_data['avg'])
-            
-            # Predict next month's spending
-            predicted_amount = avg_amount * 4  # Assuming weekly pattern
-            
-            prediction = AIExpensePrediction.objects.create(
-                user=self.user,
-                category=category_name,
-                predicted_amount=predicted_amount,
-                prediction_date=timezone.now().date() + timedelta(days=30),
-                confidence_score=0.85,
-                features_used={
-                    'avg_amount': avg_amount,
-                    'count': category_data['count'],
-                    'total': float(category_data['total'])
-                }
-            )
-            predictions.append(prediction)
-        
-        return predictions
+            model_version=holtwinters.MODEL_VERSION,
+            prediction_date__gte=timezone.now().date()
+        ).order_by('prediction_date', 'category')
     
     def get_spending_forecast(self, days=30):
         """Get spending forecast for the next N days"""
-        predictions = AIExpensePrediction.objects.filter(
-            user=self.user,
-            prediction_date__gte=timezone.now().date(),
-            prediction_date__lte=timezone.now().date() + timedelta(days=days)
+        return ai_cache.get_or_compute(
+            ('forecast', self.user.pk, days, timezone.now().date(), version_token(self.user.pk, 'expenses')),
+            lambda: self._compute_spending_forecast(days)
         )
+
+    def _compute_spending_forecast(self, days, level=0.8):
+        today = timezone.now().date()
+        state = holtwinters.get_state(self.user.pk, today)
+        if state is None:
+            return {
+                'total_forecast': 0.0,
+                'interval': {'level': level, 'lower': 0.0, 'upper': 0.0},
+                'predictions': [],
+                'period': days,
+                'model_version': holtwinters.MODEL_VERSION
+            }
+        
+        mean, std, intervals = holtwinters.forecast(state, today, days, levels=(level,))
         
-        total_forecast = predictions.aggregate(
-            total=Sum('predicted_amount')
-        )['total'] or 0
+        # Totals over the period, treating daily errors as independent
+        totals = mean.sum(axis=1)
+        totals_std = np.sqrt((std ** 2).sum(axis=1))
+        z = holtwinters.Z_SCORES[level]
+        total = totals.sum()
+        total_std = np.sqrt((totals_std ** 2).sum())
+        
+        predictions = [
+            {
+                'category': category,
+                'predicted_amount': round(float(amount), 2),
+                'lower': round(float(max(amount - z * spread, 0)), 2),
+                'upper': round(float(amount + z * spread), 2),
+                'confidence_score': round(float(amount / (amount + spread)) if amount > 0 else 0.0, 2),
+                'daily': [round(float(value), 2) for value in daily]
+            }
+            for category, amount, spread, daily in zip(state.categories, totals, totals_std, mean)
+        ]
+        predictions.sort(key=lambda prediction: prediction['predicted_amount'], reverse=True)
         
         return {
-            'total_forecast': float(total_forecast),
-            'predictions': list(predictions.values()),
-            'period': days
+            'total_forecast': round(float(total), 2),
+            'interval': {
+                'level': level,
+                'lower': round(float(max(total - z * total_std, 0)), 2),
+                'upper': round(float(total + z * total_std), 2)
+            },
+            'predictions': predictions,
+            'period': days,
+            'model_version': holtwinters.MODEL_VERSION
         }
 
 
 class AIChatService:
     """Service for AI chat functionality"""
     
+    HELP_RESPONSE = {
+        'response': "I can help you with spending analysis, budget recommendations, anomaly detection, and spending predictions. What would you like to know?",
+        'action': 'help',
+        'data': {}
+    }
+    
     def __init__(self, user):
         self.user = user
     
     def process_message(self, message, context=None):
         """Process user message and return AI response"""
         context = context or {}
+        intent = self._classify(message)
+        if intent is None:
+            return self.HELP_RESPONSE
         
+        # Answers only change when the snapshot is rebuilt, which bumps 'assistant'
+        return ai_cache.get_or_compute(
+            ('chat', self.user.pk, intent, snapshots.current_month(), version_token(self.user.pk, 'assistant')),
+            lambda: getattr(self, f'_handle_{intent}')(self._get_snapshot())
+        )
+    
+    def _classify(self, message):
         # Simple NLP processing (in production, use proper NLP library)
         message_lower = message.lower()
         
         if 'spending' in message_lower and 'this month' in message_lower:
-            return self._handle_spending_query()
+            return 'spending_query'
         elif 'budget' in message_lower and 'recommend' in message_lower:
-            return self._handle_budget_recommendation()
+            return 'budget_recommendation'
         elif 'anomaly' in message_lower or 'unusual' in message_lower:
-            return self._handle_anomaly_detection()
+            return 'anomaly_detection'
         elif 'predict' in message_lower or 'forecast' in message_lower:
-            return self._handle_prediction_query()
-        else:
-            return {
-                'response': "I can help you with spending analysis, budget recommendations, anomaly detection, and spending predictions. What would you like to know?",
-                'action': 'help',
-                'data': {}
-            }
+            return 'prediction_query'
+        return None
     
-    def _handle_spending_query(self):
-        """Handle spending-related queries"""
-        current_month = timezone.now().month
-        current_year = timezone.now().year
+    def _get_snapshot(self):
+        """Stored insight snapshot; built in memory (without writes) when missing or from last month"""
+        from .tasks import schedule_snapshot_refresh
         
-        expenses = Expense.objects.filter(
-            user=self.user,
-            transaction_date__month=current_month,
-            transaction_date__year=current_year
-        )
+        snapshot = AIInsightSnapshot.objects.filter(user=self.user).values_list('data', flat=True).first()
+        if snapshot and snapshot.get('month') == snapshots.current_month().isoformat():
+            return snapshot
         
-        total_spent = expenses.aggregate(total=Sum('amount'))['total'] or 0
+        schedule_snapshot_refresh(self.user.pk)
+        return snapshots.build_snapshot(self.user)
+    
+    def _handle_spending_query(self, snapshot):
+        """Handle spending-related queries"""
+        spending = snapshot['spending']
         
-        category_breakdown = expenses.values('category__name').annotate(
-            total=Sum('amount')
-        ).order_by('-total')[:5]
+        top_categories = ', '.join(
+            f"{c['category__name']}: ${c['total']:.2f}" for c in spending['category_breakdown']
+        )
         
         return {
-            'response': f"You've spent ${total_spent:.2f} this month. Your top categories are: {', '.join([f'{c['category__name']}: ${c['total']:.2f}' for c in category_breakdown])}",
+            'response': f"You've spent ${spending['total_spent']:.2f} this month. Your top categories are: {top_categories}",
             'action': 'spending_summary',
-            'data': {
-                'total_spent': float(total_spent),
-                'category_breakdown': list(category_breakdown)
-            }
+            'data': spending
         }
     
-    def _handle_budget_recommendation(self):
+    def _handle_budget_recommendation(self, snapshot):
         """Handle budget recommendation requests"""
-        service = AIInsightsService(self.user)
-        recommendations = service.generate_budget_recommendations()
+        recommendations = snapshot['recommendations']
         
         return {
             'response': f"I've analyzed your spending patterns and have {len(recommendations)} budget recommendations for you.",
@@ -142,10 +165,9 @@ class AIChatService:
             'data': {'recommendations': recommendations}
         }
     
-    def _handle_anomaly_detection(self):
+    def _handle_anomaly_detection(self, snapshot):
         """Handle anomaly detection requests"""
-        service = AIInsightsService(self.user)
-        anomalies = service.detect_anomalies()
+        anomalies = snapshot['anomalies']
         
         if anomalies:
             return {
@@ -160,10 +182,9 @@ class AIChatService:
                 'data': {}
             }
     
-    def _handle_prediction_query(self):
+    def _handle_prediction_query(self, snapshot):
         """Handle prediction-related queries"""
-        service = AIPredictionService(self.user)
-        forecast = service.get_spending_forecast()
+        forecast = snapshot['forecast']
         
         return {
             'response': f"Based on your spending patterns, I predict you'll spend approximately ${forecast['total_forecast']:.2f} in the next 30 days.",
@@ -227,72 +248,176 @@ class AIInsightsService:
     
     def generate_budget_recommendations(self):
         """Generate smart budget recommendations"""
-        # Get user's spending patterns
-        three_months_ago = timezone.now() - timedelta(days=90)
-        expenses = Expense.objects.filter(
-            user=self.user,
-            transaction_date__gte=three_months_ago
+        # Recomputed only when expenses change or a new month starts
+        ai_cache.get_or_compute(
+            ('budget_recommendations', self.user.pk, timezone.now().date().replace(day=1),
+             version_token(self.user.pk, 'expenses')),
+            lambda: budgeting.generate_recommendations([self.user.pk])
         )
-        
-        recommendations = []
-        
-        for category in Category.objects.all():
-            category_expenses = expenses.filter(category=category)
-            if category_expenses.exists():
-                avg_monthly = category_expenses.aggregate(
-                    avg=Avg('amount')
-                )['avg'] or 0
-                
-                # Calculate recommended budget (20% buffer)
-                recommended = avg_monthly * 4 * 1.2
-                
-                recommendation = SmartBudgetRecommendation.objects.create(
-                    user=self.user,
-                    category=category.name,
-                    recommended_amount=recommended,
-                    current_spending=avg_monthly * 4,
-                    reasoning=f"Based on your average monthly spending of ${avg_monthly * 4:.2f} in {category.name}",
-                    confidence_level=0.85
-                )
-                recommendations.append(recommendation)
-        
-        return recommendations
+        return SmartBudgetRecommendation.objects.filter(user=self.user).order_by('-recommended_amount')
     
     def detect_anomalies(self):
         """Detect unusual spending patterns"""
         # Get last 30 days of expenses
         thirty_days_ago = timezone.now() - timedelta(days=30)
-        expenses = Expense.objects.filter(
-            user=self.user,
-            transaction_date__gte=thirty_days_ago
+        expenses = pd.DataFrame.from_records(
+            list(Expense.objects.filter(
+                user=self.user,
+                transaction_date__gte=thirty_days_ago
+            ).values_list('id', 'category_id', 'amount')),
+            columns=['id', 'category_id', 'amount']
         )
+        if expenses.empty:
+            return []
+        
+        # z-score of each expense against the other expenses of its category
+        amounts = expenses['amount'].astype(float)
+        grouped = amounts.groupby(expenses['category_id'].fillna(-1))
+        others = grouped.transform('count') - 1
+        mean = (grouped.transform('sum') - amounts) / others.where(others > 0)
+        variance = (grouped.transform(lambda a: (a ** 2).sum()) - amounts ** 2) / others.where(others > 0) - mean ** 2
+        std = np.sqrt(variance.clip(lower=0))
+        z_score = ((amounts - mean).abs() / std.where(std > 1e-9)).fillna(0)
         
-        anomalies = []
+        # More than 2 standard deviations, and not alerted on before
+        flagged = expenses.assign(z_score=z_score, mean=mean, std=std)[z_score > 2]
+        alerted = set(AnomalyAlert.objects.filter(
+            expense_id__in=flagged['id'].tolist()
+        ).values_list('expense_id', flat=True))
         
-        for expense in expenses:
-            # Calculate z-score for this expense
-            category_expenses = Expense.objects.filter(
+        return AnomalyAlert.objects.bulk_create([
+            AnomalyAlert(
                 user=self.user,
-                category=expense.category,
-                transaction_date__gte=thirty_days_ago
-            ).exclude(id=expense.id)
+                expense_id=row.id,
+                anomaly_score=float(row.z_score),
+                expected_range={'min': float(row.mean - 2*row.std), 'max': float(row.mean + 2*row.std)},
+                actual_amount=row.amount
+            )
+            for row in flagged.itertuples(index=False) if row.id not in alerted
+        ])
+
+
+class CategoryPredictionService:
+    """Service for per-user expense categorization"""
+    
+    TRAINING_CHUNK_SIZE = 2000
+    
+    def __init__(self, user):
+        self.user = user
+    
+    def _load_model(self):
+        """Return the user's model from the LRU or the database, or None if untrained"""
+        model = categorizer.model_cache.get(self.user.pk)
+        if model is None:
+            stored = UserCategoryModel.objects.filter(
+                user=self.user,
+                model_version=categorizer.MODEL_VERSION
+            ).values_list('model_data', flat=True).first()
+            # Cache "no model" too, so untrained users cost no query per expense
+            model = categorizer.CategoryModel.loads(stored) if stored else False
+            categorizer.model_cache.put(self.user.pk, model)
+        return model or None
+    
+    def predict(self, title, merchant='', amount=None):
+        """Return {'category_id', 'confidence', 'alternatives'} or None"""
+        model = self._load_model()
+        if model is None:
+            return None
+        
+        ranked = model.predict(categorizer.expense_text(title, merchant, amount))
+        if not ranked:
+            return None
+        
+        category_id, confidence = ranked[0]
+        return {
+            'category_id': category_id,
+            'confidence': confidence,
+            'alternatives': [
+                {'category_id': alternative_id, 'confidence': score}
+                for alternative_id, score in ranked[1:]
+            ]
+        }
+    
+    def suggest_category(self, title, merchant='', amount=None):
+        """Return (Category, prediction) for a confident prediction, else (None, prediction)"""
+        prediction = self.predict(title, merchant, amount)
+        if prediction and prediction['confidence'] >= settings.CATEGORY_MODEL_MIN_CONFIDENCE:
+            category = Category.objects.filter(id=prediction['category_id'], is_active=True).first()
+            return category, prediction
+        return None, prediction
+    
+    def record_prediction(self, expense, prediction, assigned=False):
+        """
+        Store a prediction for an expense. Predictions made alongside a
+        user-chosen category are scored right away; assigned ones are scored
+        when the user keeps or changes the category.
+        """
+        if prediction is None:
+            return None
+        
+        ids = [prediction['category_id']] + [a['category_id'] for a in prediction['alternatives']]
+        names = dict(Category.objects.filter(id__in=ids).values_list('id', 'name'))
+        
+        return SmartCategoryPrediction.objects.create(
+            user=self.user,
+            expense=expense,
+            predicted_category=names.get(prediction['category_id'], ''),
+            confidence_score=prediction['confidence'],
+            alternative_categories=[
+                {'category': names.get(a['category_id'], ''), 'confidence': a['confidence']}
+                for a in prediction['alternatives']
+            ],
+            is_correct=None if assigned else prediction['category_id'] == expense.category_id,
+            feedback_provided=not assigned
+        )
+    
+    def record_feedback(self, expense):
+        """Score the expense's predictions against the category the user settled on"""
+        predictions = SmartCategoryPrediction.objects.filter(expense=expense)
+        category_name = expense.category.name
+        predictions.filter(predicted_category=category_name).update(is_correct=True, feedback_provided=True)
+        predictions.exclude(predicted_category=category_name).update(is_correct=False, feedback_provided=True)
+    
+    def train(self):
+        """Add the user's expenses since the last run to their model"""
+        stored = UserCategoryModel.objects.filter(user=self.user).first()
+        
+        model, trained_through = None, 0
+        if stored and stored.model_version == categorizer.MODEL_VERSION:
+            model = categorizer.CategoryModel.loads(stored.model_data)
+            trained_through = stored.trained_through
+        
+        expenses = Expense.objects.filter(
+            user=self.user,
+            expense_type='expense'
+        ).order_by('id')
+        
+        learned = 0
+        while True:
+            rows = list(expenses.filter(id__gt=trained_through).values_list(
+                'id', 'title', 'location', 'amount', 'category_id'
+            )[:self.TRAINING_CHUNK_SIZE])
+            if not rows:
+                break
             
-            if category_expenses.exists():
-                amounts = list(category_expenses.values_list('amount', flat=True))
-                mean = np.mean(amounts)
-                std = np.std(amounts)
-                
-                if std > 0:
-                    z_score = abs((float(expense.amount) - mean) / std)
-                    
-                    if z_score > 2:  # More than 2 standard deviations
-                        anomaly = AnomalyAlert.objects.create(
-                            user=self.user,
-                            expense=expense,
-                            anomaly_score=z_score,
-                            expected_range={'min': float(mean - 2*std), 'max': float(mean + 2*std)},
-                            actual_amount=expense.amount
-                        )
-                        anomalies.append(anomaly)
-        
-        return anomalies
+            texts = [categorizer.expense_text(title, location, amount) for _, title, location, amount, _ in rows]
+            labels = [category_id for *_, category_id in rows]
+            model = model or categorizer.CategoryModel()
+            model.add_counts(*categorizer.count_samples(texts, labels))
+            trained_through = rows[-1][0]
+            learned += len(rows)
+        
+        if model is None or not learned:
+            return stored
+        
+        stored, _ = UserCategoryModel.objects.update_or_create(
+            user=self.user,
+            defaults={
+                'model_version': categorizer.MODEL_VERSION,
+                'model_data': model.dumps(),
+                'training_samples': model.sample_count,
+                'trained_through': trained_through,
+            }
+        )
+        categorizer.model_cache.put(self.user.pk, model)
+        return stored
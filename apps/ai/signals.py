@@ -0,0 +1,92 @@
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from apps.expenses.models import Expense
+from apps.users.versioning import bump_versions
+from . import anomalies, patterns
+from .models import AIExpensePrediction, SpendingCubeDelta
+from .tasks import schedule_category_training, schedule_cube_update, schedule_snapshot_refresh
+
+
+@receiver([post_save, post_delete], sender=AIExpensePrediction)
+def bump_prediction_version(sender, instance, **kwargs):
+    """Invalidate cached forecasts for the owner"""
+    bump_versions(instance.user_id, 'predictions')
+
+
+@receiver(post_save, sender=Expense)
+def score_expense_anomaly(sender, instance, created, **kwargs):
+    """Score new expenses against the owner's running category statistics"""
+    if created and instance.expense_type == 'expense':
+        anomalies.score_expense(instance)
+
+
+@receiver(post_save, sender=Expense)
+def learn_expense_category(sender, instance, created, **kwargs):
+    """Teach the owner's categorizer about new expenses"""
+    if created and instance.expense_type == 'expense':
+        schedule_category_training(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Expense)
+def refresh_insight_snapshot(sender, instance, **kwargs):
+    """Rebuild the owner's chat insights shortly after expenses change"""
+    schedule_snapshot_refresh(instance.user_id)
+
+
+CUBE_FIELDS = ('user_id', 'category_id', 'expense_type', 'transaction_date', 'created_at', 'amount')
+
+
+def _cube_values(instance):
+    """Loaded cube fields of an expense; deferred ones are missing"""
+    return {field: instance.__dict__[field] for field in CUBE_FIELDS if field in instance.__dict__}
+
+
+@receiver(post_init, sender=Expense)
+def remember_cube_slot(sender, instance, **kwargs):
+    """Keep the loaded values of an expense to move it within the cube when it is saved"""
+    values = _cube_values(instance)
+    if instance.pk and len(values) == len(CUBE_FIELDS):
+        instance._cube_previous = values
+
+
+@receiver(pre_save, sender=Expense)
+def load_cube_slot(sender, instance, **kwargs):
+    """Read the stored version of expenses saved without loaded values (deferred fields, set primary key)"""
+    if instance.pk and not hasattr(instance, '_cube_previous'):
+        instance._cube_previous = Expense.objects.filter(pk=instance.pk).values(*CUBE_FIELDS).first()
+
+
+def _cube_delta(values, sign=1):
+    return patterns.expense_delta(
+        values['user_id'], values['category_id'], values['transaction_date'],
+        values['created_at'], values['amount'], sign=sign
+    )
+
+
+@receiver(post_save, sender=Expense)
+def update_spending_cube(sender, instance, created, **kwargs):
+    """Record new expenses for the owner's spend cube, and moves of edited ones"""
+    previous = None if created else getattr(instance, '_cube_previous', None)
+    # Deferred fields are not saved, so they keep their stored values
+    current = {**(previous or {}), **_cube_values(instance)}
+    instance._cube_previous = current
+    if previous == current:
+        return
+
+    deltas = []
+    if previous and previous['expense_type'] == 'expense':
+        deltas.append(_cube_delta(previous, sign=-1))
+    if current['expense_type'] == 'expense':
+        deltas.append(_cube_delta(current))
+    if deltas:
+        SpendingCubeDelta.objects.bulk_create(deltas)
+        for user_id in {delta.user_id for delta in deltas}:
+            schedule_cube_update(user_id)
+
+
+@receiver(post_delete, sender=Expense)
+def remove_from_spending_cube(sender, instance, **kwargs):
+    if instance.expense_type == 'expense':
+        _cube_delta(_cube_values(instance), sign=-1).save()
+        schedule_cube_update(instance.user_id)
@@ -0,0 +1,122 @@
+"""
+Per-user insight snapshots for the AI chat.
+
+A snapshot holds everything the chat intents answer from: this month's
+spending summary, the spending forecast, open anomaly alerts and budget
+recommendations. Building one only reads; the writes (recommendations,
+anomaly alerts) happen in ``refresh_snapshots``, which runs in the
+background after expenses change and after the nightly prediction run.
+
+Saving snapshots bumps the 'assistant' data version, which is what cached
+chat responses are keyed on.
+"""
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.expenses.models import Expense
+from apps.users.versioning import bump_versions_many
+from . import budgeting
+from .models import AIInsightSnapshot, AnomalyAlert, SmartBudgetRecommendation
+
+TOP_CATEGORIES = 5
+ANOMALY_DAYS = 30
+MAX_ANOMALIES = 10
+MAX_RECOMMENDATIONS = 10
+
+
+def current_month():
+    return timezone.now().date().replace(day=1)
+
+
+def _spending_summary(user, month):
+    breakdown = list(
+        Expense.objects.filter(
+            user=user,
+            expense_type='expense',
+            transaction_date__gte=month
+        ).values('category__name').annotate(total=Sum('amount')).order_by('-total')
+    )
+    return {
+        'total_spent': float(sum(row['total'] for row in breakdown)),
+        'category_breakdown': [
+            {'category__name': row['category__name'], 'total': float(row['total'])}
+            for row in breakdown[:TOP_CATEGORIES]
+        ],
+    }
+
+
+def _anomalies(user):
+    alerts = AnomalyAlert.objects.filter(
+        user=user,
+        is_investigated=False,
+        created_at__gte=timezone.now() - timedelta(days=ANOMALY_DAYS)
+    ).order_by('-anomaly_score')[:MAX_ANOMALIES]
+    return [
+        {
+            'id': alert.id,
+            'expense': alert.expense_id,
+            'anomaly_score': alert.anomaly_score,
+            'expected_range': alert.expected_range,
+            'actual_amount': float(alert.actual_amount),
+            'severity': alert.severity,
+            'created_at': alert.created_at.isoformat(),
+        }
+        for alert in alerts
+    ]
+
+
+def _recommendations(user):
+    return [
+        {
+            'id': row['id'],
+            'category': row['category'],
+            'recommended_amount': float(row['recommended_amount']),
+            'current_spending': float(row['current_spending']),
+            'risk_level': row['risk_level'],
+            'reasoning': row['reasoning'],
+        }
+        for row in SmartBudgetRecommendation.objects.filter(user=user).order_by(
+            '-recommended_amount'
+        ).values(
+            'id', 'category', 'recommended_amount', 'current_spending', 'risk_level', 'reasoning'
+        )[:MAX_RECOMMENDATIONS]
+    ]
+
+
+def build_snapshot(user):
+    """Snapshot data for one user; reads only"""
+    from .services import AIPredictionService
+
+    month = current_month()
+    return {
+        'month': month.isoformat(),
+        'spending': _spending_summary(user, month),
+        'forecast': AIPredictionService(user).get_spending_forecast(),
+        'anomalies': _anomalies(user),
+        'recommendations': _recommendations(user),
+    }
+
+
+def refresh_snapshots(users):
+    """Update the stored insights of the given users and rebuild their snapshots"""
+    from .services import AIInsightsService
+
+    user_ids = [user.pk for user in users]
+    budgeting.generate_recommendations(user_ids)
+
+    snapshots = []
+    for user in users:
+        AIInsightsService(user).detect_anomalies()
+        snapshots.append(AIInsightSnapshot(user=user, data=build_snapshot(user)))
+
+    AIInsightSnapshot.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['data', 'updated_at'],
+    )
+    # bulk_create skips post_save, so invalidate cached chat answers here
+    bump_versions_many(user_ids, 'assistant')
+    return len(snapshots)
@@ -0,0 +1,157 @@
+import logging
+from datetime import timedelta
+
+from celery import group, shared_task
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+
+from apps.expenses.models import Expense
+from . import anomalies, backtesting, categorizer, forecasting, holtwinters, patterns, snapshots
+from .models import MLModelVersion, SmartCategoryPrediction, UserCategoryModel
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+def schedule_category_training(user_id):
+    """Queue one delayed training run per user, however many expenses arrive meanwhile"""
+    delay = settings.CATEGORY_MODEL_TRAIN_DELAY
+
+    def _schedule():
+        if cache.add(f'category_model_training:{user_id}', 1, delay):
+            train_category_model.apply_async((user_id,), countdown=delay)
+
+    transaction.on_commit(_schedule)
+
+
+def schedule_snapshot_refresh(user_id):
+    """Queue one delayed insight snapshot refresh per user, debounced like training"""
+    delay = settings.AI_SNAPSHOT_REFRESH_DELAY
+
+    def _schedule():
+        if cache.add(f'insight_snapshot_refresh:{user_id}', 1, delay):
+            refresh_insight_snapshots.apply_async(([user_id],), countdown=delay)
+
+    transaction.on_commit(_schedule)
+
+
+def schedule_cube_update(user_id):
+    """Queue one delayed fold of a user's spend cube deltas, debounced like training"""
+    delay = settings.SPENDING_CUBE_UPDATE_DELAY
+
+    def _schedule():
+        if cache.add(f'spending_cube_update:{user_id}', 1, delay):
+            apply_spending_cube_deltas.apply_async((user_id,), countdown=delay)
+
+    transaction.on_commit(_schedule)
+
+
+@shared_task
+def refresh_insight_snapshots(user_ids):
+    """Rebuild the chat insight snapshots of a chunk of users"""
+    return snapshots.refresh_snapshots(list(User.objects.filter(id__in=user_ids)))
+
+
+@shared_task
+def train_category_model(user_id):
+    """Incrementally train a user's expense categorizer"""
+    from .services import CategoryPredictionService
+
+    user = User.objects.filter(id=user_id).first()
+    if user is None:
+        return 0
+
+    stored = CategoryPredictionService(user).train()
+    return stored.training_samples if stored else 0
+
+
+@shared_task
+def record_category_model_metrics(days=30):
+    """Record accuracy of the categorizer from user feedback in MLModelVersion"""
+    scored = SmartCategoryPrediction.objects.filter(
+        feedback_provided=True,
+        created_at__gte=timezone.now() - timedelta(days=days)
+    ).values_list('predicted_category', 'expense__category__name')
+
+    pairs = list(scored)
+    if not pairs:
+        return None
+
+    predicted, actual = zip(*pairs)
+    precision, recall, f1_score, _ = precision_recall_fscore_support(
+        actual, predicted, average='macro', zero_division=0
+    )
+    training_data_size = UserCategoryModel.objects.filter(
+        model_version=categorizer.MODEL_VERSION
+    ).aggregate(total=Sum('training_samples'))['total'] or 0
+
+    version, _ = MLModelVersion.objects.update_or_create(
+        model_name=categorizer.MODEL_NAME,
+        version=categorizer.MODEL_VERSION,
+        defaults={
+            'accuracy': accuracy_score(actual, predicted),
+            'precision': precision,
+            'recall': recall,
+            'f1_score': f1_score,
+            'training_data_size': training_data_size,
+            'is_active': True,
+        }
+    )
+    return version.accuracy
+
+
+@shared_task
+def generate_predictions_chunk(user_ids):
+    """Compute and upsert spending predictions of every model for a chunk of users"""
+    count = forecasting.generate_predictions(user_ids) + holtwinters.generate_predictions(user_ids)
+    # Forecasts changed, and this also rolls the snapshots over each day
+    refresh_insight_snapshots.delay(user_ids)
+    return count
+
+
+@shared_task
+def generate_all_predictions():
+    """Fan the nightly prediction run out over workers in chunks of users"""
+    since = timezone.now().date() - timedelta(days=forecasting.HISTORY_DAYS)
+    user_ids = list(
+        Expense.objects.filter(transaction_date__gte=since)
+        .values_list('user_id', flat=True)
+        .distinct()
+        .order_by('user_id')
+    )
+    chunk_size = settings.PREDICTION_CHUNK_SIZE
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    group(generate_predictions_chunk.s(chunk) for chunk in chunks).apply_async()
+    return len(chunks)
+
+
+@shared_task
+def backtest_predictions():
+    """Score matured predictions against actual spend and record per-version metrics"""
+    result = backtesting.run_backtest()
+    logger.info('Back-tested %s predictions for %s', result['scored'], result['model_versions'])
+    return result
+
+
+@shared_task
+def rebuild_category_spending_stats(user_ids):
+    """Seed streaming anomaly statistics from history, e.g. for users who predate them"""
+    return anomalies.rebuild_stats(user_ids)
+
+
+@shared_task
+def rebuild_spending_cube(user_id):
+    """Rebuild a user's spend cube from history, e.g. after bulk imports that skip signals"""
+    return patterns.rebuild_cube(user_id).pk
+
+
+@shared_task
+def apply_spending_cube_deltas(user_id):
+    """Fold the expense writes recorded since the last run into a user's spend cube"""
+    return patterns.apply_deltas(user_id)
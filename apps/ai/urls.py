@@ -5,6 +5,7 @@ from .views import (
     UserSpendingPatternViewSet,
     SmartBudgetRecommendationViewSet,
     AnomalyAlertViewSet,
+    MLModelVersionViewSet,
     AIChatViewSet
 )
 
@@ -13,6 +14,7 @@ router.register(r'predictions', AIExpensePredictionViewSet, basename='ai-predict
 router.register(r'spending-patterns', UserSpendingPatternViewSet, basename='spending-patterns')
 router.register(r'budget-recommendations', SmartBudgetRecommendationViewSet, basename='budget-recommendations')
 router.register(r'anomaly-alerts', AnomalyAlertViewSet, basename='anomaly-alerts')
+router.register(r'model-versions', MLModelVersionViewSet, basename='model-versions')
 router.register(r'chat', AIChatViewSet, basename='ai-chat')
 
 urlpatterns = [
@@ -1,19 +1,26 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.db.models import Sum, Avg, Count
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from datetime import timedelta
 
-from .models import AIExpensePrediction, UserSpendingPattern, SmartBudgetRecommendation, AnomalyAlert
+from apps.expenses.models import Expense
+from apps.users.versioning import data_version_condition
+
+from .models import (
+    AIExpensePrediction, UserSpendingPattern, SmartBudgetRecommendation, AnomalyAlert, MLModelVersion
+)
 from .serializers import (
     AIExpensePredictionSerializer, 
     UserSpendingPatternSerializer,
     SmartBudgetRecommendationSerializer,
     AnomalyAlertSerializer,
+    MLModelVersionSerializer,
     AIChatRequestSerializer,
     AIChatResponseSerializer
 )
@@ -35,6 +42,7 @@ class AIExpensePredictionViewSet(viewsets.ModelViewSet):
         return AIExpensePrediction.objects.filter(user=self.request.user)
 
     @action(detail=False, methods=['get'])
+    @method_decorator(data_version_condition('predictions'))
     def upcoming_predictions(self, request):
         """Get upcoming expense predictions for the next 7 days"""
         predictions = self.get_queryset().filter(
@@ -45,6 +53,24 @@ class AIExpensePredictionViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(predictions, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def forecast(self, request):
+        """Get a per-category spending forecast with prediction intervals"""
+        from .services import AIPredictionService
+        
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= 365:
+            return Response(
+                {'error': 'days must be between 1 and 365'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        service = AIPredictionService(request.user)
+        return Response(service.get_spending_forecast(days))
+
     @action(detail=False, methods=['post'])
     def generate_predictions(self, request):
         """Generate AI predictions for user's spending patterns"""
@@ -57,7 +83,7 @@ class AIExpensePredictionViewSet(viewsets.ModelViewSet):
         
         return Response({
             'message': 'Predictions generated successfully',
-            'predictions': predictions
+            'predictions': AIExpensePredictionSerializer(predictions, many=True).data
         })
 
 
@@ -78,16 +104,25 @@ class UserSpendingPatternViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def weekly_patterns(self, request):
         """Get spending patterns for the current week"""
-        patterns = self.get_queryset().filter(
-            created_at__gte=timezone.now() - timedelta(days=7)
-        ).values('category').annotate(
+        patterns = Expense.objects.filter(
+            user=request.user,
+            expense_type='expense',
+            transaction_date__gt=timezone.now().date() - timedelta(days=7)
+        ).values('category__name').annotate(
             total_amount=Sum('amount'),
             count=Count('id'),
             avg_amount=Avg('amount')
-        )
+        ).order_by('-total_amount')
         
         return Response(patterns)
 
+    @action(detail=False, methods=['get'])
+    def heatmap(self, request):
+        """Get spending by day of week and hour, optionally for one category"""
+        from .patterns import get_heatmap
+        
+        return Response(get_heatmap(request.user, request.query_params.get('category')))
+
 
 class SmartBudgetRecommendationViewSet(viewsets.ModelViewSet):
     """
@@ -110,6 +145,19 @@ class SmartBudgetRecommendationViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(recommendations, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def generate_recommendations(self, request):
+        """Refresh budget recommendations from the user's monthly spending"""
+        from .services import AIInsightsService
+        
+        service = AIInsightsService(request.user)
+        recommendations = service.generate_budget_recommendations()
+        
+        return Response({
+            'message': 'Recommendations generated successfully',
+            'recommendations': self.get_serializer(recommendations, many=True).data
+        })
+
     @action(detail=True, methods=['post'])
     def accept_recommendation(self, request, pk=None):
         """Accept a budget recommendation"""
@@ -160,6 +208,35 @@ class AnomalyAlertViewSet(viewsets.ModelViewSet):
         })
 
 
+class MLModelVersionViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for model versions and their back-tested accuracy
+    """
+    queryset = MLModelVersion.objects.all()
+    serializer_class = MLModelVersionSerializer
+    permission_classes = [IsAdminUser]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['model_name', 'version', 'is_active']
+    ordering_fields = ['accuracy', 'created_at']
+
+    @action(detail=False, methods=['get'])
+    def compare(self, request):
+        """Compare the versions of one model side by side, most accurate first"""
+        model_name = request.query_params.get('model_name', 'spending_forecast')
+        versions = self.get_queryset().filter(model_name=model_name).order_by('-accuracy')
+
+        return Response([
+            {
+                'version': version.version,
+                'accuracy': version.accuracy,
+                'is_active': version.is_active,
+                'samples': version.training_data_size,
+                **version.metrics.get('overall', {}),
+            }
+            for version in versions
+        ])
+
+
 class AIChatViewSet(viewsets.ViewSet):
     """
     ViewSet for AI chat functionality
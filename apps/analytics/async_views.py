@@ -0,0 +1,45 @@
+"""
+Async variants of the read-heavy analytics endpoints.
+
+These are served by the ASGI worker and use Django's async ORM, so a single
+worker can keep many slow polling clients open next to the WebSocket
+consumers instead of pinning one sync thread per request. The dashboard's
+aggregates run in a worker thread through the same cached builder as the
+sync view, so the two cannot drift apart.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+
+from apps.users.authentication import async_api_view
+from apps.users.versioning import async_data_version_condition
+from .models import UserInsight
+from .serializers import UserInsightSerializer
+from .views import dashboard_data
+
+
+@async_api_view()
+@async_data_version_condition('analytics', 'insights')
+async def dashboard(request):
+    """Async variant of AnalyticsReportViewSet.dashboard, sharing its cached builder"""
+    return JsonResponse(await sync_to_async(dashboard_data)(request.user))
+
+
+@async_api_view()
+@async_data_version_condition('insights')
+async def insights_unread_count(request):
+    """Async variant of UserInsightViewSet.unread_count"""
+    count = await UserInsight.objects.filter(user=request.user, is_read=False).acount()
+    return JsonResponse({'unread_count': count})
+
+
+@async_api_view()
+@async_data_version_condition('insights')
+async def recent_insights(request):
+    """Latest unread insights for the current user"""
+    insights = [
+        insight async for insight in UserInsight.objects.filter(
+            user=request.user,
+            is_read=False
+        ).order_by('-created_at')[:10]
+    ]
+    return JsonResponse(UserInsightSerializer(insights, many=True).data, safe=False)
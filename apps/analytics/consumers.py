@@ -2,8 +2,10 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
+from django.db.models import Sum, Count
 from django.utils import timezone
 from datetime import timedelta
+from apps.users.versioning import bump_versions
 from .models import CategoryAnalytics, UserInsight
 
 User = get_user_model()
@@ -287,9 +289,17 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             notification_id = text_data_json.get('notification_id')
             await self.mark_notification_read(notification_id)
 
-    @database_sync_to_async
-    def send_initial_notifications(self):
+    async def send_initial_notifications(self):
         """Send initial notifications"""
+        notification_data = await self.get_unread_notifications()
+        await self.send(text_data=json.dumps({
+            'type': 'initial_notifications',
+            'notifications': notification_data
+        }))
+
+    @database_sync_to_async
+    def get_unread_notifications(self):
+        """Get the latest unread insights for the initial payload"""
         notifications = UserInsight.objects.filter(
             user=self.user,
             is_read=False
@@ -306,19 +316,17 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 'created_at': notification.created_at.isoformat(),
                 'is_read': notification.is_read
             })
-        
-        self.send(text_data=json.dumps({
-            'type': 'initial_notifications',
-            'notifications': notification_data
-        }))
+        return notification_data
 
     @database_sync_to_async
     def mark_notification_read(self, notification_id):
         """Mark notification as read"""
-        UserInsight.objects.filter(
+        updated = UserInsight.objects.filter(
             id=notification_id,
             user=self.user
         ).update(is_read=True)
+        if updated:
+            bump_versions(self.user.pk, 'insights')
 
     async def new_notification(self, event):
         """Handle new notifications"""
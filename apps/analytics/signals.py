@@ -0,0 +1,17 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.users.versioning import bump_versions
+from .models import UserInsight, CategoryAnalytics
+
+
+@receiver([post_save, post_delete], sender=UserInsight)
+def bump_insight_version(sender, instance, **kwargs):
+    """Invalidate cached insight counts for the owner"""
+    bump_versions(instance.user_id, 'insights')
+
+
+@receiver([post_save, post_delete], sender=CategoryAnalytics)
+def bump_analytics_version(sender, instance, **kwargs):
+    """Invalidate cached dashboard data for the owner"""
+    bump_versions(instance.user_id, 'analytics')
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AnalyticsReportViewSet, UserInsightViewSet, CategoryAnalyticsViewSet
+from .views import AnalyticsReportViewSet, UserInsightViewSet, CategoryAnalyticsViewSet, CacheMetricsView
+from . import async_views
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()
@@ -9,5 +10,9 @@ router.register(r'insights', UserInsightViewSet, basename='user-insight')
 router.register(r'categories', CategoryAnalyticsViewSet, basename='category-analytics')
 
 urlpatterns = [
+    path('async/dashboard/', async_views.dashboard, name='async-dashboard'),
+    path('async/insights/unread-count/', async_views.insights_unread_count, name='async-insights-unread-count'),
+    path('async/insights/recent/', async_views.recent_insights, name='async-insights-recent'),
+    path('cache-metrics/', CacheMetricsView.as_view(), name='cache-metrics'),
     path('', include(router.urls)),
 ]
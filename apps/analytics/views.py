@@ -1,7 +1,7 @@
 from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.db.models import Sum, Count, Avg, Q
@@ -9,10 +9,13 @@ from django.utils import timezone
 from datetime import datetime, timedelta
 from django.contrib.auth import get_user_model
 from django.http import JsonResponse
-from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
 from rest_framework.views import APIView
 
+from apps.users.versioning import bump_versions, data_version_condition, version_token
+from config.cache import CacheNamespace, all_metrics
+from config.db_router import reads_from_replica
+
 from .models import AnalyticsReport, UserInsight, CategoryAnalytics
 from .serializers import (
     AnalyticsReportSerializer, AnalyticsReportCreateSerializer,
@@ -25,6 +28,75 @@ from .serializers import (
 
 User = get_user_model()
 
+analytics_cache = CacheNamespace('analytics', timeout=60 * 5)
+
+
+def build_dashboard(user):
+    """Compute the dashboard payload; see ``dashboard_data`` for the cached version"""
+    # Calculate date ranges
+    today = timezone.now().date()
+    start_of_month = today.replace(day=1)
+    start_of_year = today.replace(month=1, day=1)
+    
+    # Get expense data
+    monthly_expenses = CategoryAnalytics.objects.filter(
+        user=user,
+        month__gte=start_of_month
+    ).aggregate(total=Sum('total_spent'))['total'] or 0
+    
+    yearly_expenses = CategoryAnalytics.objects.filter(
+        user=user,
+        month__gte=start_of_year
+    ).aggregate(total=Sum('total_spent'))['total'] or 0
+    
+    # Get category breakdown
+    category_data = CategoryAnalytics.objects.filter(
+        user=user,
+        month__gte=start_of_month
+    ).values('category_name').annotate(
+        total=Sum('total_spent'),
+        count=Count('id')
+    ).order_by('-total')[:10]
+    
+    # Get monthly trend
+    monthly_trend = CategoryAnalytics.objects.filter(
+        user=user,
+        month__gte=start_of_year
+    ).values('month').annotate(
+        total=Sum('total_spent')
+    ).order_by('month')
+    
+    # Calculate insights
+    top_category = category_data[0] if category_data else None
+    budget_utilization = 75.5  # Placeholder - integrate with budgets app
+    savings_rate = 15.2  # Placeholder - calculate actual savings rate
+    
+    payload = {
+        'total_expenses': yearly_expenses,
+        'monthly_expenses': monthly_expenses,
+        'daily_average': yearly_expenses / 365 if yearly_expenses else 0,
+        'top_category': top_category['category_name'] if top_category else None,
+        'budget_utilization': budget_utilization,
+        'savings_rate': savings_rate,
+        'expense_trend': list(monthly_trend),
+        'category_breakdown': list(category_data),
+        'recent_insights': UserInsightSerializer(
+            UserInsight.objects.filter(user=user)[:5],
+            many=True
+        ).data,
+        'last_updated': timezone.now()
+    }
+    
+    return payload
+
+
+def dashboard_data(user):
+    """Dashboard payload, cached per user until their data changes (shared by the sync and async views)"""
+    return analytics_cache.get_or_compute(
+        ('dashboard', user.pk, timezone.now().date(), version_token(user.pk, 'analytics', 'insights')),
+        lambda: build_dashboard(user)
+    )
+
 
 class AnalyticsReportViewSet(viewsets.ModelViewSet):
     """
@@ -48,68 +120,13 @@ class AnalyticsReportViewSet(viewsets.ModelViewSet):
         return self.serializer_class
 
     @action(detail=False, methods=['get'])
-    @method_decorator(cache_page(60 * 5))  # Cache for 5 minutes
+    @method_decorator(data_version_condition('analytics', 'insights'))
     def dashboard(self, request):
         """Get comprehensive dashboard data with real-time metrics"""
-        user = request.user
-        
-        # Calculate date ranges
-        today = timezone.now().date()
-        start_of_month = today.replace(day=1)
-        start_of_year = today.replace(month=1, day=1)
-        
-        # Get expense data
-        monthly_expenses = CategoryAnalytics.objects.filter(
-            user=user,
-            month__gte=start_of_month
-        ).aggregate(total=Sum('total_spent'))['total'] or 0
-        
-        yearly_expenses = CategoryAnalytics.objects.filter(
-            user=user,
-            month__gte=start_of_year
-        ).aggregate(total=Sum('total_spent'))['total'] or 0
-        
-        # Get category breakdown
-        category_data = CategoryAnalytics.objects.filter(
-            user=user,
-            month__gte=start_of_month
-        ).values('category_name').annotate(
-            total=Sum('total_spent'),
-            count=Count('id')
-        ).order_by('-total')[:10]
-        
-        # Get monthly trend
-        monthly_trend = CategoryAnalytics.objects.filter(
-            user=user,
-            month__gte=start_of_year
-        ).values('month').annotate(
-            total=Sum('total_spent')
-        ).order_by('month')
-        
-        # Calculate insights
-        top_category = category_data[0] if category_data else None
-        budget_utilization = 75.5  # Placeholder - integrate with budgets app
-        savings_rate = 15.2  # Placeholder - calculate actual savings rate
-        
-        dashboard_data = {
-            'total_expenses': yearly_expenses,
-            'monthly_expenses': monthly_expenses,
-            'daily_average': yearly_expenses / 365 if yearly_expenses else 0,
-            'top_category': top_category['category_name'] if top_category else None,
-            'budget_utilization': budget_utilization,
-            'savings_rate': savings_rate,
-            'expense_trend': list(monthly_trend),
-            'category_breakdown': list(category_data),
-            'recent_insights': UserInsightSerializer(
-                UserInsight.objects.filter(user=user)[:5],
-                many=True
-            ).data,
-            'last_updated': timezone.now()
-        }
-        
-        return Response(dashboard_data, status=status.HTTP_200_OK)
+        return Response(dashboard_data(request.user), status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'])
+    @reads_from_replica
     def charts(self, request):
         """Get chart data for various visualization types"""
         user = request.user
@@ -422,9 +439,12 @@ class UserInsightViewSet(viewsets.ModelViewSet):
     def mark_all_read(self, request):
         """Mark all insights as read"""
         updated = self.get_queryset().filter(is_read=False).update(is_read=True)
+        if updated:
+            bump_versions(request.user.pk, 'insights')
         return Response({'updated_count': updated}, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'])
+    @method_decorator(data_version_condition('insights'))
     def unread_count(self, request):
         """Get count of unread insights"""
         count = self.get_queryset().filter(is_read=False).count()
@@ -453,6 +473,7 @@ class CategoryAnalyticsViewSet(viewsets.ModelViewSet):
         return self.serializer_class
 
     @action(detail=False, methods=['get'])
+    @reads_from_replica
     def summary(self, request):
         """Get category summary for current month"""
         user = request.user
@@ -521,3 +542,13 @@ class InteractiveDashboardView(APIView):
         """Get upcoming bills widget data"""
         # Implementation for upcoming bills
         return {'type': 'bill_reminder', 'data': {}}
+
+
+class CacheMetricsView(APIView):
+    """
+    Hit/miss counters of every cache namespace, summed over all workers
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(all_metrics(), status=status.HTTP_200_OK)
@@ -0,0 +1,172 @@
+"""
+Transaction analytics in the user's currency.
+
+Everything is computed from one grouped result set: totals per day,
+category, currency and type, read from the daily rollups when all of the
+user's accounts have them and from transactions otherwise. The set is
+converted into ``User.currency`` in one pass at each day's rate (see
+``fx.convert_frame``), then the totals and the category and daily breakdowns
+are aggregated from it in memory. ``totals`` keeps the native amount of each
+currency next to the converted figures.
+
+``spending`` combines bank debits with manually entered expenses, which are
+in the user's currency, leaving out expenses reconciled to a transaction so
+each spend counts once.
+"""
+import pandas as pd
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.expenses.models import Expense
+from config.cache import CacheNamespace
+from . import fx
+from .models import Transaction, TransactionDailyRollup
+from .rollups import rollups_available
+
+banking_cache = CacheNamespace('banking', timeout=60 * 5)
+# Closed ranges are keyed by the data version, so they can live much longer
+CLOSED_RANGE_TIMEOUT = 60 * 60 * 24
+
+
+def parse_date_range(params):
+    """(start_date, end_date) from query parameters; ValueError when malformed"""
+    dates = []
+    for name in ('start_date', 'end_date'):
+        value = params.get(name)
+        try:
+            parsed = parse_date(value) if value else None
+        except ValueError:
+            parsed = None
+        if value and parsed is None:
+            raise ValueError(f"{name} must be a YYYY-MM-DD date")
+        dates.append(parsed)
+    return tuple(dates)
+
+
+def _in_range(queryset, field, start_date, end_date):
+    if start_date:
+        queryset = queryset.filter(**{f'{field}__gte': start_date})
+    if end_date:
+        queryset = queryset.filter(**{f'{field}__lte': end_date})
+    return queryset
+
+
+def _daily_frame(user, start_date, end_date):
+    """(frame, source): totals per day, category, currency and transaction type"""
+    if rollups_available(user):
+        rows = _in_range(
+            TransactionDailyRollup.objects.filter(bank_account__user=user), 'date', start_date, end_date
+        ).values_list('date', 'category', 'currency', 'transaction_type').annotate(
+            total=Sum('total'), count=Sum('count')
+        ).order_by()
+        source = 'rollups'
+    else:
+        rows = _in_range(
+            Transaction.objects.filter(bank_account__user=user), 'transaction_date', start_date, end_date
+        ).values_list('transaction_date', 'category', 'amount_currency', 'transaction_type').annotate(
+            total=Sum('amount'), count=Count('id')
+        ).order_by()
+        source = 'transactions'
+    frame = pd.DataFrame(list(rows), columns=['date', 'category', 'currency', 'transaction_type', 'total', 'count'])
+    frame['total'] = frame['total'].astype(float)
+    return frame, source
+
+
+def _merchant_frame(user, start_date, end_date):
+    # Grouped by day as well, so each day converts at its own rate
+    rows = _in_range(
+        Transaction.objects.filter(bank_account__user=user, transaction_type='debit', merchant__isnull=False),
+        'transaction_date', start_date, end_date
+    ).values_list('merchant_id', 'merchant__name', 'amount_currency', 'transaction_date').annotate(
+        total=Sum('amount'), count=Count('id')
+    ).order_by()
+    frame = pd.DataFrame(list(rows), columns=['merchant_id', 'merchant__name', 'currency', 'date', 'total', 'count'])
+    frame['total'] = frame['total'].astype(float)
+    return frame
+
+
+def _breakdown(frame, groups):
+    """Converted total and count per group; ``groups`` maps output keys to frame columns"""
+    grouped = frame.groupby(list(groups.values()), dropna=False).agg(
+        total=('converted', 'sum'), count=('count', 'sum')
+    ).reset_index()
+    return [
+        {
+            **{key: None if pd.isna(row[column]) else row[column] for key, column in groups.items()},
+            'total': fx.to_decimal(row['total']),
+            'count': int(row['count']),
+        }
+        for row in grouped.to_dict('records')
+    ]
+
+
+def transaction_analytics(user, start_date=None, end_date=None):
+    """Totals and breakdowns of a user's transactions in a date range; fx.RateUnavailable without the rates"""
+    currency = user.currency
+    frame, source = _daily_frame(user, start_date, end_date)
+    frame = fx.convert_frame(frame, currency)
+    debit = frame['transaction_type'] == 'debit'
+    frame['spent'] = frame['total'].where(debit, 0.0)
+    frame['received'] = frame['total'].where(~debit, 0.0)
+
+    totals = []
+    for row_currency, row in frame.groupby('currency').agg(
+        spent=('spent', 'sum'), received=('received', 'sum'), count=('count', 'sum')
+    ).iterrows():
+        totals.append({
+            'currency': row_currency,
+            'total_spent': fx.to_decimal(row['spent']),
+            'total_received': fx.to_decimal(row['received']),
+            'net_amount': fx.to_decimal(row['received'] - row['spent']),
+            'count': int(row['count']),
+        })
+
+    debits = frame[debit]
+    total_spent = float(debits['converted'].sum())
+    total_received = float(frame.loc[~debit, 'converted'].sum())
+
+    category_spending = _breakdown(debits, {'category': 'category'})
+    daily_spending = _breakdown(debits, {'transaction_date': 'date'})
+    merchants = fx.convert_frame(_merchant_frame(user, start_date, end_date), currency)
+    merchant_spending = _breakdown(merchants, {'merchant_id': 'merchant_id', 'merchant__name': 'merchant__name'})
+
+    # Manual expenses with a bank record are already in the debits; add only the others
+    manual = _in_range(
+        Expense.objects.filter(user=user, expense_type='expense', bank_transaction__isnull=True),
+        'transaction_date', start_date, end_date
+    ).aggregate(total=Sum('amount'))['total'] or 0
+    bank = fx.to_decimal(total_spent)
+
+    return {
+        'currency': currency,
+        'totals': totals,
+        'total_spent': bank,
+        'total_received': fx.to_decimal(total_received),
+        'net_amount': fx.to_decimal(total_received - total_spent),
+        'spending': {'bank': bank, 'manual': manual, 'total': bank + manual},
+        'category_spending': sorted(category_spending, key=lambda row: row['total'], reverse=True),
+        'merchant_spending': sorted(merchant_spending, key=lambda row: row['total'], reverse=True)[:10],
+        'daily_spending': sorted(daily_spending, key=lambda row: row['transaction_date']),
+        'source': source,
+    }
+
+
+def balance_summary(accounts, currency):
+    """Total balance of bank accounts and per account type, converted into ``currency`` at today's rates"""
+    rows = accounts.values_list('account_type', 'balance_currency').annotate(
+        count=Count('id'), total=Sum('balance')
+    ).order_by()
+    frame = pd.DataFrame(list(rows), columns=['account_type', 'currency', 'count', 'total'])
+    frame['total'] = frame['total'].astype(float)
+    frame = fx.convert_frame(frame, currency, date_column=timezone.now().date())
+    account_summary = _breakdown(frame, {'account_type': 'account_type'})
+    return {
+        'currency': currency,
+        'total_accounts': sum(row['count'] for row in account_summary),
+        'total_balance': fx.to_decimal(frame['converted'].sum()),
+        'account_summary': [
+            {'account_type': row['account_type'], 'count': row['count'], 'total_balance': row['total']}
+            for row in account_summary
+        ],
+    }
@@ -5,3 +5,6 @@ class BankingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.banking'
     verbose_name = 'Banking & Transactions'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,270 @@
+"""
+Currency conversion.
+
+``ExchangeRate`` holds one rate per currency and day, quoted against a single
+pivot currency (``FX_PIVOT_CURRENCY``), so any cross rate is the ratio of two
+stored rates and the table grows by one row per currency a day. Days without
+a rate (weekends, holidays) use the last rate before them, up to
+``FX_MAX_STALE_DAYS`` old.
+
+Rates are loaded daily from ``FX_RATES_FILE`` (CSV ``date,currency,rate`` or
+JSON ``{"YYYY-MM-DD": {"EUR": 0.92}}``) when one is configured, and from the
+``FX_RATE_PROVIDER`` otherwise. The first load, and any load after older
+transactions were imported, goes back to the earliest transaction.
+``FakeRateProvider`` generates deterministic rates for development and is
+only the default with ``DEBUG`` on; without a file or a provider, loading
+fails with ``ImproperlyConfigured``.
+
+Conversion works on whole result sets: ``convert_frame`` takes grouped rows
+(date, currency, amount), resolves each distinct (date, from, to) rate once,
+through a per-process LRU and at most one query for the misses, and converts
+every row with one vectorized multiply.
+"""
+import csv
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+
+import pandas as pd
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.module_loading import import_string
+
+from .models import ExchangeRate, Transaction
+
+CENTS = Decimal('0.01')
+
+
+class RateUnavailable(LookupError):
+    """No rate recent enough to convert between two currencies on a day"""
+
+
+class RateLRU:
+    """Per-process LRU of (date, from, to) rates with a freshness TTL"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._rates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._rates.get(key)
+                if entry is None:
+                    continue
+                loaded_at, rate = entry
+                if now - loaded_at > self.ttl:
+                    del self._rates[key]
+                    continue
+                self._rates.move_to_end(key)
+                found[key] = rate
+        return found
+
+    def put_many(self, rates):
+        now = time.monotonic()
+        with self._lock:
+            for key, rate in rates.items():
+                self._rates[key] = (now, rate)
+                self._rates.move_to_end(key)
+            while len(self._rates) > self.max_size:
+                self._rates.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._rates.clear()
+
+
+rate_cache = RateLRU(
+    max_size=getattr(settings, 'FX_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'FX_CACHE_TTL', 3600),
+)
+
+
+def _pivot_table(days, currencies):
+    """DataFrame of rates per pivot unit, one row per day from the earliest usable day, one column per currency"""
+    pivot = settings.FX_PIVOT_CURRENCY
+    stale = settings.FX_MAX_STALE_DAYS
+    first, last = min(days) - timedelta(days=stale), max(days)
+    rows = ExchangeRate.objects.filter(
+        currency__in=currencies - {pivot}, date__gte=first, date__lte=last
+    ).values_list('date', 'currency', 'rate')
+
+    frame = pd.DataFrame(list(rows), columns=['date', 'currency', 'rate'])
+    frame['rate'] = frame['rate'].astype(float)
+    table = frame.pivot(index='date', columns='currency', values='rate')
+    # Every calendar day, carrying the last known rate over the days without one
+    table = table.reindex(
+        index=[first + timedelta(days=offset) for offset in range((last - first).days + 1)],
+        columns=sorted(currencies)
+    ).ffill(limit=stale)
+    if pivot in table.columns:
+        table[pivot] = 1.0
+    return table
+
+
+def get_rates(keys):
+    """{(date, from, to): rate} for the given keys; RateUnavailable when one cannot be resolved"""
+    keys = set(keys)
+    rates = {key: 1.0 for key in keys if key[1] == key[2]}
+    rates.update(rate_cache.get_many(keys - rates.keys()))
+    missing = keys - rates.keys()
+    if not missing:
+        return rates
+
+    days = sorted({day for day, _, _ in missing})
+    currencies = {currency for _, source, target in missing for currency in (source, target)}
+    table = _pivot_table(days, currencies)
+
+    missing = sorted(missing)
+    values = table.to_numpy()
+    rows = table.index.get_indexer([day for day, _, _ in missing])
+    sources = values[rows, table.columns.get_indexer([source for _, source, _ in missing])]
+    targets = values[rows, table.columns.get_indexer([target for _, _, target in missing])]
+    resolved = dict(zip(missing, (targets / sources).tolist()))
+
+    unavailable = [key for key, rate in resolved.items() if math.isnan(rate)]
+    if unavailable:
+        day, source, target = unavailable[0]
+        raise RateUnavailable(
+            f"No {source}->{target} rate for {day} or the {settings.FX_MAX_STALE_DAYS} days before"
+            + (f" (and {len(unavailable) - 1} more)" if len(unavailable) > 1 else '')
+        )
+    rate_cache.put_many(resolved)
+    rates.update(resolved)
+    return rates
+
+
+def convert(amount, source, target, day=None):
+    """One amount in ``target`` currency, rounded to cents"""
+    day = day or timezone.now().date()
+    rate = get_rates([(day, source, target)])[day, source, target]
+    return to_decimal(float(amount) * rate)
+
+
+def convert_frame(frame, target, amount_column='total', currency_column='currency', date_column='date',
+                  output_column='converted'):
+    """
+    Add ``output_column`` with ``amount_column`` in ``target`` currency.
+
+    ``date_column`` may be a column name or a single date used for every row
+    (e.g. today for balances). Rates are resolved once per distinct
+    (date, currency).
+    """
+    frame = frame.copy()
+    if frame.empty:
+        frame[output_column] = pd.Series(dtype=float)
+        return frame
+    days = frame[date_column] if isinstance(date_column, str) else pd.Series(date_column, index=frame.index)
+    keys = pd.DataFrame({'day': days, 'currency': frame[currency_column]})
+    distinct = keys.drop_duplicates()
+    rates = get_rates((day, currency, target) for day, currency in distinct.itertuples(index=False))
+    distinct = distinct.assign(rate=[rates[day, currency, target] for day, currency in distinct.itertuples(index=False)])
+    rate = keys.merge(distinct, on=['day', 'currency'], how='left')['rate'].to_numpy()
+    frame[output_column] = frame[amount_column].astype(float).to_numpy() * rate
+    return frame
+
+
+def to_decimal(value):
+    """Decimal amount in cents from a converted float"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return Decimal(repr(float(value))).quantize(CENTS)
+
+
+# Loading
+
+def store_rates(rates, source):
+    """Upsert {(date, currency): rate} rows; returns the number written"""
+    rows = [
+        ExchangeRate(date=day, currency=currency.upper(), rate=Decimal(str(rate)), source=source)
+        for (day, currency), rate in rates.items()
+        if currency.upper() != settings.FX_PIVOT_CURRENCY
+    ]
+    ExchangeRate.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['currency', 'date'],
+        update_fields=['rate', 'source', 'updated_at'],
+        batch_size=1000,
+    )
+    rate_cache.clear()
+    return len(rows)
+
+
+def read_rates_file(path):
+    """{(date, currency): rate} from a CSV (date,currency,rate) or JSON ({date: {currency: rate}}) file"""
+    rates = {}
+    with open(path, encoding='utf-8') as handle:
+        if path.lower().endswith('.json'):
+            for day, by_currency in json.load(handle).items():
+                for currency, rate in by_currency.items():
+                    rates[parse_date(day), currency] = Decimal(str(rate))
+        else:
+            for row in csv.DictReader(handle):
+                rates[parse_date(row['date']), row['currency'].strip()] = Decimal(row['rate'])
+    if any(day is None for day, _ in rates):
+        raise ValueError(f"{path} has dates that are not YYYY-MM-DD")
+    return rates
+
+
+class FakeRateProvider:
+    """Deterministic rates around fixed levels with a slow daily drift, for development and tests"""
+
+    LEVELS = {
+        'EUR': 0.92, 'GBP': 0.79, 'JPY': 150.0, 'CAD': 1.36, 'AUD': 1.52, 'CHF': 0.88,
+        'CNY': 7.2, 'INR': 83.0, 'MXN': 17.0, 'BRL': 5.0, 'SEK': 10.5, 'NZD': 1.64,
+    }
+
+    def fetch(self, day):
+        """{currency: rate per pivot unit} for one day"""
+        return {
+            currency: Decimal(str(round(level * (1 + 0.03 * math.sin(day.toordinal() / 45 + i)), 6)))
+            for i, (currency, level) in enumerate(sorted(self.LEVELS.items()))
+        }
+
+
+def get_rate_provider():
+    if not settings.FX_RATE_PROVIDER:
+        raise ImproperlyConfigured('Set FX_RATE_PROVIDER or FX_RATES_FILE to load exchange rates')
+    return import_string(settings.FX_RATE_PROVIDER)()
+
+
+def history_start():
+    """Earliest transaction date when no stored rate covers it (first load, older imports), else None"""
+    earliest = Transaction.objects.aggregate(earliest=Min('transaction_date'))['earliest']
+    # Providers skip weekends and holidays: a rate within the staleness window counts
+    covered_through = earliest and earliest + timedelta(days=settings.FX_MAX_STALE_DAYS)
+    if earliest is None or ExchangeRate.objects.filter(date__lte=covered_through).exists():
+        return None
+    return earliest
+
+
+def refresh_rates(start_date, end_date=None):
+    """Load rates from the configured file, or from the provider for the days not stored yet; returns rows written"""
+    if settings.FX_RATES_FILE:
+        rates = read_rates_file(settings.FX_RATES_FILE)
+        return store_rates(rates, source='file')
+
+    end_date = end_date or timezone.now().date()
+    stored = set(
+        ExchangeRate.objects.filter(date__gte=start_date, date__lte=end_date).values_list('date', flat=True).distinct()
+    )
+    provider = get_rate_provider()
+    rates = {}
+    day = start_date
+    while day <= end_date:
+        if day not in stored:
+            rates.update({(day, currency): rate for currency, rate in provider.fetch(day).items()})
+        day += timedelta(days=1)
+    return store_rates(rates, source='provider') if rates else 0
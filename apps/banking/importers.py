@@ -0,0 +1,306 @@
+"""
+Bank statement file imports (OFX/QFX and CSV).
+
+Files are parsed as a stream: the OFX tokenizer reads fixed-size blocks and
+the CSV reader one line at a time, and both yield ``ProviderTransaction``
+rows that are written in chunks. A 100k-line statement therefore never sits
+in memory as a whole.
+
+Every chunk is deduplicated with one query against the transaction ids that
+are already stored, under a lock on the account row so that overlapping
+imports into one account never insert the same row and the counts stay exact. Rows get their id from the file (OFX ``FITID`` or a
+mapped CSV column), namespaced by account; rows without one get a content
+hash of account, date, amount, description and the row's occurrence number
+among identical rows, so importing the same statement twice adds nothing.
+Progress is written to the import's ``SyncLog`` after each chunk.
+"""
+import csv
+import hashlib
+import html
+import io
+import logging
+import re
+import time
+from collections import Counter
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.users.versioning import bump_versions
+from . import rollups
+from .merchants import assign_merchants
+from .models import BankAccount, Transaction
+from .providers import ProviderTransaction
+from .sync import build_transaction
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+READ_SIZE = 64 * 1024
+
+# Header names recognised when no column mapping is given (lowercased)
+DEFAULT_COLUMNS = {
+    'date': ['date', 'transaction date', 'trans. date', 'posted date', 'posting date'],
+    'amount': ['amount', 'transaction amount'],
+    'debit': ['debit', 'withdrawal', 'withdrawals', 'debit amount'],
+    'credit': ['credit', 'deposit', 'deposits', 'credit amount'],
+    'description': ['description', 'payee', 'name', 'details', 'memo', 'transaction description'],
+    'merchant': ['merchant', 'merchant name'],
+    'category': ['category'],
+    'transaction_id': ['transaction id', 'id', 'reference', 'reference number', 'fitid'],
+}
+DATE_FORMATS = ['%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%d/%m/%Y', '%Y/%m/%d', '%d-%m-%Y', '%d.%m.%Y']
+
+OFX_TAG_RE = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+class StatementError(ValueError):
+    """The file cannot be imported (unknown format, unmapped columns, bad values)"""
+
+
+def _parse_amount(value):
+    """Decimal from bank formatted text: "$1,234.50", "(12.00)", "-3.10" """
+    text = (value or '').strip().replace(',', '').replace('$', '').replace('€', '').replace('£', '')
+    if not text:
+        return None
+    negative = text.startswith('(') and text.endswith(')')
+    try:
+        amount = Decimal(text.strip('()'))
+    except InvalidOperation:
+        raise StatementError(f"Invalid amount: {value!r}")
+    return -amount if negative else amount
+
+
+def _parse_date(value, date_format=None):
+    text = (value or '').strip()
+    for candidate in ([date_format] if date_format else DATE_FORMATS):
+        try:
+            return datetime.strptime(text, candidate).date()
+        except ValueError:
+            continue
+    raise StatementError(f"Invalid date: {value!r}")
+
+
+def _ofx_date(value):
+    """OFX dates are YYYYMMDD, optionally followed by a time and a timezone"""
+    return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+
+def _ofx_tokens(stream):
+    """(closing, tag, text) for every tag of an OFX file, read block by block"""
+    buffer = ''
+    while True:
+        block = stream.read(READ_SIZE)
+        buffer += block
+        # Everything before the last '<' is complete; the tag after it may continue in the next block
+        cut = buffer.rfind('<') if block else len(buffer)
+        if cut <= 0:
+            if not block:
+                return
+            continue
+        for match in OFX_TAG_RE.finditer(buffer, 0, cut):
+            yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+        if not block:
+            return
+        buffer = buffer[cut:]
+
+
+def parse_ofx(stream, currency):
+    """Stream ``ProviderTransaction`` rows from OFX/QFX text, SGML (1.x) or XML (2.x)"""
+    current = None
+    for closing, tag, text in _ofx_tokens(stream):
+        if tag == 'CURDEF' and text:
+            currency = text
+        elif tag == 'STMTTRN' or (closing and tag == 'BANKTRANLIST'):
+            # SGML files may leave transactions unclosed: the next one or the end of the list closes them
+            if current:
+                yield _ofx_transaction(current, currency)
+            current = {} if tag == 'STMTTRN' and not closing else None
+        elif current is not None and not closing and text:
+            # SGML leaves have no closing tags, so a tag with text is a value
+            current[tag] = html.unescape(text)
+    if current:
+        yield _ofx_transaction(current, currency)
+
+
+def _ofx_transaction(fields, currency):
+    try:
+        # OFX amounts are signed from the account's point of view
+        amount = -_parse_amount(fields['TRNAMT'])
+        posted = _ofx_date(fields['DTPOSTED'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise StatementError(f"Invalid OFX transaction {fields.get('FITID')}: {e}")
+    name = fields.get('NAME') or fields.get('PAYEE') or fields.get('MEMO') or ''
+    return ProviderTransaction(
+        transaction_id=fields.get('FITID'),
+        amount=amount,
+        currency=fields.get('CURRENCY') or currency,
+        description=' '.join(filter(None, [name, fields.get('MEMO') if fields.get('MEMO') != name else None])),
+        merchant_name=name or None,
+        transaction_date=_ofx_date(fields['DTUSER']) if fields.get('DTUSER') else posted,
+        posted_date=posted,
+        metadata={'source': 'ofx', 'trntype': fields.get('TRNTYPE')},
+    )
+
+
+def resolve_columns(header, mapping=None):
+    """{field: column name} for a CSV header, from the mapping or the default header names"""
+    mapping = dict(mapping or {})
+    by_lower = {column.strip().lower(): column for column in header if column}
+    columns = {}
+    for field_name, candidates in DEFAULT_COLUMNS.items():
+        if field_name in mapping:
+            if mapping[field_name] not in header:
+                raise StatementError(f"Column {mapping[field_name]!r} not found in the file")
+            columns[field_name] = mapping[field_name]
+            continue
+        columns[field_name] = next((by_lower[c] for c in candidates if c in by_lower), None)
+
+    if not columns['date'] or not columns['description']:
+        raise StatementError('The file needs date and description columns; pass a column mapping')
+    if not columns['amount'] and not (columns['debit'] or columns['credit']):
+        raise StatementError('The file needs an amount column or debit/credit columns; pass a column mapping')
+    return columns
+
+
+def parse_csv(stream, currency, mapping=None):
+    """
+    Stream ``ProviderTransaction`` rows from a bank CSV.
+
+    ``mapping`` maps fields (date, amount, debit, credit, description,
+    merchant, category, transaction_id) to column names and may set
+    ``date_format`` and ``negative_debits`` (default true: spending shows
+    as a negative amount, as most banks export it).
+    """
+    mapping = dict(mapping or {})
+    date_format = mapping.pop('date_format', None)
+    negative_debits = mapping.pop('negative_debits', True)
+
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames:
+        raise StatementError('The file is empty')
+    columns = resolve_columns(reader.fieldnames, mapping)
+
+    for line, row in enumerate(reader, start=2):
+        values = {
+            field_name: (row.get(column) or '').strip() if column else ''
+            for field_name, column in columns.items()
+        }
+        try:
+            if columns['amount']:
+                amount = _parse_amount(values['amount'])
+                if amount is None:
+                    continue
+                amount = -amount if negative_debits else amount
+            else:
+                amount = (_parse_amount(values['debit']) or 0) - (_parse_amount(values['credit']) or 0)
+            transaction_date = _parse_date(values['date'], date_format)
+        except StatementError as e:
+            raise StatementError(f"Line {line}: {e}")
+
+        yield ProviderTransaction(
+            transaction_id=values['transaction_id'] or None,
+            amount=amount,
+            currency=currency,
+            description=values['description'],
+            merchant_name=values['merchant'] or values['description'] or None,
+            category=values['category'] or None,
+            transaction_date=transaction_date,
+            posted_date=transaction_date,
+            metadata={'source': 'csv'},
+        )
+
+
+def detect_format(name, head):
+    """'ofx' or 'csv' from the file name and its first bytes"""
+    if name and name.lower().endswith(('.ofx', '.qfx')):
+        return 'ofx'
+    if b'OFXHEADER' in head or b'<OFX>' in head.upper():
+        return 'ofx'
+    return 'csv'
+
+
+def _transaction_ids(account, rows, occurrences):
+    """Account-scoped ids: the file's own id, or a content hash for rows without one"""
+    for row in rows:
+        if row.transaction_id:
+            row.transaction_id = f'import-{account.id}-{row.transaction_id}'[:255]
+            continue
+        content = f'{account.id}|{row.transaction_date}|{row.amount}|{row.description}'
+        # Identical rows in one file (two coffees on the same day) are distinct transactions
+        occurrences[content] += 1
+        digest = hashlib.sha1(f'{content}|{occurrences[content]}'.encode()).hexdigest()
+        row.transaction_id = f'import-{account.id}-{digest}'
+
+
+def import_file(sync_log, file, file_format, mapping=None, start_date=None, end_date=None):
+    """Import a statement file into the log's account; updates and returns the SyncLog"""
+    account = sync_log.bank_account
+    started = time.monotonic()
+    sync_log.status = 'in_progress'
+    sync_log.save(update_fields=['status'])
+
+    stream = io.TextIOWrapper(file, encoding='utf-8-sig', errors='replace', newline='')
+    if file_format == 'ofx':
+        rows = parse_ofx(stream, account.currency)
+    else:
+        rows = parse_csv(stream, account.currency, mapping)
+
+    occurrences = Counter()
+    try:
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            sync_log.rows_processed += len(batch)
+            in_range = [
+                row for row in batch
+                if (start_date is None or row.transaction_date >= start_date)
+                and (end_date is None or row.transaction_date <= end_date)
+            ]
+            sync_log.rows_filtered += len(batch) - len(in_range)
+            batch = in_range
+            _transaction_ids(account, batch, occurrences)
+
+            with transaction.atomic():
+                # Ids are account-scoped: with the account locked, nothing else
+                # can insert them between the lookup and the insert
+                BankAccount.objects.select_for_update().filter(id=account.id).exists()
+                existing = set(
+                    Transaction.objects.filter(
+                        transaction_id__in=[row.transaction_id for row in batch]
+                    ).values_list('transaction_id', flat=True)
+                )
+                new = {}
+                for row in batch:
+                    # A file may repeat a FITID; the first row wins like a stored one would
+                    if row.transaction_id not in existing:
+                        new.setdefault(row.transaction_id, row)
+                models = assign_merchants([build_transaction(account, row) for row in new.values()])
+                Transaction.objects.bulk_create(models)
+                rollups.refresh_rollups(account.id, {model.transaction_date for model in models})
+                sync_log.transactions_added += len(models)
+                sync_log.transactions_skipped += len(batch) - len(models)
+                sync_log.save(update_fields=[
+                    'rows_processed', 'rows_filtered', 'transactions_added', 'transactions_skipped'
+                ])
+        if account.rollups_built_at is None:
+            rollups.rebuild_rollups(account)
+        sync_log.status = 'completed'
+    except Exception as e:
+        logger.exception(f"Import into bank account {account.id} failed")
+        sync_log.status = 'failed'
+        sync_log.error_message = str(e)
+    finally:
+        sync_log.completed_at = timezone.now()
+        sync_log.duration_seconds = round(time.monotonic() - started, 3)
+        sync_log.save()
+        if sync_log.transactions_added:
+            from .tasks import schedule_reconciliation
+            bump_versions(account.user_id, 'transactions')
+            schedule_reconciliation(account.user_id)
+
+    return sync_log
@@ -0,0 +1,307 @@
+"""
+Merchant canonicalization.
+
+Raw merchant strings from bank feeds, receipts and voice commands
+("AMZN MKTP US*2K4", "Amazon.com", "Amazon") are resolved to one ``Merchant``
+in three steps:
+
+1. rule-based cleanup: processor prefixes, reference codes, store numbers,
+   domains and legal suffixes are stripped, and well-known abbreviations are
+   expanded, giving a normalized key;
+2. the ``MerchantAlias`` mapping table (fronted by the cache) maps keys seen
+   before straight to their merchant;
+3. unseen keys are matched against the known merchants with a trigram index
+   (Jaccard similarity); keys with no close match become new merchants.
+
+``resolve_many`` does all of this for a batch of names with a fixed number of
+queries, so importers resolve whole pages of transactions at once. With
+``create=False`` it only looks names up, for display paths (voice commands,
+receipts) that must not add merchants.
+"""
+import hashlib
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from config.cache import CacheNamespace
+from .models import Merchant, MerchantAlias
+
+merchant_cache = CacheNamespace('merchants', timeout=60 * 60 * 24)
+
+INDEX_GENERATION_KEY = 'merchants:index_generation'
+MIN_SIMILARITY = 0.6
+MAX_KEY_LENGTH = 255
+
+# Payment processors and card networks prefix the real merchant. A bare
+# hyphen only separates them when spaced ("In-N-Out" is a name)
+PROCESSOR_PREFIX_RE = re.compile(
+    r'^(?:sq|tst|sp|pp|paypal|pos|ach|dd|ck|checkcard|debit card purchase|purchase|recurring payment|'
+    r'card purchase|visa|mc|bill payment|google|apple pay|in)(?:\s*[\*#:]+|\s+-+)\s*',
+    re.IGNORECASE
+)
+# Bank feeds also write some prefixes in capitals with only a space: "POS 12/03 SHELL OIL".
+# Case-sensitive, so names that merely start with these words are kept
+CAPS_PREFIX_RE = re.compile(
+    r'^(?:POS|ACH|CHECKCARD|DEBIT CARD PURCHASE|CARD PURCHASE|RECURRING PAYMENT|BILL PAYMENT)\s+'
+)
+# Reference codes after an asterisk: "AMZN MKTP US*2K4RT1"
+REFERENCE_RE = re.compile(r'\*.*$')
+STORE_NUMBER_RE = re.compile(r'(?:#|no\.?\s*|store\s+)\s*\d+|\b\d{3,}\b', re.IGNORECASE)
+DATE_RE = re.compile(r'\b\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?\b')
+DOMAIN_RE = re.compile(r'\.(?:com|net|org|co|io|us|uk)\b', re.IGNORECASE)
+NON_WORD_RE = re.compile(r"[^a-z0-9&' ]+")
+SPACE_RE = re.compile(r'\s+')
+
+NOISE_WORDS = {
+    'the', 'store', 'stores', 'mktp', 'mktplace', 'marketplace', 'us', 'usa', 'online', 'www', 'payment', 'pmts',
+}
+# Dropped only as the last word: "Co-op Food" keeps its "co"
+LEGAL_SUFFIXES = {'inc', 'llc', 'ltd', 'co', 'corp', 'corporation', 'company'}
+
+# Abbreviations that rules cannot derive, keyed by normalized prefix
+KNOWN_MERCHANTS = {
+    'amzn': 'amazon',
+    'amazon prime': 'amazon',
+    'prime video': 'amazon',
+    'wm supercenter': 'walmart',
+    'wal mart': 'walmart',
+    'mcdonald\'s': 'mcdonalds',
+    'starbucks coffee': 'starbucks',
+    'uber trip': 'uber',
+    'uber eats': 'uber eats',
+    'ubr': 'uber',
+    'lyft ride': 'lyft',
+    'apple bill': 'apple',
+    'itunes': 'apple',
+    'goog': 'google',
+    'costco whse': 'costco',
+    'wholefds': 'whole foods',
+    'whole foods market': 'whole foods',
+    'tjmaxx': 'tj maxx',
+}
+
+
+def normalize(raw):
+    """Cleaned-up lookup key for a raw merchant string ('' when nothing is left)"""
+    if not raw:
+        return ''
+    text = PROCESSOR_PREFIX_RE.sub('', raw.strip())
+    text = CAPS_PREFIX_RE.sub('', text)
+    text = REFERENCE_RE.sub('', text)
+    text = DOMAIN_RE.sub(' ', text)
+    text = DATE_RE.sub(' ', text)
+    text = STORE_NUMBER_RE.sub(' ', text)
+    text = NON_WORD_RE.sub(' ', text.lower())
+    words = [word for word in SPACE_RE.split(text) if word and word not in NOISE_WORDS]
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+    key = ' '.join(words)
+
+    for prefix, canonical in KNOWN_MERCHANTS.items():
+        if key == prefix or key.startswith(prefix + ' '):
+            return canonical
+    return key[:MAX_KEY_LENGTH]
+
+
+def display_name(key):
+    return ' '.join(word.capitalize() for word in key.split())
+
+
+def trigrams(key):
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _numbers(key):
+    return [word for word in key.split() if word.isdigit()]
+
+
+class TrigramIndex:
+    """In-memory trigram index over merchant keys, for Jaccard similarity lookups"""
+
+    def __init__(self, merchants):
+        self.keys = {}
+        self.sizes = {}
+        self.postings = defaultdict(list)
+        for merchant_id, key in merchants:
+            grams = trigrams(key)
+            self.keys[merchant_id] = key
+            self.sizes[merchant_id] = len(grams)
+            for gram in grams:
+                self.postings[gram].append(merchant_id)
+
+    def add(self, merchant_id, key):
+        grams = trigrams(key)
+        self.keys[merchant_id] = key
+        self.sizes[merchant_id] = len(grams)
+        for gram in grams:
+            self.postings[gram].append(merchant_id)
+
+    def match(self, key, min_similarity=MIN_SIMILARITY):
+        """(merchant_id, similarity) of the closest known merchant, or (None, 0.0)"""
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        numbers = _numbers(key)
+        best, best_similarity = None, 0.0
+        for merchant_id, count in shared.items():
+            similarity = count / (len(grams) + self.sizes[merchant_id] - count)
+            # "7 eleven" vs "24 hour fitness": numbers are never fuzzy
+            if similarity > best_similarity and _numbers(self.keys[merchant_id]) == numbers:
+                best, best_similarity = merchant_id, similarity
+        if best_similarity < min_similarity:
+            return None, best_similarity
+        return best, best_similarity
+
+
+_index = None
+_index_generation = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Process-local trigram index, rebuilt when another worker added merchants"""
+    global _index, _index_generation
+    generation = cache.get(INDEX_GENERATION_KEY, 0)
+    with _index_lock:
+        if _index is None or _index_generation != generation:
+            _index = TrigramIndex(Merchant.objects.values_list('id', 'normalized_name'))
+            _index_generation = generation
+        return _index
+
+
+def _bump_index_generation():
+    def _bump():
+        try:
+            cache.incr(INDEX_GENERATION_KEY)
+        except ValueError:
+            cache.set(INDEX_GENERATION_KEY, 1, None)
+
+    transaction.on_commit(_bump)
+
+
+def _alias_cache_keys(keys):
+    prefix = merchant_cache.key('alias')
+    return {key: f'{prefix}:{hashlib.md5(key.encode()).hexdigest()}' for key in keys}
+
+
+def resolve_many(raw_names, create=True):
+    """Map raw merchant strings to merchant ids ({raw: id or None}) in bulk; ``create`` stores new merchants and aliases"""
+    keys = {raw: normalize(raw) for raw in set(raw_names) if raw}
+    wanted = {key for key in keys.values() if key}
+    if not wanted:
+        return {raw: None for raw in raw_names}
+
+    # 1. Cached mapping table
+    cache_keys = _alias_cache_keys(wanted)
+    cached = merchant_cache.cache.get_many(list(cache_keys.values()))
+    resolved = {key: cached[cache_key] for key, cache_key in cache_keys.items() if cache_key in cached}
+    hits = set(resolved)
+
+    # 2. Stored aliases
+    missing = wanted - hits
+    if missing:
+        resolved.update(
+            MerchantAlias.objects.filter(alias__in=missing).values_list('alias', 'merchant_id')
+        )
+
+    # 3. Fuzzy match against known merchants, or a new merchant
+    missing = sorted(wanted - set(resolved))
+    if missing and create:
+        resolved.update(_match_or_create(missing))
+    elif missing:
+        index = get_index()
+        matches = {key: index.match(key)[0] for key in missing}
+        resolved.update({key: merchant_id for key, merchant_id in matches.items() if merchant_id is not None})
+
+    merchant_cache.cache.set_many(
+        {cache_keys[key]: merchant_id for key, merchant_id in resolved.items() if key not in hits},
+        merchant_cache.timeout
+    )
+    return {raw: resolved.get(keys.get(raw)) for raw in raw_names}
+
+
+def _match_or_create(keys):
+    index = get_index()
+    aliases = []
+    resolved = {}
+    # Unknown keys are clustered among themselves too, so one batch with
+    # "whole foods mkt" and "whole foods" creates a single merchant
+    new_index = TrigramIndex([])
+    new_merchants = []
+    new_aliases = {}
+
+    for key in keys:
+        merchant_id, similarity = index.match(key)
+        if merchant_id is not None:
+            resolved[key] = merchant_id
+            aliases.append(MerchantAlias(alias=key, merchant_id=merchant_id, source='fuzzy', similarity=similarity))
+            continue
+        position, similarity = new_index.match(key)
+        if position is None:
+            new_index.add(len(new_merchants), key)
+            new_merchants.append(key)
+        else:
+            new_aliases[key] = (new_merchants[position], similarity)
+
+    if new_merchants:
+        with transaction.atomic():
+            Merchant.objects.bulk_create(
+                [Merchant(name=display_name(key), normalized_name=key) for key in new_merchants],
+                ignore_conflicts=True
+            )
+            created = dict(
+                Merchant.objects.filter(normalized_name__in=new_merchants).values_list('normalized_name', 'id')
+            )
+        for key in new_merchants:
+            resolved[key] = created[key]
+            index.add(created[key], key)
+            aliases.append(MerchantAlias(alias=key, merchant_id=created[key], source='exact', similarity=1.0))
+        for key, (merchant_key, similarity) in new_aliases.items():
+            resolved[key] = created[merchant_key]
+            aliases.append(MerchantAlias(alias=key, merchant_id=created[merchant_key], source='fuzzy', similarity=similarity))
+        _bump_index_generation()
+
+    # Concurrent imports may have stored the same alias; theirs is as good
+    MerchantAlias.objects.bulk_create(aliases, ignore_conflicts=True)
+    return resolved
+
+
+def resolve(raw, create=True):
+    """Merchant for one raw string, or None"""
+    merchant_id = resolve_many([raw], create=create).get(raw)
+    return Merchant.objects.filter(id=merchant_id).first() if merchant_id else None
+
+
+def canonical_name(raw):
+    """Canonical name of a known merchant for display, falling back to the raw string; never adds merchants"""
+    merchant = resolve(raw, create=False) if raw else None
+    return merchant.name if merchant else raw
+
+
+def assign_merchants(transactions):
+    """Set ``merchant_id`` on unsaved transactions from their merchant names, in place"""
+    resolved = resolve_many([t.merchant_name for t in transactions if t.merchant_name])
+    for t in transactions:
+        if t.merchant_name and t.merchant_id is None:
+            t.merchant_id = resolved.get(t.merchant_name)
+    return transactions
+
+
+def merge_merchants(source, target):
+    """Fold a duplicate merchant into another one (manual correction)"""
+    from .models import Transaction
+
+    with transaction.atomic():
+        aliases = list(source.aliases.values_list('alias', flat=True))
+        source.aliases.update(merchant=target, source='manual')
+        Transaction.objects.filter(merchant=source).update(merchant=target)
+        source.delete()
+    merchant_cache.cache.delete_many(list(_alias_cache_keys(aliases).values()))
+    _bump_index_generation()
+    return target
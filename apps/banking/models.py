@@ -27,18 +27,66 @@ class BankAccount(models.Model):
     is_active = models.BooleanField(default=True)
     is_sync_enabled = models.BooleanField(default=True)
     last_sync_at = models.DateTimeField(null=True, blank=True)
+    sync_failures = models.PositiveIntegerField(default=0, help_text="Consecutive failed syncs")
+    sync_retry_at = models.DateTimeField(
+        null=True, blank=True, help_text="Backoff after failed syncs: no scheduled sync before this"
+    )
+    relink_required = models.BooleanField(
+        default=False, help_text="The last sync failed in a way retrying cannot fix; not scheduled until re-linked"
+    )
     plaid_access_token = models.CharField(max_length=255, blank=True, null=True)
+    sync_cursor = models.TextField(blank=True, default='', help_text="Provider cursor of the last synced page")
+    rollups_built_at = models.DateTimeField(
+        null=True, blank=True, help_text="When daily rollups were first built; until then analytics reads transactions"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
         unique_together = ['user', 'account_id']
+        indexes = [
+            models.Index(fields=['last_sync_at']),
+        ]
 
     def __str__(self):
         return f"{self.institution_name} - {self.account_name}"
 
 
+class Merchant(models.Model):
+    """Canonical merchant that raw merchant strings resolve to"""
+    name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+class MerchantAlias(models.Model):
+    """Normalized raw merchant string mapped to its canonical merchant"""
+    SOURCE_CHOICES = [
+        ('exact', 'Exact'),
+        ('fuzzy', 'Fuzzy Match'),
+        ('manual', 'Manual'),
+    ]
+
+    alias = models.CharField(max_length=255, unique=True)
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE, related_name='aliases')
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='exact')
+    similarity = models.FloatField(default=1.0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'Merchant Aliases'
+
+    def __str__(self):
+        return f"{self.alias} -> {self.merchant}"
+
+
 class Transaction(models.Model):
     """Model for storing bank transactions imported via Plaid or manual entry"""
     TRANSACTION_TYPES = [
@@ -52,6 +100,9 @@ class Transaction(models.Model):
     currency = models.CharField(max_length=3, default='USD')
     description = models.TextField()
     merchant_name = models.CharField(max_length=255, blank=True, null=True)
+    merchant = models.ForeignKey(
+        Merchant, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions'
+    )
     category = models.CharField(max_length=100, blank=True, null=True)
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPES)
     transaction_date = models.DateField()
@@ -60,6 +111,12 @@ class Transaction(models.Model):
     is_pending = models.BooleanField(default=False)
     is_manual = models.BooleanField(default=False, help_text="True if manually entered")
     metadata = models.JSONField(default=dict, blank=True)
+    reconciled_expense = models.OneToOneField(
+        'expenses.Expense', on_delete=models.SET_NULL, null=True, blank=True, related_name='bank_transaction',
+        help_text="Manually entered expense this transaction is the bank record of"
+    )
+    reconciliation_score = models.FloatField(null=True, blank=True)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -68,13 +125,79 @@ class Transaction(models.Model):
         indexes = [
             models.Index(fields=['transaction_date']),
             models.Index(fields=['category']),
-            models.Index(fields=['merchant_name']),
+            models.Index(fields=['bank_account', 'transaction_date']),
         ]
 
     def __str__(self):
         return f"{self.description} - {self.amount}"
 
 
+class ReconciliationRejection(models.Model):
+    """Transaction and expense the user unlinked by hand; reconciliation never pairs them again"""
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='reconciliation_rejections')
+    expense = models.ForeignKey(
+        'expenses.Expense', on_delete=models.CASCADE, related_name='reconciliation_rejections'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['transaction', 'expense'], name='unique_reconciliation_rejection'),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id} is not {self.expense_id}"
+
+
+class TransactionDailyRollup(models.Model):
+    """Transaction totals of one account and day, per category, currency and type"""
+    bank_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='daily_rollups')
+    date = models.DateField()
+    category = models.CharField(max_length=100, blank=True, null=True)
+    currency = models.CharField(max_length=3)
+    transaction_type = models.CharField(max_length=10, choices=Transaction.TRANSACTION_TYPES)
+    total = models.DecimalField(max_digits=16, decimal_places=2)
+    count = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['bank_account', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['bank_account', 'date', 'category', 'currency', 'transaction_type'],
+                name='unique_daily_rollup'
+            ),
+            # NULLs never conflict in a unique index, so uncategorized rows need their own
+            models.UniqueConstraint(
+                fields=['bank_account', 'date', 'currency', 'transaction_type'],
+                condition=models.Q(category__isnull=True),
+                name='unique_uncategorized_daily_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.bank_account_id} {self.date} {self.category}: {self.total} {self.currency}"
+
+
+class ExchangeRate(models.Model):
+    """Daily rate of a currency: units of ``currency`` per one unit of the pivot currency (FX_PIVOT_CURRENCY)"""
+    date = models.DateField()
+    currency = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=20, decimal_places=10)
+    source = models.CharField(max_length=50, default='provider')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date', 'currency']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='unique_exchange_rate_per_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.currency}: {self.rate}"
+
+
 class TransactionCategory(models.Model):
     """Model for categorizing transactions"""
     name = models.CharField(max_length=100, unique=True)
@@ -100,15 +223,26 @@ class SyncLog(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
     ]
+    SOURCE_CHOICES = [
+        ('sync', 'Provider Sync'),
+        ('csv', 'CSV Import'),
+        ('ofx', 'OFX/QFX Import'),
+    ]
     
     bank_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='sync_logs')
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='sync')
+    import_file = models.FileField(upload_to='bank_imports/', null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    rows_processed = models.IntegerField(default=0)
     transactions_added = models.IntegerField(default=0)
     transactions_updated = models.IntegerField(default=0)
+    transactions_removed = models.IntegerField(default=0)
+    transactions_skipped = models.IntegerField(default=0, help_text="Rows not stored: already stored ones on import, unsupported currencies on sync")
+    rows_filtered = models.IntegerField(default=0, help_text="Imported rows outside the requested date range")
     error_message = models.TextField(blank=True, null=True)
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
-    duration_seconds = models.IntegerField(null=True, blank=True)
+    duration_seconds = models.FloatField(null=True, blank=True)
 
     class Meta:
         ordering = ['-started_at']
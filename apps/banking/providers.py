@@ -0,0 +1,235 @@
+"""
+Bank data providers for transaction sync.
+
+A provider pages through an account's transaction changes since a cursor,
+Plaid ``/transactions/sync`` style: every page has added, modified and
+removed transactions plus the cursor to continue from. ``iter_pages`` turns
+that into a stream so the sync engine never holds more than one page.
+
+``PlaidSyncProvider`` talks to Plaid's REST API and is the default.
+``FakeSyncProvider`` simulates a bank locally (deterministic transactions,
+pending ones that post two days later, optional latency); it is only the
+default with ``DEBUG`` on, for development and tests.
+"""
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+class ProviderError(Exception):
+    """A provider request failed; ``retryable`` errors are worth another attempt later"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+@dataclass
+class ProviderTransaction:
+    transaction_id: str
+    amount: Decimal  # Positive for money leaving the account
+    currency: str
+    description: str
+    transaction_date: date
+    merchant_name: Optional[str] = None
+    category: Optional[str] = None
+    posted_date: Optional[date] = None
+    is_pending: bool = False
+    pending_transaction_id: Optional[str] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class SyncPage:
+    added: List[ProviderTransaction]
+    modified: List[ProviderTransaction]
+    removed: List[str]
+    next_cursor: str
+    has_more: bool
+
+
+class BaseSyncProvider:
+    """Interface of transaction sync providers"""
+    page_size = 500
+
+    def fetch_page(self, account, cursor: str) -> SyncPage:
+        raise NotImplementedError
+
+    def iter_pages(self, account, cursor: str) -> Iterator[SyncPage]:
+        """Stream pages from ``cursor`` until the provider has nothing more"""
+        while True:
+            page = self.fetch_page(account, cursor)
+            yield page
+            cursor = page.next_cursor
+            if not page.has_more:
+                return
+
+
+class FakeSyncProvider(BaseSyncProvider):
+    """
+    Deterministic simulated bank.
+
+    Transaction ``i`` of an account happens on ``start + i // per_day``, where
+    ``start`` is 90 days before the account was created. Transactions from the
+    last two days are reported as pending and re-reported as posted (with a new
+    id and ``pending_transaction_id``) once they are older. The cursor is
+    ``"<posted through>:<pending through>"``.
+    """
+    HISTORY_DAYS = 90
+    PENDING_DAYS = 2
+    MERCHANTS = [
+        ('AMZN MKTP US*{ref}', 'Shopping'),
+        ('STARBUCKS STORE {ref}', 'Food and Drink'),
+        ('SQ *BLUE BOTTLE COFFEE', 'Food and Drink'),
+        ('SHELL OIL {ref}', 'Travel'),
+        ('WHOLEFDS MKT {ref}', 'Food and Drink'),
+        ('UBER *TRIP', 'Travel'),
+        ('NETFLIX.COM', 'Entertainment'),
+        ('PAYROLL DEPOSIT', 'Income'),
+    ]
+
+    def __init__(self, per_day=3, page_size=None, latency=None):
+        self.per_day = per_day
+        self.page_size = page_size or self.page_size
+        self.latency = settings.BANK_SYNC_FAKE_LATENCY if latency is None else latency
+
+    def _start(self, account):
+        created = timezone.localtime(account.created_at).date() if account.created_at else timezone.now().date()
+        return created - timedelta(days=self.HISTORY_DAYS)
+
+    def _transaction(self, account, index, start, posted):
+        rng = random.Random(f'{account.account_id}:{index}')
+        template, category = rng.choice(self.MERCHANTS)
+        merchant = template.format(ref=rng.randint(1000, 9999))
+        amount = Decimal(rng.randint(300, 12000)) / 100
+        if category == 'Income':
+            amount = -amount * 20
+        day = start + timedelta(days=index // self.per_day)
+        return ProviderTransaction(
+            transaction_id=f"{'post' if posted else 'pend'}-{account.account_id}-{index}",
+            amount=amount,
+            currency=account.currency,
+            description=merchant,
+            merchant_name=merchant,
+            category=category,
+            transaction_date=day,
+            posted_date=day + timedelta(days=self.PENDING_DAYS) if posted else None,
+            is_pending=not posted,
+            pending_transaction_id=f'pend-{account.account_id}-{index}' if posted else None,
+        )
+
+    def fetch_page(self, account, cursor):
+        if self.latency:
+            time.sleep(self.latency)
+
+        start = self._start(account)
+        today = timezone.now().date()
+        posted_through, pending_through = (int(part) for part in (cursor or '0:0').split(':'))
+        # Indices below posted_limit are settled; the rest up to total are pending
+        posted_limit = max((today - start).days + 1 - self.PENDING_DAYS, 0) * self.per_day
+        total = ((today - start).days + 1) * self.per_day
+
+        added = []
+        while posted_through < posted_limit and len(added) < self.page_size:
+            added.append(self._transaction(account, posted_through, start, posted=True))
+            if posted_through >= pending_through:
+                # Never seen as pending: a plain new posted transaction
+                added[-1].pending_transaction_id = None
+            posted_through += 1
+        pending_through = max(pending_through, posted_through)
+        while pending_through < total and len(added) < self.page_size:
+            added.append(self._transaction(account, pending_through, start, posted=False))
+            pending_through += 1
+
+        return SyncPage(
+            added=added,
+            modified=[],
+            # Posted transactions replace their pending versions
+            removed=[t.pending_transaction_id for t in added if t.pending_transaction_id],
+            next_cursor=f'{posted_through}:{pending_through}',
+            has_more=posted_through < posted_limit or pending_through < total,
+        )
+
+
+class PlaidSyncProvider(BaseSyncProvider):
+    """Plaid ``/transactions/sync`` over its REST API"""
+
+    def __init__(self, page_size=None):
+        if not settings.PLAID_CLIENT_ID or not settings.PLAID_SECRET:
+            raise ImproperlyConfigured('PLAID_CLIENT_ID and PLAID_SECRET must be set to sync with Plaid')
+        self.page_size = min(page_size or self.page_size, 500)
+        self.base_url = f"https://{settings.PLAID_ENV}.plaid.com"
+        self.session = requests.Session()
+
+    def fetch_page(self, account, cursor):
+        if not account.plaid_access_token:
+            raise ProviderError('Account is not linked to Plaid', retryable=False)
+
+        payload = {
+            'client_id': settings.PLAID_CLIENT_ID,
+            'secret': settings.PLAID_SECRET,
+            'access_token': account.plaid_access_token,
+            'count': self.page_size,
+        }
+        if cursor:
+            payload['cursor'] = cursor
+
+        try:
+            response = self.session.post(
+                f'{self.base_url}/transactions/sync', json=payload, timeout=settings.BANK_SYNC_TIMEOUT
+            )
+        except requests.RequestException as e:
+            raise ProviderError(f'Plaid request failed: {e}')
+
+        try:
+            data = response.json()
+        except ValueError:
+            # Gateways and outages answer with HTML; worth another attempt
+            data = None
+        if response.status_code != 200:
+            # Rate limits and Plaid-side errors clear up; bad credentials do not
+            retryable = response.status_code == 429 or response.status_code >= 500
+            if data is None:
+                raise ProviderError(f'Plaid error: HTTP {response.status_code}', retryable=retryable)
+            raise ProviderError(
+                f"Plaid error {data.get('error_code')}: {data.get('error_message')}", retryable=retryable
+            )
+        if data is None:
+            raise ProviderError('Plaid returned a response that is not JSON')
+
+        return SyncPage(
+            added=[self._transaction(t) for t in data['added'] if t['account_id'] == account.account_id],
+            modified=[self._transaction(t) for t in data['modified'] if t['account_id'] == account.account_id],
+            removed=[t['transaction_id'] for t in data['removed']],
+            next_cursor=data['next_cursor'],
+            has_more=data['has_more'],
+        )
+
+    def _transaction(self, t):
+        category = (t.get('personal_finance_category') or {}).get('primary') or next(iter(t.get('category') or []), None)
+        return ProviderTransaction(
+            transaction_id=t['transaction_id'],
+            amount=Decimal(str(t['amount'])),
+            currency=t.get('iso_currency_code') or t.get('unofficial_currency_code') or 'USD',
+            description=t.get('name') or t.get('merchant_name') or '',
+            merchant_name=t.get('merchant_name'),
+            category=category,
+            transaction_date=date.fromisoformat(t.get('authorized_date') or t['date']),
+            posted_date=None if t['pending'] else date.fromisoformat(t['date']),
+            is_pending=t['pending'],
+            pending_transaction_id=t.get('pending_transaction_id'),
+            metadata={'payment_channel': t.get('payment_channel')},
+        )
+
+
+def get_provider():
+    return import_string(settings.BANK_SYNC_PROVIDER)()
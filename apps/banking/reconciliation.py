@@ -0,0 +1,176 @@
+"""
+Reconciliation of bank transactions with manually entered expenses.
+
+A user who enters an expense and also syncs the card it was paid with has the
+same spend twice. A debit is matched to an expense when the amounts are equal
+to the cent, the dates are at most ``RECONCILE_DATE_WINDOW_DAYS`` apart and
+the score (date proximity plus merchant similarity) is high enough. Pairs
+without a similar merchant name only match when neither side has another
+candidate. The match is stored as ``Transaction.reconciled_expense``.
+
+Candidates are generated without comparing every pair: rows are hashed into
+buckets by user and amount in cents, each bucket is sorted by date and swept
+with a moving window. Pairs the user unlinked by hand
+(``ReconciliationRejection``) are dropped, and the rest are accepted greedily,
+best score first, so every expense and every transaction is linked at most
+once. A whole chunk of
+users costs two reads and one bulk update, which is what the backfill relies
+on to reconcile years of history.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from apps.expenses.models import Expense
+from apps.users.versioning import bump_versions_many
+from .merchants import normalize, trigrams
+from .models import ReconciliationRejection, Transaction
+
+logger = logging.getLogger(__name__)
+
+DATE_WEIGHT = 0.6
+MERCHANT_WEIGHT = 0.4
+MIN_SCORE = 0.5
+MIN_MERCHANT_SIMILARITY = 0.5
+# Days of history the incremental run after a sync or a new expense looks at
+RECENT_DAYS = 90
+
+
+def _similarity(left, right):
+    """Similarity of two normalized merchant keys: trigram Jaccard, or word containment ("uber" in "uber ride")"""
+    if not left or not right:
+        return 0.0
+    if left == right:
+        return 1.0
+    left_grams, right_grams = trigrams(left), trigrams(right)
+    jaccard = len(left_grams & right_grams) / len(left_grams | right_grams)
+    left_words, right_words = set(left.split()), set(right.split())
+    containment = len(left_words & right_words) / min(len(left_words), len(right_words))
+    return max(jaccard, containment)
+
+
+def score(days_apart, expense_key, transaction_keys, window):
+    """(score, merchant similarity) of an expense and a transaction of the same amount"""
+    proximity = 1 - days_apart / (window + 1)
+    similarity = max((_similarity(expense_key, key) for key in transaction_keys), default=0.0)
+    return DATE_WEIGHT * proximity + MERCHANT_WEIGHT * similarity, similarity
+
+
+def _load(user_ids, since):
+    expenses = Expense.objects.filter(
+        user_id__in=user_ids, expense_type='expense', bank_transaction__isnull=True
+    )
+    # Expenses have no currency of their own: they are in the user's currency
+    transactions = Transaction.objects.filter(
+        bank_account__user_id__in=user_ids,
+        transaction_type='debit',
+        reconciled_expense__isnull=True,
+        amount_currency=F('bank_account__user__currency')
+    )
+    if since:
+        expenses = expenses.filter(transaction_date__gte=since)
+        transactions = transactions.filter(transaction_date__gte=since - timedelta(days=settings.RECONCILE_DATE_WINDOW_DAYS))
+
+    buckets = defaultdict(lambda: ([], []))
+    for expense_id, user_id, amount, day, title in expenses.values_list(
+        'id', 'user_id', 'amount', 'transaction_date', 'title'
+    ):
+        buckets[user_id, int(round(amount * 100))][0].append((day, expense_id, normalize(title)))
+    for transaction_id, user_id, amount, day, merchant_name, description, merchant_key in transactions.values_list(
+        'id', 'bank_account__user_id', 'amount', 'transaction_date', 'merchant_name', 'description',
+        'merchant__normalized_name'
+    ):
+        bucket = buckets.get((user_id, int(round(amount * 100))))
+        if bucket is not None:
+            keys = {merchant_key, normalize(merchant_name), normalize(description)} - {None, ''}
+            bucket[1].append((day, transaction_id, keys))
+
+    rejected = set(ReconciliationRejection.objects.filter(
+        transaction__bank_account__user_id__in=user_ids
+    ).values_list('expense_id', 'transaction_id'))
+    return buckets, rejected
+
+
+def candidate_pairs(expenses, transactions, window):
+    """(score, similarity, expense id, transaction id) within ``window`` days, by sort and sweep over date-ordered lists"""
+    expenses = sorted(expenses, key=lambda row: row[0])
+    transactions = sorted(transactions, key=lambda row: row[0])
+    window_delta = timedelta(days=window)
+    pairs = []
+    low = 0
+    for day, transaction_id, transaction_keys in transactions:
+        while low < len(expenses) and expenses[low][0] < day - window_delta:
+            low += 1
+        i = low
+        while i < len(expenses) and expenses[i][0] <= day + window_delta:
+            expense_day, expense_id, expense_key = expenses[i]
+            pairs.append((
+                *score(abs((day - expense_day).days), expense_key, transaction_keys, window),
+                expense_id,
+                transaction_id
+            ))
+            i += 1
+    return pairs
+
+
+def match(buckets, window, rejected=frozenset()):
+    """{transaction id: (expense id, score)}, each expense and transaction used once, never a rejected pair"""
+    pairs = []
+    for expenses, transactions in buckets.values():
+        if expenses and transactions:
+            pairs.extend(candidate_pairs(expenses, transactions, window))
+    pairs = [pair for pair in pairs if (pair[2], pair[3]) not in rejected]
+
+    # Without merchant evidence, amount and date only settle it when neither side has another candidate
+    expense_candidates = Counter(pair[2] for pair in pairs)
+    transaction_candidates = Counter(pair[3] for pair in pairs)
+    pairs = [
+        pair for pair in pairs
+        if pair[0] >= MIN_SCORE and (
+            pair[1] >= MIN_MERCHANT_SIMILARITY
+            or expense_candidates[pair[2]] == transaction_candidates[pair[3]] == 1
+        )
+    ]
+
+    pairs.sort(key=lambda pair: (-pair[0], pair[2], pair[3]))
+    matched, used_expenses = {}, set()
+    for pair_score, _, expense_id, transaction_id in pairs:
+        if transaction_id in matched or expense_id in used_expenses:
+            continue
+        matched[transaction_id] = (expense_id, round(pair_score, 3))
+        used_expenses.add(expense_id)
+    return matched
+
+
+def reconcile(user_ids, since=None):
+    """Link unmatched debits and expenses of the given users; returns the number of new links"""
+    window = settings.RECONCILE_DATE_WINDOW_DAYS
+    buckets, rejected = _load(user_ids, since)
+    matched = match(buckets, window, rejected)
+    if not matched:
+        return 0
+
+    now = timezone.now()
+    Transaction.objects.bulk_update(
+        [
+            Transaction(id=transaction_id, reconciled_expense_id=expense_id, reconciliation_score=pair_score,
+                        reconciled_at=now)
+            for transaction_id, (expense_id, pair_score) in matched.items()
+        ],
+        ['reconciled_expense', 'reconciliation_score', 'reconciled_at'],
+        batch_size=1000
+    )
+    owners = set(
+        Transaction.objects.filter(id__in=matched.keys()).values_list('bank_account__user_id', flat=True).distinct()
+    )
+    bump_versions_many(owners, 'transactions', 'expenses')
+    return len(matched)
+
+
+def reconcile_recent(user_id):
+    """Incremental run for one user over recent history"""
+    return reconcile([user_id], since=timezone.now().date() - timedelta(days=RECENT_DAYS))
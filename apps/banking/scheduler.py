@@ -0,0 +1,150 @@
+"""
+Scheduled sync of all bank accounts.
+
+Every few minutes the accounts that are due are picked and synced on a
+thread pool of bounded size: a sync is mostly waiting on the provider, so
+threads overlap that waiting while each keeps its own database connection.
+
+* Due time: ``last_sync_at + interval + jitter``. The jitter is a stable
+  fraction of the interval derived from the account id, so accounts linked at
+  the same moment drift apart instead of all coming due in the same run.
+* Backoff: after consecutive failed syncs the next attempt waits
+  ``base * 2^(failures - 1)``, capped, from the last failure. The sync stores
+  that time on the account (``sync_retry_at``), so backed-off accounts are
+  filtered out in SQL and never crowd due ones out of a run. Accounts whose
+  sync failed for good (``relink_required``, e.g. revoked credentials) are
+  not scheduled until they are re-linked or a manual sync succeeds.
+* Rate limits: every provider page request takes a token from the bucket of
+  the account's institution, so one run never floods a single bank however
+  many of its accounts are due.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import BankAccount, SyncLog
+from .providers import BaseSyncProvider, get_provider
+from .sync import LOCK_TIMEOUT, SyncInProgress, sync_account
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts up to ``capacity``"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one if the bucket is empty"""
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class RateLimitedProvider(BaseSyncProvider):
+    """Provider wrapper that takes a bucket token before every page request"""
+
+    def __init__(self, provider, bucket):
+        self.provider = provider
+        self.bucket = bucket
+
+    def fetch_page(self, account, cursor):
+        self.bucket.acquire()
+        return self.provider.fetch_page(account, cursor)
+
+
+def _jitter(account):
+    """Stable per-account fraction of the interval, in [0, BANK_SYNC_JITTER)"""
+    digest = hashlib.md5(account.account_id.encode()).digest()
+    return int.from_bytes(digest[:4], 'big') / 2 ** 32 * settings.BANK_SYNC_JITTER
+
+
+def next_sync_at(account):
+    """When an account is next due for a scheduled sync"""
+    if account.sync_retry_at:
+        return account.sync_retry_at
+    if account.last_sync_at is None:
+        return account.created_at
+    interval = timedelta(minutes=settings.BANK_SYNC_INTERVAL_MINUTES)
+    return account.last_sync_at + interval * (1 + _jitter(account))
+
+
+def due_accounts(now=None, limit=None):
+    """Accounts due for a scheduled sync, most overdue first"""
+    now = now or timezone.now()
+    limit = limit or settings.BANK_SYNC_BATCH_SIZE
+    interval = timedelta(minutes=settings.BANK_SYNC_INTERVAL_MINUTES)
+
+    # Jitter only ever delays, so anything synced within the interval is not due
+    candidates = list(
+        BankAccount.objects.filter(is_active=True, is_sync_enabled=True, relink_required=False).filter(
+            Q(sync_retry_at__lte=now)
+            | Q(sync_retry_at__isnull=True) & (Q(last_sync_at__isnull=True) | Q(last_sync_at__lte=now - interval))
+        ).exclude(
+            # Already queued, e.g. by a manual sync
+            id__in=SyncLog.objects.filter(
+                source='sync',
+                status__in=['pending', 'in_progress'],
+                started_at__gte=now - timedelta(seconds=LOCK_TIMEOUT)
+            ).values('bank_account_id')
+        ).order_by(F('last_sync_at').asc(nulls_first=True))[:limit * 4]
+    )
+
+    due = []
+    for account in candidates:
+        due_at = next_sync_at(account)
+        if due_at <= now:
+            due.append((due_at, account))
+    due.sort(key=lambda item: item[0])
+    return [account for _, account in due[:limit]]
+
+
+def run_syncs(accounts, provider_factory=get_provider, concurrency=None):
+    """Sync accounts concurrently under per-institution rate limits; returns counts by outcome"""
+    concurrency = concurrency or settings.BANK_SYNC_CONCURRENCY
+    buckets = defaultdict(lambda: TokenBucket(
+        settings.BANK_SYNC_INSTITUTION_RATE, settings.BANK_SYNC_INSTITUTION_BURST
+    ))
+    for account in accounts:
+        buckets[account.institution_name]
+
+    def _sync(account):
+        provider = RateLimitedProvider(provider_factory(), buckets[account.institution_name])
+        try:
+            return sync_account(account, provider=provider).status
+        except SyncInProgress:
+            return 'skipped'
+        except Exception:
+            logger.exception(f"Scheduled sync of bank account {account.id} failed")
+            return 'failed'
+        finally:
+            # Worker threads get their own connection; don't leak it
+            connection.close()
+
+    outcomes = defaultdict(int)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for outcome in executor.map(_sync, accounts):
+            outcomes[outcome] += 1
+    return dict(outcomes)
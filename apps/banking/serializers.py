@@ -10,24 +10,28 @@ class BankAccountSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'account_name', 'account_type', 'institution_name',
             'balance', 'currency', 'is_active', 'is_sync_enabled',
-            'last_sync_at', 'created_at', 'updated_at'
+            'last_sync_at', 'sync_retry_at', 'relink_required', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'last_sync_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'last_sync_at', 'sync_retry_at', 'relink_required']
 
 
 class TransactionSerializer(serializers.ModelSerializer):
     """Serializer for Transaction model"""
     category_name = serializers.CharField(source='category', read_only=True)
+    merchant_display_name = serializers.CharField(source='merchant.name', read_only=True, default=None)
     
     class Meta:
         model = Transaction
         fields = [
             'id', 'transaction_id', 'amount', 'currency', 'description',
-            'merchant_name', 'category', 'category_name', 'transaction_type',
-            'transaction_date', 'posted_date', 'account_balance', 'is_pending',
-            'is_manual', 'metadata', 'created_at', 'updated_at'
+            'merchant_name', 'merchant', 'merchant_display_name', 'category', 'category_name',
+            'transaction_type', 'transaction_date', 'posted_date', 'account_balance', 'is_pending',
+            'is_manual', 'metadata', 'reconciled_expense', 'reconciliation_score', 'reconciled_at',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'id', 'merchant', 'reconciled_expense', 'reconciliation_score', 'reconciled_at', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
 
 
 class TransactionCategorySerializer(serializers.ModelSerializer):
@@ -45,8 +49,8 @@ class SyncLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = SyncLog
         fields = [
-            'id', 'status', 'transactions_added', 'transactions_updated',
-            'error_message', 'started_at', 'completed_at', 'duration_seconds'
+            'id', 'source', 'status', 'rows_processed', 'transactions_added', 'transactions_updated',
+            'transactions_removed', 'transactions_skipped', 'rows_filtered', 'error_message', 'started_at', 'completed_at', 'duration_seconds'
         ]
         read_only_fields = ['id', 'started_at', 'completed_at', 'duration_seconds']
 
@@ -65,10 +69,29 @@ class BankAccountCreateSerializer(serializers.ModelSerializer):
 class TransactionImportSerializer(serializers.Serializer):
     """Serializer for importing transactions"""
     account_id = serializers.IntegerField()
-    start_date = serializers.DateField()
-    end_date = serializers.DateField()
-    import_type = serializers.ChoiceField(choices=['manual', 'plaid', 'csv'])
+    start_date = serializers.DateField(required=False, allow_null=True)
+    end_date = serializers.DateField(required=False, allow_null=True)
+    # 'manual' imports a statement file of either format, detected from its content
+    import_type = serializers.ChoiceField(choices=['manual', 'plaid', 'csv', 'ofx', 'qfx'])
     file = serializers.FileField(required=False, allow_null=True)
+    column_mapping = serializers.JSONField(required=False, default=dict)
+
+    def validate_column_mapping(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected an object of field to column name")
+        return value
+
+    def validate(self, data):
+        if data['import_type'] != 'plaid' and not data.get('file'):
+            raise serializers.ValidationError({'file': "A statement file is required for this import type"})
+        if data.get('start_date') and data.get('end_date') and data['start_date'] > data['end_date']:
+            raise serializers.ValidationError("start_date must be before end_date")
+        return data
+
+
+class TransactionReconcileSerializer(serializers.Serializer):
+    """Serializer for linking a transaction to an expense by hand (null unlinks)"""
+    expense_id = serializers.IntegerField(allow_null=True)
 
 
 class TransactionFilterSerializer(serializers.Serializer):
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from apps.expenses.models import Expense
+from apps.users.versioning import bump_versions
+from . import rollups
+from .merchants import assign_merchants
+from .models import BankAccount, Transaction
+from .tasks import schedule_reconciliation
+
+
+@receiver([post_save, post_delete], sender=Transaction)
+def bump_transaction_version(sender, instance, **kwargs):
+    """Invalidate cached transaction analytics for the account owner"""
+    bump_versions(instance.bank_account.user_id, 'transactions')
+
+
+@receiver(pre_save, sender=BankAccount)
+def reset_sync_backoff_on_relink(sender, instance, update_fields=None, **kwargs):
+    """A new access token is a re-link: schedule the account again right away"""
+    if not instance.pk or (update_fields is not None and 'plaid_access_token' not in update_fields):
+        return
+    stored = BankAccount.objects.filter(pk=instance.pk).values_list('plaid_access_token', flat=True).first()
+    if stored != instance.plaid_access_token:
+        instance.sync_failures, instance.sync_retry_at, instance.relink_required = 0, None, False
+        if update_fields is not None:
+            BankAccount.objects.filter(pk=instance.pk).update(sync_failures=0, sync_retry_at=None, relink_required=False)
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_stored_transaction(sender, instance, **kwargs):
+    """Keep the stored version of an updated transaction for the handlers below"""
+    if instance.pk:
+        instance._stored = Transaction.objects.filter(pk=instance.pk).values(
+            'bank_account_id', 'transaction_date', 'merchant_name', 'merchant_id'
+        ).first()
+
+
+@receiver(pre_save, sender=Transaction)
+def resolve_transaction_merchant(sender, instance, **kwargs):
+    """Link single writes to their canonical merchant, again when the name changes; importers resolve in bulk"""
+    stored = getattr(instance, '_stored', None)
+    if stored and stored['merchant_name'] != instance.merchant_name and stored['merchant_id'] == instance.merchant_id:
+        instance.merchant_id = None
+    if instance.merchant_name and instance.merchant_id is None:
+        assign_merchants([instance])
+
+
+def _refresh_rollups(account_id, days):
+    transaction.on_commit(lambda: rollups.refresh_rollups(account_id, days))
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollups(sender, instance, created, **kwargs):
+    """Recompute the rollups of the days a single write touched"""
+    previous = None if created else getattr(instance, '_stored', None)
+    if previous and previous['bank_account_id'] != instance.bank_account_id:
+        # Moved to another account: the old account loses it
+        _refresh_rollups(previous['bank_account_id'], [previous['transaction_date']])
+        previous = None
+    _refresh_rollups(
+        instance.bank_account_id, [instance.transaction_date, previous['transaction_date'] if previous else None]
+    )
+
+
+@receiver(post_delete, sender=Transaction)
+def remove_from_rollups(sender, instance, **kwargs):
+    _refresh_rollups(instance.bank_account_id, [instance.transaction_date])
+
+
+@receiver(post_save, sender=Expense)
+def reconcile_new_expense(sender, instance, created, **kwargs):
+    """Look for the bank record of a new manual expense once syncs have had a chance to land"""
+    if created and instance.expense_type == 'expense' and BankAccount.objects.filter(user_id=instance.user_id).exists():
+        schedule_reconciliation(instance.user_id)
@@ -0,0 +1,219 @@
+"""
+Incremental bank transaction sync.
+
+Each ``BankAccount`` keeps the provider cursor of the last page it applied.
+A sync streams the pages after that cursor and applies each one in its own
+database transaction together with the new cursor, so an interrupted sync
+resumes where it stopped and never applies a page twice:
+
+* added and modified transactions are upserted in one ``bulk_create`` on
+  ``transaction_id``, after a single lookup that splits them into new and
+  updated rows;
+* a posted transaction that replaces a pending one takes over the pending
+  row (its ``transaction_id`` is renamed), so links to the row survive;
+* removed transactions are deleted in one query;
+* rows in currencies money fields cannot hold (Plaid's unofficial codes
+  such as BTC) are skipped and counted on the SyncLog;
+* the daily rollups of the days the page touched are recomputed.
+
+Bulk writes skip model signals, so merchants are resolved per page and the
+owner's transaction data version is bumped once at the end.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from djmoney.money import Money
+from moneyed import CurrencyDoesNotExist, get_currency
+
+from apps.users.versioning import bump_versions
+from config.cache import CacheNamespace
+from . import rollups
+from .merchants import assign_merchants
+from .models import SyncLog, Transaction
+from .providers import ProviderError, get_provider
+
+logger = logging.getLogger(__name__)
+
+sync_cache = CacheNamespace('bank_sync')
+LOCK_TIMEOUT = 60 * 30
+
+UPSERT_FIELDS = [
+    'amount', 'amount_currency', 'currency', 'description', 'merchant_name', 'merchant',
+    'category', 'transaction_type', 'transaction_date', 'posted_date', 'is_pending',
+    'metadata', 'updated_at',
+]
+
+
+class SyncInProgress(Exception):
+    """Another worker is syncing the same account"""
+
+
+def backoff(failures):
+    """Delay before retrying an account after ``failures`` consecutive failed syncs"""
+    if failures <= 0:
+        return timedelta(0)
+    minutes = settings.BANK_SYNC_BACKOFF_BASE_MINUTES * 2 ** min(failures - 1, 16)
+    return timedelta(minutes=min(minutes, settings.BANK_SYNC_BACKOFF_MAX_MINUTES))
+
+
+def is_known_currency(code):
+    """Whether money amounts can be stored in ``code`` (Plaid also sends unofficial codes such as BTC)"""
+    try:
+        get_currency(code)
+    except CurrencyDoesNotExist:
+        return False
+    return True
+
+
+def build_transaction(account, item):
+    """Unsaved Transaction of an account from a provider row"""
+    return Transaction(
+        bank_account=account,
+        transaction_id=item.transaction_id,
+        # Providers sign amounts by direction; rows store a positive amount and a type
+        amount=Money(abs(item.amount), item.currency),
+        currency=item.currency,
+        description=item.description,
+        merchant_name=item.merchant_name,
+        category=item.category,
+        transaction_type='debit' if item.amount > 0 else 'credit',
+        transaction_date=item.transaction_date,
+        posted_date=item.posted_date,
+        is_pending=item.is_pending,
+        metadata=item.metadata,
+    )
+
+
+def _promote_pending(account, items):
+    """Rename pending rows to the ids of the posted transactions that replace them"""
+    renames = {
+        item.pending_transaction_id: item.transaction_id
+        for item in items
+        if item.pending_transaction_id and not item.is_pending
+    }
+    if not renames:
+        return 0
+
+    already_posted = set(
+        Transaction.objects.filter(transaction_id__in=renames.values()).values_list('transaction_id', flat=True)
+    )
+    pending = list(
+        Transaction.objects.filter(
+            bank_account=account, transaction_id__in=renames.keys(), is_pending=True
+        ).only('id', 'transaction_id')
+    )
+    promoted = [row for row in pending if renames[row.transaction_id] not in already_posted]
+    for row in promoted:
+        row.transaction_id = renames[row.transaction_id]
+    Transaction.objects.bulk_update(promoted, ['transaction_id'])
+    return len(promoted)
+
+
+def apply_page(account, page):
+    """Write one provider page; returns (added, updated, removed, skipped) counts"""
+    # The last version of a transaction within a page wins
+    items = {item.transaction_id: item for item in page.added + page.modified}
+    _promote_pending(account, items.values())
+
+    stored = Transaction.objects.filter(
+        transaction_id__in=[*items, *page.removed]
+    ).values_list('transaction_id', 'bank_account_id', 'transaction_date')
+    owners = {}
+    # Days whose rollups change: the new dates and the stored dates of updated or removed rows
+    touched = {item.transaction_date for item in items.values()}
+    for transaction_id, owner, transaction_date in stored:
+        owners[transaction_id] = owner
+        if owner == account.id:
+            touched.add(transaction_date)
+    foreign = {transaction_id for transaction_id in items if owners.get(transaction_id, account.id) != account.id}
+    if foreign:
+        # Transaction ids are globally unique; never let one account overwrite another's rows
+        logger.warning(f"Skipping {len(foreign)} transactions of account {account.id} owned by other accounts")
+
+    unsupported = {transaction_id for transaction_id, item in items.items() if not is_known_currency(item.currency)}
+    if unsupported:
+        # Skipped rather than failing the page, which would hold the cursor back for good
+        currencies = sorted({items[transaction_id].currency for transaction_id in unsupported})
+        logger.warning(
+            f"Skipping {len(unsupported)} transactions of account {account.id} in unsupported currencies {currencies}"
+        )
+
+    rows = [
+        build_transaction(account, item) for transaction_id, item in items.items()
+        if transaction_id not in foreign and transaction_id not in unsupported
+    ]
+    assign_merchants(rows)
+    Transaction.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['transaction_id'],
+        update_fields=UPSERT_FIELDS,
+    )
+
+    removed = 0
+    if page.removed:
+        removed, _ = Transaction.objects.filter(bank_account=account, transaction_id__in=page.removed).delete()
+
+    rollups.refresh_rollups(account.id, touched)
+    updated = sum(1 for row in rows if row.transaction_id in owners)
+    return len(rows) - updated, updated, removed, len(unsupported)
+
+
+def sync_account(account, sync_log=None, provider=None):
+    """Pull an account's changes since its cursor; returns the finished SyncLog"""
+    lock_key = sync_cache.key('lock', account.id)
+    if not sync_cache.cache.add(lock_key, 1, LOCK_TIMEOUT):
+        raise SyncInProgress(f"Account {account.id} is already syncing")
+
+    started = time.monotonic()
+    sync_log = sync_log or SyncLog(bank_account=account)
+    sync_log.transactions_added = sync_log.transactions_updated = sync_log.transactions_removed = 0
+    sync_log.transactions_skipped = 0
+
+    try:
+        # Inside the try: a misconfigured provider fails the log and releases the lock
+        provider = provider or get_provider()
+        sync_log.status = 'in_progress'
+        sync_log.save()
+        for page in provider.iter_pages(account, account.sync_cursor):
+            with transaction.atomic():
+                added, updated, removed, skipped = apply_page(account, page)
+                account.sync_cursor = page.next_cursor
+                account.save(update_fields=['sync_cursor'])
+            sync_log.transactions_added += added
+            sync_log.transactions_updated += updated
+            sync_log.transactions_removed += removed
+            sync_log.transactions_skipped += skipped
+
+        if account.rollups_built_at is None:
+            rollups.rebuild_rollups(account)
+        account.last_sync_at = timezone.now()
+        account.sync_failures, account.sync_retry_at, account.relink_required = 0, None, False
+        account.save(update_fields=['last_sync_at', 'sync_failures', 'sync_retry_at', 'relink_required'])
+        sync_log.status = 'completed'
+    except Exception as e:
+        # Pages applied so far stay applied; the next sync resumes from the saved cursor
+        logger.exception(f"Sync of bank account {account.id} failed")
+        sync_log.status = 'failed'
+        sync_log.error_message = str(e)
+        account.sync_failures += 1
+        account.sync_retry_at = timezone.now() + backoff(account.sync_failures)
+        # Revoked or missing credentials fail until the account is re-linked
+        account.relink_required = isinstance(e, ProviderError) and not e.retryable
+        account.save(update_fields=['sync_failures', 'sync_retry_at', 'relink_required'])
+    finally:
+        sync_cache.cache.delete(lock_key)
+        sync_log.completed_at = timezone.now()
+        sync_log.duration_seconds = round(time.monotonic() - started, 3)
+        sync_log.save()
+        if sync_log.transactions_added or sync_log.transactions_updated or sync_log.transactions_removed:
+            bump_versions(account.user_id, 'transactions')
+        if sync_log.transactions_added or sync_log.transactions_updated:
+            from .tasks import schedule_reconciliation
+            schedule_reconciliation(account.user_id)
+
+    return sync_log
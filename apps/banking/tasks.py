@@ -0,0 +1,174 @@
+import logging
+from datetime import date, timedelta
+
+from celery import group, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import fx, importers, reconciliation, rollups, scheduler
+from .analytics import banking_cache
+from .merchants import assign_merchants
+from .models import BankAccount, SyncLog, Transaction
+from .sync import SyncInProgress, sync_account
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_CHUNK_SIZE = 500
+
+
+def schedule_reconciliation(user_id):
+    """Queue one delayed reconciliation per user, however many syncs and expenses arrive meanwhile"""
+    delay = settings.RECONCILE_DELAY
+
+    def _schedule():
+        if cache.add(f'bank_reconciliation:{user_id}', 1, delay):
+            reconcile_user_transactions.apply_async((user_id,), countdown=delay)
+
+    transaction.on_commit(_schedule)
+
+
+@shared_task
+def canonicalize_merchants(batch_size=1000):
+    """Link transactions that predate merchant canonicalization to their merchants"""
+    linked = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Transaction.objects.filter(
+                id__gt=last_id,
+                merchant__isnull=True,
+                merchant_name__isnull=False
+            ).exclude(merchant_name='').order_by('id').only('id', 'merchant_name', 'merchant')[:batch_size]
+        )
+        if not batch:
+            break
+        assign_merchants(batch)
+        Transaction.objects.bulk_update(batch, ['merchant'])
+        linked += sum(1 for t in batch if t.merchant_id)
+        last_id = batch[-1].id
+
+    logger.info('Linked %s transactions to canonical merchants', linked)
+    return linked
+
+
+@shared_task
+def sync_bank_account(account_id, sync_log_id=None):
+    """Pull new transactions of one bank account from its provider"""
+    account = BankAccount.objects.filter(id=account_id, is_active=True, is_sync_enabled=True).first()
+    sync_log = SyncLog.objects.filter(id=sync_log_id).first() if sync_log_id else None
+    if account is None:
+        if sync_log:
+            SyncLog.objects.filter(id=sync_log.id).update(
+                status='failed', error_message='Account is inactive or sync is disabled'
+            )
+        return None
+
+    try:
+        sync_log = sync_account(account, sync_log)
+    except SyncInProgress as e:
+        logger.info(str(e))
+        if sync_log:
+            SyncLog.objects.filter(id=sync_log.id).update(status='failed', error_message=str(e))
+        return None
+    return sync_log.id
+
+
+@shared_task
+def sync_due_accounts():
+    """Sync every bank account that is due, with bounded concurrency"""
+    # Runs overlap when a batch takes longer than the beat interval
+    if not cache.add('bank_sync:scheduler_running', 1, 60 * 30):
+        logger.info('Scheduled bank sync is still running, skipping this run')
+        return {}
+    try:
+        accounts = scheduler.due_accounts()
+        outcomes = scheduler.run_syncs(accounts)
+    finally:
+        cache.delete('bank_sync:scheduler_running')
+    logger.info('Scheduled bank sync of %s accounts: %s', len(accounts), outcomes)
+    return outcomes
+
+
+@shared_task
+def import_bank_file(sync_log_id, file_format, mapping=None, start_date=None, end_date=None):
+    """Import an uploaded statement file, then delete it"""
+    sync_log = SyncLog.objects.select_related('bank_account').filter(id=sync_log_id).first()
+    if sync_log is None or not sync_log.import_file:
+        return None
+
+    try:
+        try:
+            statement = sync_log.import_file.open('rb')
+        except Exception as e:
+            # Missing from this worker's storage, or unreadable: the import can never run
+            logger.exception(f"Could not open the statement of sync log {sync_log.id}")
+            SyncLog.objects.filter(id=sync_log.id).update(
+                status='failed', error_message=f'Could not read the uploaded file: {e}', completed_at=timezone.now()
+            )
+            return None
+        with statement:
+            importers.import_file(
+                sync_log,
+                statement,
+                file_format,
+                mapping=mapping,
+                start_date=date.fromisoformat(start_date) if start_date else None,
+                end_date=date.fromisoformat(end_date) if end_date else None,
+            )
+    finally:
+        # Statements are sensitive; only the imported rows are kept
+        sync_log.import_file.delete(save=False)
+        SyncLog.objects.filter(id=sync_log.id).update(import_file=None)
+    return sync_log.id
+
+
+@shared_task
+def rebuild_transaction_rollups(batch_size=200):
+    """Build the daily rollups of accounts that don't have them yet"""
+    built = 0
+    for account in BankAccount.objects.filter(rollups_built_at__isnull=True)[:batch_size]:
+        rollups.rebuild_rollups(account)
+        built += 1
+    logger.info('Built daily transaction rollups of %s bank accounts', built)
+    return built
+
+
+@shared_task
+def reconcile_user_transactions(user_id):
+    """Link a user's recent bank debits to the expenses they entered by hand"""
+    return reconciliation.reconcile_recent(user_id)
+
+
+@shared_task
+def reconcile_transactions_chunk(user_ids):
+    """Reconcile the whole history of a chunk of users"""
+    linked = reconciliation.reconcile(user_ids)
+    logger.info('Reconciled %s transactions for %s users', linked, len(user_ids))
+    return linked
+
+
+@shared_task
+def reconcile_all_transactions():
+    """Backfill: fan reconciliation of every user with bank accounts out over workers"""
+    user_ids = list(
+        BankAccount.objects.values_list('user_id', flat=True).distinct().order_by('user_id')
+    )
+    chunks = [user_ids[i:i + RECONCILE_CHUNK_SIZE] for i in range(0, len(user_ids), RECONCILE_CHUNK_SIZE)]
+    group(reconcile_transactions_chunk.s(chunk) for chunk in chunks).apply_async()
+    return len(chunks)
+
+
+@shared_task
+def refresh_exchange_rates(days=7):
+    """Load the exchange rates of the last ``days`` days that are not stored yet (or the whole rates file)"""
+    start = timezone.now().date() - timedelta(days=days)
+    # Backfill back to the earliest transaction until stored rates cover it
+    start = min(start, fx.history_start() or start)
+    stored = fx.refresh_rates(start)
+    if stored:
+        # Cached analytics were converted with the previous rates
+        banking_cache.invalidate()
+    logger.info('Stored %s exchange rates', stored)
+    return stored
@@ -3,16 +3,54 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Sum, Count, Avg
+from django.db import transaction
 from django.utils import timezone
 from datetime import datetime, timedelta
 
-from .models import BankAccount, Transaction, TransactionCategory, SyncLog
+from apps.expenses.models import Expense
+from apps.users.versioning import bump_versions, version_token
+from config.db_router import reads_from_replica
+from .models import BankAccount, ReconciliationRejection, Transaction, TransactionCategory, SyncLog
 from .serializers import (
     BankAccountSerializer, TransactionSerializer, TransactionCategorySerializer,
     SyncLogSerializer, BankAccountCreateSerializer, TransactionImportSerializer,
-    TransactionFilterSerializer
+    TransactionFilterSerializer, TransactionReconcileSerializer
 )
+from . import importers
+from .analytics import (
+    CLOSED_RANGE_TIMEOUT, balance_summary, banking_cache, parse_date_range, transaction_analytics
+)
+from .fx import RateUnavailable
+from .sync import LOCK_TIMEOUT
+from .tasks import import_bank_file, reconcile_user_transactions, sync_bank_account
+
+
+def queue_sync(account):
+    """Queue a provider sync of an account unless one is already queued; returns the response"""
+    if not account.is_sync_enabled:
+        return Response(
+            {'error': 'Sync is disabled for this account'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # Logs older than the sync lock belong to workers that died mid-sync
+    running = account.sync_logs.filter(
+        source='sync',
+        status__in=['pending', 'in_progress'],
+        started_at__gte=timezone.now() - timedelta(seconds=LOCK_TIMEOUT)
+    ).first()
+    if running:
+        return Response(
+            {'message': 'Sync already queued', 'sync_log': SyncLogSerializer(running).data},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    sync_log = SyncLog.objects.create(bank_account=account, status='pending')
+    transaction.on_commit(lambda: sync_bank_account.delay(account.id, sync_log.id))
+    return Response(
+        {'message': 'Sync queued', 'sync_log': SyncLogSerializer(sync_log).data},
+        status=status.HTTP_202_ACCEPTED
+    )
 
 
 class BankAccountViewSet(viewsets.ModelViewSet):
@@ -26,69 +64,21 @@ class BankAccountViewSet(viewsets.ModelViewSet):
         return BankAccount.objects.filter(user=self.request.user)
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # A new account has no transactions, so its (empty) rollups are complete
+        serializer.save(user=self.request.user, rollups_built_at=timezone.now())
 
     @action(detail=True, methods=['post'])
     def sync_transactions(self, request, pk=None):
-        """Sync transactions for a specific bank account"""
-        account = self.get_object()
-        
-        # Create sync log
-        sync_log = SyncLog.objects.create(
-            bank_account=account,
-            status='in_progress'
-        )
-        
-        try:
-            # Here you would integrate with Plaid API
-            # For now, we'll simulate the sync
-            transactions_added = 0
-            transactions_updated = 0
-            
-            # Update sync log
-            sync_log.status = 'completed'
-            sync_log.transactions_added = transactions_added
-            sync_log.transactions_updated = transactions_updated
-            sync_log.completed_at = timezone.now()
-            sync_log.duration_seconds = 30  # Simulated duration
-            sync_log.save()
-            
-            account.last_sync_at = timezone.now()
-            account.save()
-            
-            return Response({
-                'message': 'Sync completed successfully',
-                'transactions_added': transactions_added,
-                'transactions_updated': transactions_updated
-            })
-            
-        except Exception as e:
-            sync_log.status = 'failed'
-            sync_log.error_message = str(e)
-            sync_log.completed_at = timezone.now()
-            sync_log.save()
-            
-            return Response(
-                {'error': str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        """Queue a sync of a bank account; poll the returned sync log for progress"""
+        return queue_sync(self.get_object())
 
     @action(detail=False, methods=['get'])
     def summary(self, request):
-        """Get summary of all bank accounts"""
-        accounts = self.get_queryset()
-        total_balance = accounts.aggregate(total=Sum('balance'))['total'] or 0
-        
-        account_summary = accounts.values('account_type').annotate(
-            count=Count('id'),
-            total_balance=Sum('balance')
-        )
-        
-        return Response({
-            'total_accounts': accounts.count(),
-            'total_balance': total_balance,
-            'account_summary': account_summary
-        })
+        """Get summary of all bank accounts, in the user's currency"""
+        try:
+            return Response(balance_summary(self.get_queryset(), request.user.currency))
+        except RateUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
 
 class TransactionViewSet(viewsets.ModelViewSet):
@@ -96,70 +86,125 @@ class TransactionViewSet(viewsets.ModelViewSet):
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['transaction_type', 'category', 'is_pending']
+    filterset_fields = ['transaction_type', 'category', 'merchant', 'is_pending']
 
     def get_queryset(self):
         return Transaction.objects.filter(
             bank_account__user=self.request.user
-        ).select_related('bank_account')
+        ).select_related('bank_account', 'merchant')
 
     @action(detail=False, methods=['post'])
     def import_transactions(self, request):
-        """Import transactions from various sources"""
+        """Queue an import of a statement file (or a provider sync); poll the returned sync log"""
         serializer = TransactionImportSerializer(data=request.data)
-        if serializer.is_valid():
-            # Here you would implement actual import logic
-            # For now, we'll return a success response
-            return Response({
-                'message': 'Import started',
-                'import_type': serializer.validated_data['import_type']
-            })
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        account = BankAccount.objects.filter(id=data['account_id'], user=request.user).first()
+        if account is None:
+            return Response({'error': 'Bank account not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        if data['import_type'] == 'plaid':
+            # Same checks as a manual sync: enabled, and not already queued
+            return queue_sync(account)
+
+        upload = data['file']
+        if data['import_type'] == 'manual':
+            file_format = importers.detect_format(upload.name, upload.read(1024))
+            upload.seek(0)
+        else:
+            file_format = 'csv' if data['import_type'] == 'csv' else 'ofx'
+
+        sync_log = SyncLog.objects.create(
+            bank_account=account, source=file_format, status='pending', import_file=upload
+        )
+        transaction.on_commit(lambda: import_bank_file.delay(
+            sync_log.id,
+            file_format,
+            mapping=data['column_mapping'],
+            start_date=data['start_date'].isoformat() if data.get('start_date') else None,
+            end_date=data['end_date'].isoformat() if data.get('end_date') else None,
+        ))
+
+        return Response(
+            {'message': 'Import queued', 'sync_log': SyncLogSerializer(sync_log).data},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=True, methods=['post'])
+    def link_expense(self, request, pk=None):
+        """Link this transaction to one of the user's expenses by hand, or unlink it"""
+        bank_transaction = self.get_object()
+        serializer = TransactionReconcileSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        expense_id = serializer.validated_data['expense_id']
+        expense = None
+        if expense_id is not None:
+            expense = Expense.objects.filter(id=expense_id, user=request.user).first()
+            if expense is None:
+                return Response({'error': 'Expense not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        with transaction.atomic():
+            # Pairs the user undoes are remembered, so reconciliation does not link them again
+            rejected = []
+            if bank_transaction.reconciled_expense_id and bank_transaction.reconciled_expense_id != expense_id:
+                rejected.append((bank_transaction.id, bank_transaction.reconciled_expense_id))
+            if expense is not None:
+                # An expense is the record of one bank transaction at most
+                others = Transaction.objects.filter(reconciled_expense=expense).exclude(id=bank_transaction.id)
+                rejected.extend((other_id, expense.id) for other_id in others.values_list('id', flat=True))
+                others.update(reconciled_expense=None, reconciliation_score=None, reconciled_at=None)
+                ReconciliationRejection.objects.filter(transaction=bank_transaction, expense=expense).delete()
+            ReconciliationRejection.objects.bulk_create(
+                [ReconciliationRejection(transaction_id=t, expense_id=e) for t, e in rejected], ignore_conflicts=True
+            )
+            bank_transaction.reconciled_expense = expense
+            bank_transaction.reconciliation_score = 1.0 if expense else None
+            bank_transaction.reconciled_at = timezone.now() if expense else None
+            bank_transaction.save(update_fields=[
+                'reconciled_expense', 'reconciliation_score', 'reconciled_at', 'updated_at'
+            ])
+        bump_versions(request.user.pk, 'expenses')
+        return Response(self.get_serializer(bank_transaction).data)
+
+    @action(detail=False, methods=['post'])
+    def reconcile(self, request):
+        """Queue matching of the user's unlinked bank debits to their manual expenses"""
+        user_id = request.user.pk
+        transaction.on_commit(lambda: reconcile_user_transactions.delay(user_id))
+        return Response({'message': 'Reconciliation queued'}, status=status.HTTP_202_ACCEPTED)
 
     @action(detail=False, methods=['get'])
+    @reads_from_replica
     def analytics(self, request):
-        """Get transaction analytics"""
-        queryset = self.get_queryset()
-        
-        # Date range filtering
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
-        
-        if start_date:
-            queryset = queryset.filter(transaction_date__gte=start_date)
-        if end_date:
-            queryset = queryset.filter(transaction_date__lte=end_date)
-        
-        # Calculate analytics
-        total_spent = queryset.filter(transaction_type='debit').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        total_received = queryset.filter(transaction_type='credit').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        category_spending = queryset.filter(transaction_type='debit').values(
-            'category'
-        ).annotate(
-            total=Sum('amount'),
-            count=Count('id')
-        ).order_by('-total')
-        
-        daily_spending = queryset.filter(transaction_type='debit').values(
-            'transaction_date'
-        ).annotate(
-            total=Sum('amount'),
-            count=Count('id')
-        ).order_by('transaction_date')
-        
-        return Response({
-            'total_spent': total_spent,
-            'total_received': total_received,
-            'net_amount': total_received - total_spent,
-            'category_spending': category_spending,
-            'daily_spending': daily_spending
-        })
+        """Get transaction analytics in the user's currency"""
+        try:
+            start_date, end_date = parse_date_range(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        try:
+            # Ranges that ended before today only change through late transactions, imports or
+            # backdated expenses, which bump the version token, and rate loads, which invalidate
+            # the namespace
+            if end_date and end_date < timezone.now().date():
+                data = banking_cache.get_or_compute(
+                    (
+                        'transaction_analytics', user.pk, user.currency, start_date, end_date,
+                        version_token(user.pk, 'transactions', 'expenses')
+                    ),
+                    lambda: transaction_analytics(user, start_date, end_date),
+                    timeout=CLOSED_RANGE_TIMEOUT
+                )
+            else:
+                data = transaction_analytics(user, start_date, end_date)
+        except RateUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(data)
 
 
 class TransactionCategoryViewSet(viewsets.ModelViewSet):
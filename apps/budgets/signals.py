@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.users.versioning import bump_versions
+from .models import Budget
+
+
+@receiver([post_save, post_delete], sender=Budget)
+def bump_budget_version(sender, instance, **kwargs):
+    """Invalidate cached budget aggregates for the owner"""
+    bump_versions(instance.user_id, 'budgets')
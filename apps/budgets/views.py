@@ -8,6 +8,9 @@ from django.db.models import Sum, Count
 from django.utils import timezone
 from datetime import datetime, timedelta
 from django.contrib.auth import get_user_model
+from django.utils.decorators import method_decorator
+
+from apps.users.versioning import data_version_condition
 
 from .models import Budget
 from .serializers import BudgetSerializer, BudgetCreateSerializer, BudgetUpdateSerializer
@@ -44,6 +47,7 @@ class BudgetViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
     @action(detail=False, methods=['get'])
+    @method_decorator(data_version_condition('budgets'))
     def summary(self, request):
         """Get budget summary for current user"""
         queryset = self.get_queryset()
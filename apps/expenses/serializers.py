@@ -32,6 +32,8 @@ class ExpenseCreateSerializer(serializers.ModelSerializer):
             'payment_method', 'transaction_date', 'location', 'receipt',
             'tags', 'is_recurring', 'recurring_frequency', 'is_split'
         ]
+        # Left out, the category is predicted from the user's history
+        extra_kwargs = {'category': {'required': False}}
 
 
 class RecurringExpenseSerializer(serializers.ModelSerializer):
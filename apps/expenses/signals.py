@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.users.versioning import bump_versions
+from .models import Expense
+
+
+@receiver([post_save, post_delete], sender=Expense)
+def bump_expense_version(sender, instance, **kwargs):
+    """Invalidate cached expense aggregates for the owner"""
+    bump_versions(instance.user_id, 'expenses')
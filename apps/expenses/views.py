@@ -6,8 +6,12 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.db.models import Sum, Count, Avg
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from datetime import datetime, timedelta
 
+from apps.ai.services import CategoryPredictionService
+from apps.users.versioning import data_version_condition
+
 from .models import Category, Expense, RecurringExpense
 from .serializers import (
     CategorySerializer, CategoryCreateSerializer,
@@ -79,10 +83,33 @@ class ExpenseViewSet(viewsets.ModelViewSet):
         return ExpenseSerializer
 
     def perform_create(self, serializer):
-        """Set the user to the current user"""
-        serializer.save(user=self.request.user)
+        """Set the user to the current user, predicting the category when it is left out"""
+        data = serializer.validated_data
+        service = CategoryPredictionService(self.request.user)
+        category, prediction = service.suggest_category(
+            data.get('title'), data.get('location'), data.get('amount')
+        )
+        
+        assigned = 'category' not in data
+        if assigned:
+            category = category or Category.objects.get_or_create(
+                name='Other',
+                defaults={'color': '#95a5a6'}
+            )[0]
+            expense = serializer.save(user=self.request.user, category=category)
+        else:
+            expense = serializer.save(user=self.request.user)
+        
+        service.record_prediction(expense, prediction, assigned=assigned)
+
+    def perform_update(self, serializer):
+        previous_category_id = serializer.instance.category_id
+        expense = serializer.save()
+        if expense.category_id != previous_category_id:
+            CategoryPredictionService(self.request.user).record_feedback(expense)
 
     @action(detail=False, methods=['get'])
+    @method_decorator(data_version_condition('expenses'))
     def summary(self, request):
         """Get expense summary"""
         expenses = self.get_queryset()
@@ -5,3 +5,6 @@ class NotificationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.notifications'
     verbose_name = 'Notifications'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,33 @@
+"""
+Async variants of the notification polling endpoints, served by the ASGI worker.
+"""
+from datetime import timedelta
+
+from django.http import JsonResponse
+from django.utils import timezone
+
+from apps.users.authentication import async_api_view
+from apps.users.versioning import async_data_version_condition
+from .models import Notification
+from .serializers import NotificationSerializer
+
+
+@async_api_view()
+@async_data_version_condition('notifications')
+async def unread_count(request):
+    """Async variant of NotificationViewSet.unread_count"""
+    count = await Notification.objects.filter(user=request.user, status='unread').acount()
+    return JsonResponse({'unread_count': count})
+
+
+@async_api_view()
+@async_data_version_condition('notifications')
+async def recent(request):
+    """Async variant of NotificationViewSet.recent"""
+    notifications = [
+        notification async for notification in Notification.objects.filter(
+            user=request.user,
+            created_at__gte=timezone.now() - timedelta(days=7)
+        ).select_related('user').order_by('-created_at')[:20]
+    ]
+    return JsonResponse(NotificationSerializer(notifications, many=True).data, safe=False)
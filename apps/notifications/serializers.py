@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from apps.users.versioning import bump_versions
 from .models import Notification, NotificationPreference
 
 
@@ -58,4 +59,5 @@ class NotificationMarkReadSerializer(serializers.Serializer):
             user=user
         )
         notifications.update(status='read')
+        bump_versions(user.pk, 'notifications')
         return notifications
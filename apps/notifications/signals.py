@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.users.versioning import bump_versions
+from .models import Notification
+
+
+@receiver([post_save, post_delete], sender=Notification)
+def bump_notification_version(sender, instance, **kwargs):
+    """Invalidate cached notification counts for the owner"""
+    bump_versions(instance.user_id, 'notifications')
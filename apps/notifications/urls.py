@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import NotificationViewSet, NotificationPreferenceViewSet
+from . import async_views
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()
@@ -8,5 +9,7 @@ router.register(r'notifications', NotificationViewSet, basename='notification')
 router.register(r'preferences', NotificationPreferenceViewSet, basename='notification-preference')
 
 urlpatterns = [
+    path('async/unread-count/', async_views.unread_count, name='async-notifications-unread-count'),
+    path('async/recent/', async_views.recent, name='async-notifications-recent'),
     path('', include(router.urls)),
 ]
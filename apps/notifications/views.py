@@ -4,6 +4,9 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from django.utils.decorators import method_decorator
+
+from apps.users.versioning import bump_versions, data_version_condition
 
 from .models import Notification, NotificationPreference
 from .serializers import (
@@ -56,12 +59,15 @@ class NotificationViewSet(viewsets.ModelViewSet):
         """Mark all unread notifications as read"""
         unread_notifications = self.get_queryset().filter(status='unread')
         count = unread_notifications.update(status='read')
+        if count:
+            bump_versions(request.user.pk, 'notifications')
         return Response({
             'message': f'{count} notifications marked as read',
             'count': count
         })
 
     @action(detail=False, methods=['get'])
+    @method_decorator(data_version_condition('notifications'))
     def unread_count(self, request):
         """Get count of unread notifications"""
         count = self.get_queryset().filter(status='unread').count()
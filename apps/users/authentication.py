@@ -0,0 +1,71 @@
+from functools import wraps
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework import exceptions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+_jwt_authentication = JWTAuthentication()
+
+
+def async_api_view(http_method_names=('GET', 'HEAD')):
+    """
+    Decorator for ``async def`` Django views authenticated with the same JWT
+    backend DRF uses.
+
+    DRF 3.14 views are sync-only, so the async read endpoints are plain Django
+    views and need to check the method and resolve ``request.user`` themselves.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def inner(request, *args, **kwargs):
+            if request.method not in http_method_names:
+                return HttpResponseNotAllowed(http_method_names)
+
+            try:
+                result = await sync_to_async(_jwt_authentication.authenticate)(request)
+            except exceptions.AuthenticationFailed as exc:
+                return JsonResponse({'detail': exc.detail}, status=401)
+
+            if result is None:
+                return JsonResponse(
+                    {'detail': 'Authentication credentials were not provided.'},
+                    status=401
+                )
+
+            request.user, request.auth = result
+            return await view_func(request, *args, **kwargs)
+
+        return inner
+
+    return decorator
+
+
+@database_sync_to_async
+def _get_user_from_token(raw_token):
+    try:
+        validated_token = _jwt_authentication.get_validated_token(raw_token)
+        return _jwt_authentication.get_user(validated_token)
+    except exceptions.AuthenticationFailed:
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    WebSocket middleware that resolves ``scope['user']`` from a ``?token=`` JWT.
+
+    Browsers cannot set an Authorization header on WebSocket handshakes, so API
+    clients pass the access token in the query string instead. Session-based
+    users are left untouched.
+    """
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        token = query.get('token')
+        if token:
+            scope = dict(scope, user=await _get_user_from_token(token[0]))
+        return await super().__call__(scope, receive, send)
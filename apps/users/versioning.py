@@ -0,0 +1,170 @@
+"""
+Per-user data versions for cheap conditional GET handling.
+
+Every user has one version token per resource ('expenses', 'insights', ...)
+stored in the shared cache. Writes bump the token, and polling endpoints derive
+their ETag / Last-Modified headers from it, so an unchanged poll is answered
+with a 304 after a single cache lookup instead of re-running aggregates.
+"""
+import hashlib
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+RESOURCES = (
+    'expenses', 'insights', 'notifications', 'budgets', 'analytics', 'transactions',
+    'predictions', 'assistant',
+)
+
+VERSION_KEY = 'data_version:{user_id}:{resource}'
+
+
+def _version_key(user_id, resource):
+    return VERSION_KEY.format(user_id=user_id, resource=resource)
+
+
+def _new_version():
+    return (uuid.uuid4().hex, time.time())
+
+
+def get_versions(user_id, resources):
+    """Return {resource: (token, timestamp)} for the given user"""
+    keys = {_version_key(user_id, resource): resource for resource in resources}
+    found = cache.get_many(list(keys))
+
+    for key in keys:
+        if key not in found:
+            # Cold or evicted entry: start a fresh version. Another worker may
+            # race us here, so keep whichever value reached the cache first.
+            value = _new_version()
+            cache.add(key, value, None)
+            found[key] = cache.get(key, value)
+
+    return {keys[key]: value for key, value in found.items()}
+
+
+def version_token(user_id, *resources):
+    """Short token that changes whenever any of the given resources does, for cache keys"""
+    versions = get_versions(user_id, resources)
+    return hashlib.sha1(
+        ':'.join(versions[resource][0] for resource in resources).encode()
+    ).hexdigest()[:16]
+
+
+def bump_versions(user_id, *resources):
+    """Invalidate the given resources for a user once the transaction commits"""
+    bump_versions_many([user_id], *resources)
+
+
+def bump_versions_many(user_ids, *resources):
+    """Invalidate resources for many users (bulk writes) with a single cache write"""
+    user_ids = [user_id for user_id in user_ids if user_id]
+    if not user_ids or not resources:
+        return
+
+    def _bump():
+        cache.set_many(
+            {
+                _version_key(user_id, resource): _new_version()
+                for user_id in user_ids
+                for resource in resources
+            },
+            None
+        )
+
+    transaction.on_commit(_bump)
+
+
+def _request_versions(request, resources):
+    """Fetch versions once per request; condition() asks for ETag and Last-Modified separately"""
+    versions = getattr(request, '_data_versions', None)
+    if versions is None:
+        versions = get_versions(request.user.pk, resources)
+        request._data_versions = versions
+    return versions
+
+
+def _check_resources(resources):
+    unknown = set(resources) - set(RESOURCES)
+    if unknown:
+        raise ValueError(f"Unknown data version resources: {', '.join(sorted(unknown))}")
+
+
+def _etag(request, resources, versions):
+    digest = hashlib.sha1()
+    digest.update(f'{request.user.pk}:{request.get_full_path()}:{timezone.now().date()}'.encode())
+    for resource in resources:
+        digest.update(f':{resource}={versions[resource][0]}'.encode())
+    return digest.hexdigest()
+
+
+def _last_modified(versions):
+    changed_at = datetime.fromtimestamp(
+        max(timestamp for _, timestamp in versions.values()),
+        tz=dt_timezone.utc
+    )
+    # Day-relative aggregates change at midnight even without writes
+    start_of_day = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return max(changed_at, start_of_day)
+
+
+def data_version_condition(*resources):
+    """
+    Build a ``condition`` decorator whose validators come from data versions.
+
+    The ETag also covers the full path (query params) and the current date,
+    because several polled aggregates are relative to "today" or "this month".
+    """
+    _check_resources(resources)
+
+    def etag_func(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return None
+        return _etag(request, resources, _request_versions(request, resources))
+
+    def last_modified_func(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return None
+        return _last_modified(_request_versions(request, resources))
+
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
+
+
+def async_data_version_condition(*resources):
+    """Async counterpart of ``data_version_condition`` for ``async def`` views"""
+    _check_resources(resources)
+
+    def decorator(view_func):
+        @wraps(view_func)
+        async def inner(request, *args, **kwargs):
+            versions = await sync_to_async(get_versions)(request.user.pk, resources)
+            etag = quote_etag(_etag(request, resources, versions))
+            last_modified = int(_last_modified(versions).timestamp())
+
+            response = get_conditional_response(
+                request,
+                etag=etag,
+                last_modified=last_modified,
+            )
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+
+            if request.method in ('GET', 'HEAD'):
+                if not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if not response.has_header('ETag'):
+                    response.headers['ETag'] = etag
+            return response
+
+        return inner
+
+    return decorator
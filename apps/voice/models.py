@@ -1,6 +1,5 @@
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.contrib.postgres.fields import JSONField
 
 User = get_user_model()
 
@@ -26,17 +25,43 @@ class VoiceCommand(models.Model):
 
 class OCRReceipt(models.Model):
     """Model for OCR-processed receipts"""
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ocr_receipts')
     image = models.ImageField(upload_to='receipts/ocr/')
-    extracted_data = JSONField(default=dict)
-    confidence_score = models.FloatField()
+    extracted_data = models.JSONField(default=dict)
+    confidence_score = models.FloatField(default=0.0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    error = models.TextField(blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    perceptual_hash = models.CharField(max_length=16, blank=True)
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, blank=True, null=True, related_name='duplicates'
+    )
+    expense = models.ForeignKey(
+        'expenses.Expense', on_delete=models.SET_NULL, blank=True, null=True, related_name='ocr_receipts'
+    )
     processed_at = models.DateTimeField(auto_now_add=True)
+    processing_started_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    completed_at = models.DateTimeField(blank=True, null=True)
     is_processed = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['-processed_at']
         indexes = [
             models.Index(fields=['user', 'processed_at']),
+            models.Index(fields=['user', 'content_hash']),
+            models.Index(fields=['status']),
         ]
 
 
@@ -46,7 +71,7 @@ class VoiceAssistantSession(models.Model):
     session_id = models.CharField(max_length=100, unique=True)
     start_time = models.DateTimeField(auto_now_add=True)
     end_time = models.DateTimeField(blank=True, null=True)
-    context = JSONField(default=dict)
+    context = models.JSONField(default=dict)
     is_active = models.BooleanField(default=True)
     
     class Meta:
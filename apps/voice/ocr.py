@@ -0,0 +1,148 @@
+"""
+CPU-bound receipt OCR, run in a process pool.
+
+Everything submitted to the pool is a plain module-level function taking and
+returning picklable values (image bytes in, text out), so the children never
+touch Django, the database or file storage. The pool is created lazily, once
+per worker process, and sized to the CPU cores (``OCR_WORKERS``).
+"""
+import hashlib
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+import pytesseract
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Working resolution for tesseract: upscale tiny scans, downscale phone photos
+MIN_OCR_WIDTH = 800
+MAX_OCR_WIDTH = 2000
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    # Parallelism comes from the pool; keep tesseract single-threaded per process
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
+def pool_size():
+    return settings.OCR_WORKERS or os.cpu_count() or 1
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=pool_size(), initializer=_init_worker)
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def preprocess_image(image_bytes):
+    """
+    Decode receipt bytes into a binarized grayscale array ready for OCR.
+
+    The upload buffer is viewed (not copied) as a uint8 array and decoded
+    straight to single-channel grayscale, a third of the memory of an RGB
+    decode. Resizing brings the width into [MIN_OCR_WIDTH, MAX_OCR_WIDTH]
+    (phone photos are often 4000px+ wide, far past what tesseract needs), and
+    the Otsu threshold is applied in place.
+    """
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError('Unsupported or corrupt image')
+
+    height, width = image.shape
+    if width < MIN_OCR_WIDTH:
+        scale = MIN_OCR_WIDTH / width
+        image = cv2.resize(image, (MIN_OCR_WIDTH, int(height * scale)), interpolation=cv2.INTER_CUBIC)
+    elif width > MAX_OCR_WIDTH:
+        scale = MAX_OCR_WIDTH / width
+        image = cv2.resize(image, (MAX_OCR_WIDTH, int(height * scale)), interpolation=cv2.INTER_AREA)
+
+    # Apply threshold to get better contrast
+    cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=image)
+    return image
+
+
+def fingerprint(image_bytes):
+    """
+    Return ``(sha256 hex, dHash hex)`` for an upload.
+
+    The SHA-256 catches byte-identical re-uploads. The 64-bit difference hash
+    compares neighbouring pixels of a tiny grayscale thumbnail, so re-encoded
+    or resized copies of the same photo land within a few bits of each other.
+    """
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+
+    # A reduced decode is plenty for a 9x8 thumbnail and much cheaper
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return content_hash, ''
+
+    thumbnail = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+    return content_hash, np.packbits(bits).tobytes().hex()
+
+
+def hash_distance(first, second):
+    """Number of differing bits between two perceptual hashes"""
+    return (int(first, 16) ^ int(second, 16)).bit_count()
+
+
+def extract_text(image_bytes):
+    """Decode, preprocess and OCR one receipt image; runs inside a pool process"""
+    try:
+        return pytesseract.image_to_string(preprocess_image(image_bytes))
+    except Exception as e:
+        # pytesseract's exceptions do not survive unpickling in the parent,
+        # which would mark the whole pool as broken
+        raise RuntimeError(f'{type(e).__name__}: {e}') from None
+
+
+def extract_texts(images):
+    """
+    OCR many images in parallel.
+
+    Returns one ``(text, error)`` pair per image, in order; exactly one of the
+    two is ``None``. The whole batch shares one deadline: OCR_TIMEOUT_SECONDS
+    per round of ``pool_size()`` images. A crashed pool is replaced so the
+    next batch can run.
+    """
+    executor = get_executor()
+    futures = [executor.submit(extract_text, image_bytes) for image_bytes in images]
+    rounds = math.ceil(len(futures) / pool_size()) or 1
+    wait(futures, timeout=settings.OCR_TIMEOUT_SECONDS * rounds)
+
+    results = []
+    for future in futures:
+        if not future.done():
+            future.cancel()
+            results.append((None, TimeoutError('OCR timed out')))
+            continue
+        try:
+            results.append((future.result(), None))
+        except BrokenProcessPool as e:
+            logger.error(f"OCR process pool crashed: {str(e)}")
+            _reset_executor()
+            results.append((None, e))
+        except Exception as e:
+            results.append((None, e))
+    return results
@@ -0,0 +1,391 @@
+"""
+Receipt and command text parsing.
+
+All patterns are compiled once at import. ``parse_receipt_text`` walks the OCR
+output line by line exactly once, classifying each line by its label (total,
+subtotal, tax, payment) and picking up amounts, the date and line items on the
+way.
+
+Spoken commands are matched against a token trie (``CommandVocabulary``) built
+once at import. Matching whole tokens rather than substrings keeps "gas" from
+firing inside "Las Vegas" or "add" inside "address".
+"""
+import re
+from datetime import date, datetime
+from typing import Any, Dict, Optional
+
+# 1,234.56 / 1234.56 / 12,50 (decimal comma); the last two digits are cents
+AMOUNT_RE = re.compile(r'(?<![\d.,/])\$?\s?(\d{1,3}(?:[,.]\d{3})+|\d+)[.,](\d{2})(?![\d%./])')
+
+# Line labels; when a line has several, LABEL_PRIORITY decides
+LINE_LABEL_RE = re.compile(
+    r'(?P<subtotal>\bsub[\s-]*total\b)'
+    # "Total incl. VAT" is still the total: consume the included-tax phrase so it is not a tax label
+    r'|(?P<included_tax>\binc(?:l|luding)?\.?\s+(?:sales\s+)?(?:tax|vat|gst|hst)\b)'
+    r'|(?P<tax>\b(?:sales\s+)?tax\b|\bvat\b|\bgst\b|\bhst\b)'
+    r'|(?P<total>\b(?:grand\s+)?total\b|\bamount\s+due\b|\bbalance\s+due\b)'
+    r'|(?P<payment>\b(?:cash|change|tender(?:ed)?|visa|mastercard|amex|debit|credit|card)\b)',
+    re.IGNORECASE
+)
+# SUBTOTAL and TOTAL TAX never count as TOTAL, and "Visa card total" is a total, not a payment
+LABEL_PRIORITY = ('subtotal', 'tax', 'total', 'payment')
+_NON_DIGITS_RE = re.compile(r'[^0-9]')
+
+_MONTHS = 'jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec'
+DATE_RE = re.compile(
+    r'(?P<iso>\b\d{4}-\d{1,2}-\d{1,2}\b)'
+    r'|(?P<numeric>\b\d{1,2}[/.-]\d{1,2}[/.-](?:\d{4}|\d{2})\b)'
+    rf'|(?P<day_month>\b\d{{1,2}}\s+(?:{_MONTHS})[a-z]*\.?,?\s+\d{{4}}\b)'
+    rf'|(?P<month_day>\b(?:{_MONTHS})[a-z]*\.?\s+\d{{1,2}},?\s+\d{{4}}\b)',
+    re.IGNORECASE
+)
+_DATE_SEPARATORS_RE = re.compile(r'[/.-]')
+_DATE_PUNCTUATION_RE = re.compile(r'[.,]')
+
+# "Milk 3.49", "2 x Milk 7.98", "Milk 2 @ 3.99"
+ITEM_RE = re.compile(
+    r'^(?:(?P<leading_quantity>\d+)\s*[xX]\s+)?'
+    r'(?P<description>.*?[A-Za-z]{2}.*?)\s+'
+    r'(?:(?P<quantity>\d+)\s*[xX@]\s*)?'
+    r'\$?\s?\d[\d,.\s]*[.,]\d{2}\s*[A-Z]?$'
+)
+_LETTERS_RE = re.compile(r'[A-Za-z]{3}')
+
+MERCHANT_SEARCH_LINES = 3
+
+
+def parse_amount(whole: str, cents: str) -> float:
+    return float(f"{_NON_DIGITS_RE.sub('', whole)}.{cents}")
+
+
+def parse_date(text: str) -> Optional[date]:
+    """Parse the first date in ``text`` in any of the supported formats"""
+    match = DATE_RE.search(text)
+    if not match:
+        return None
+
+    value = match.group()
+    kind = match.lastgroup
+    if kind == 'iso':
+        formats = ('%Y-%m-%d',)
+    elif kind == 'numeric':
+        value = _DATE_SEPARATORS_RE.sub('/', value)
+        # US month-first first, as the receipts so far; day-first as fallback
+        formats = ('%m/%d/%Y', '%m/%d/%y', '%d/%m/%Y', '%d/%m/%y')
+    else:
+        words = _DATE_PUNCTUATION_RE.sub(' ', value).split()
+        if kind == 'day_month':
+            day, month, year = words
+        else:
+            month, day, year = words
+        value = f'{day} {month[:3]} {year}'
+        formats = ('%d %b %Y',)
+
+    for date_format in formats:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_receipt_text(text: str) -> Dict[str, Any]:
+    """Parse OCR text into merchant, total, subtotal, tax, date and line items"""
+    data = {
+        'merchant': '',
+        'amount': 0.0,
+        'subtotal': None,
+        'tax': None,
+        'date': None,
+        'items': [],
+        'confidence': 0.0
+    }
+
+    labelled_total = None
+    largest_amount = 0.0
+    receipt_date = None
+    in_items = True
+
+    for index, raw_line in enumerate(text.splitlines()):
+        line = raw_line.strip()
+        if not line:
+            continue
+
+        amounts = AMOUNT_RE.findall(line)
+        labels = {label.lastgroup for label in LINE_LABEL_RE.finditer(line)}
+        kind = next((kind for kind in LABEL_PRIORITY if kind in labels), None)
+
+        if receipt_date is None:
+            receipt_date = parse_date(line)
+
+        if not data['merchant'] and index < MERCHANT_SEARCH_LINES and not amounts \
+                and _LETTERS_RE.search(line) and not DATE_RE.search(line):
+            data['merchant'] = line
+
+        if not amounts:
+            continue
+
+        # The amount owed is the last figure on a labelled line
+        amount = parse_amount(*amounts[-1])
+
+        if kind == 'total':
+            # Keep the last TOTAL line; earlier ones may be running totals
+            labelled_total = amount
+            in_items = False
+        elif kind == 'subtotal':
+            data['subtotal'] = amount
+            in_items = False
+        elif kind == 'tax':
+            data['tax'] = (data['tax'] or 0.0) + amount
+            in_items = False
+        elif kind == 'payment':
+            # Tendered cash and change are not what the receipt cost
+            continue
+        elif in_items:
+            item = ITEM_RE.match(line)
+            if item:
+                data['items'].append({
+                    'description': item.group('description').strip(),
+                    'quantity': int(item.group('leading_quantity') or item.group('quantity') or 1),
+                    'amount': amount
+                })
+
+        largest_amount = max(largest_amount, amount)
+
+    if labelled_total is not None:
+        data['amount'] = labelled_total
+    elif data['subtotal'] is not None:
+        data['amount'] = round(data['subtotal'] + (data['tax'] or 0.0), 2)
+    else:
+        data['amount'] = largest_amount
+
+    if data['tax'] is not None:
+        data['tax'] = round(data['tax'], 2)
+    data['date'] = receipt_date.isoformat() if receipt_date else None
+
+    confidence = 0.3
+    if labelled_total is not None:
+        confidence += 0.4
+    elif data['amount']:
+        confidence += 0.2
+    if data['merchant']:
+        confidence += 0.15
+    if receipt_date:
+        confidence += 0.15
+    data['confidence'] = round(confidence, 2)
+
+    return data
+
+
+# Spoken commands
+
+COMMAND_TOKEN_RE = re.compile(r"\$?\d+(?:\.\d+)?|[A-Za-z][A-Za-z'&-]*")
+_NUMERIC_TOKEN_RE = re.compile(r'\$?(\d+(?:\.\d+)?)$')
+
+# Checked in this order when a command mentions more than one intent
+INTENT_KEYWORDS = {
+    'add_expense': ['add', 'create', 'new', 'spent', 'paid', 'log', 'record'],
+    'show_expenses': ['show', 'list', 'view', 'display'],
+    'budget_info': ['budget', 'limit'],
+}
+
+CATEGORY_KEYWORDS = {
+    'food': ['lunch', 'dinner', 'breakfast', 'restaurant', 'cafe', 'food', 'meal', 'groceries'],
+    'transport': ['gas', 'gas station', 'fuel', 'uber', 'taxi', 'bus', 'train', 'transport', 'travel'],
+    'shopping': ['amazon', 'store', 'shopping', 'clothes', 'electronics'],
+    'entertainment': ['movie', 'movies', 'concert', 'entertainment', 'fun', 'leisure'],
+    'utilities': ['electricity', 'water bill', 'internet', 'phone bill', 'utilities'],
+    'health': ['doctor', 'pharmacy', 'medicine', 'health', 'medical'],
+}
+
+PERIOD_KEYWORDS = {
+    'today': ['today'],
+    'week': ['this week'],
+    'month': ['this month'],
+}
+
+NUMBER_WORDS = {
+    'zero': 0, 'a': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
+    'eleven': 11, 'twelve': 12, 'thirteen': 13, 'fourteen': 14, 'fifteen': 15,
+    'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19, 'twenty': 20,
+    'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60, 'seventy': 70,
+    'eighty': 80, 'ninety': 90,
+}
+SCALE_WORDS = {'hundred': 100, 'thousand': 1000}
+
+CURRENCY_WORDS = ['dollar', 'dollars', 'buck', 'bucks', 'usd']
+MERCHANT_MARKERS = ['at', 'from']
+FILLER_WORDS = ['expense', 'expenses', 'for', 'on', 'my', 'me', 'an']
+
+_END = object()
+
+
+class CommandVocabulary:
+    """
+    Phrase trie over lower-cased command tokens.
+
+    Every keyword phrase (intents, categories, periods, number words, ...) is
+    inserted once; ``parse`` then classifies a command in a single pass,
+    taking the longest phrase that starts at each token. Pass custom keyword
+    maps to build a vocabulary with user-specific words.
+    """
+
+    def __init__(self, intents=None, categories=None, periods=None):
+        self.intents = intents or INTENT_KEYWORDS
+        self.intent_priority = list(self.intents)
+        self._trie = {}
+
+        for intent, phrases in self.intents.items():
+            self._add_all(phrases, 'intent', intent)
+        for category, phrases in (categories or CATEGORY_KEYWORDS).items():
+            self._add_all(phrases, 'category', category)
+        for period, phrases in (periods or PERIOD_KEYWORDS).items():
+            self._add_all(phrases, 'period', period)
+        for word, value in NUMBER_WORDS.items():
+            self._add(word, 'number', value)
+        for word, value in SCALE_WORDS.items():
+            self._add(word, 'scale', value)
+        self._add_all(CURRENCY_WORDS, 'currency', None)
+        self._add_all(MERCHANT_MARKERS, 'marker', None)
+        self._add_all(FILLER_WORDS, 'filler', None)
+
+    def _add_all(self, phrases, kind, value):
+        for phrase in phrases:
+            self._add(phrase, kind, value)
+
+    def _add(self, phrase, kind, value):
+        node = self._trie
+        for token in phrase.lower().split():
+            node = node.setdefault(token, {})
+        node.setdefault(_END, []).append((kind, value))
+
+    def _longest_match(self, words, start):
+        node, match = self._trie, None
+        for index in range(start, len(words)):
+            node = node.get(words[index])
+            if node is None:
+                break
+            if _END in node:
+                match = (index + 1, node[_END])
+        return match
+
+    def parse(self, text: str) -> Dict[str, Any]:
+        """Classify intent, category, period, amount, merchant and description in one pass"""
+        tokens = COMMAND_TOKEN_RE.findall(text)
+        words = [token.lower() for token in tokens]
+
+        intents = set()
+        category = None
+        period = None
+        amount = None
+        money_amount = None
+        merchant, in_merchant = [], False
+        description = []
+
+        # Spoken number being accumulated ("one hundred and twenty five")
+        number_total, number_current, in_number = 0, 0, False
+
+        def close_number(next_word=None):
+            nonlocal number_total, number_current, in_number, amount, money_amount
+            if not in_number:
+                return
+            value = float(number_total + number_current)
+            if amount is None:
+                amount = value
+            if money_amount is None and next_word in CURRENCY_WORDS:
+                money_amount = value
+            number_total, number_current, in_number = 0, 0, False
+
+        index = 0
+        while index < len(words):
+            word = words[index]
+            match = self._longest_match(words, index)
+            entries = dict(match[1]) if match else {}
+            end = match[0] if match else index + 1
+            phrase = tokens[index:end]
+
+            numeric = _NUMERIC_TOKEN_RE.match(word)
+            if numeric:
+                close_number()
+                value = float(numeric.group(1))
+                if amount is None:
+                    amount = value
+                next_word = words[index + 1] if index + 1 < len(words) else None
+                if money_amount is None and (word.startswith('$') or next_word in CURRENCY_WORDS):
+                    money_amount = value
+                in_merchant = False
+                index = end
+                continue
+
+            if 'number' in entries and not (word == 'a' and not self._next_is_scale(words, index)):
+                number_current += entries['number']
+                in_number = True
+                in_merchant = False
+                index = end
+                continue
+            if 'scale' in entries:
+                if entries['scale'] == 100:
+                    number_current = max(number_current, 1) * 100
+                else:
+                    number_total += max(number_current, 1) * entries['scale']
+                    number_current = 0
+                in_number = True
+                in_merchant = False
+                index = end
+                continue
+            if word == 'and' and in_number and self._next_is_number(words, index):
+                index = end
+                continue
+            close_number(word)
+
+            if 'intent' in entries:
+                intents.add(entries['intent'])
+                in_merchant = False
+            elif 'currency' in entries:
+                in_merchant = False
+            elif 'marker' in entries:
+                in_merchant = True
+                merchant = []
+                description.extend(phrase)
+            elif 'period' in entries:
+                period = entries['period']
+                in_merchant = False
+            elif 'filler' in entries:
+                in_merchant = False
+            else:
+                if 'category' in entries and category is None:
+                    category = entries['category']
+                if in_merchant:
+                    merchant.append((phrase, 'category' in entries))
+                description.extend(phrase)
+
+            index = end
+        close_number()
+
+        intent = next((name for name in self.intent_priority if name in intents), 'query')
+
+        # "at restaurant" names a category, not a merchant
+        merchant_name = ''
+        if any(not is_category for _, is_category in merchant):
+            merchant_name = ' '.join(token for phrase, _ in merchant for token in phrase)
+
+        return {
+            'intent': intent,
+            'category': category or 'other',
+            'period': period,
+            'amount': money_amount if money_amount is not None else (amount or 0.0),
+            'merchant': merchant_name,
+            'description': ' '.join(description),
+        }
+
+    def _next_is_scale(self, words, index):
+        return index + 1 < len(words) and words[index + 1] in SCALE_WORDS
+
+    def _next_is_number(self, words, index):
+        return index + 1 < len(words) and (
+            words[index + 1] in NUMBER_WORDS or words[index + 1] in SCALE_WORDS
+        )
+
+
+COMMAND_VOCABULARY = CommandVocabulary()
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import VoiceCommand, OCRReceipt, VoiceAssistantSession
 
@@ -21,9 +22,29 @@ class OCRReceiptSerializer(serializers.ModelSerializer):
         model = OCRReceipt
         fields = [
             'id', 'user', 'image', 'extracted_data', 'confidence_score',
-            'is_processed', 'created_at', 'updated_at'
+            'status', 'error', 'content_hash', 'duplicate_of', 'expense',
+            'is_processed', 'processed_at', 'completed_at'
         ]
-        read_only_fields = ['id', 'user', 'created_at', 'updated_at']
+        read_only_fields = [
+            'id', 'user', 'extracted_data', 'confidence_score', 'status', 'error',
+            'content_hash', 'duplicate_of', 'expense', 'is_processed', 'processed_at', 'completed_at'
+        ]
+
+
+class OCRReceiptUploadSerializer(serializers.Serializer):
+    """Serializer for a single receipt upload"""
+    image = serializers.ImageField()
+    link_existing = serializers.BooleanField(default=True)
+
+
+class OCRReceiptBatchUploadSerializer(serializers.Serializer):
+    """Serializer for uploading many receipts at once"""
+    images = serializers.ListField(
+        child=serializers.ImageField(),
+        allow_empty=False,
+        max_length=settings.OCR_BATCH_MAX_FILES
+    )
+    link_existing = serializers.BooleanField(default=True)
 
 
 class VoiceAssistantSessionSerializer(serializers.ModelSerializer):
@@ -1,20 +1,23 @@
 import os
 import json
 import logging
-from datetime import datetime
+from datetime import timedelta
 from typing import Dict, Any, List, Optional
 import numpy as np
 import pandas as pd
-from PIL import Image
-import pytesseract
-import cv2
-from django.core.files.storage import default_storage
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
 from .models import VoiceCommand, OCRReceipt, VoiceAssistantSession
 from apps.expenses.models import Expense, Category
-from apps.ai.services import AIChatService
+from apps.ai.services import AIChatService, CategoryPredictionService
+from apps.banking.merchants import canonical_name
+from . import ocr
+from .parsers import COMMAND_VOCABULARY, parse_receipt_text
+from .tasks import process_receipts
 
 logger = logging.getLogger(__name__)
 
@@ -77,15 +80,14 @@ class VoiceCommandService:
     
     def _parse_command_text(self, text: str) -> Dict[str, Any]:
         """Parse command text to extract intent and data"""
-        text_lower = text.lower().strip()
-        
-        # Intent detection
-        if any(word in text_lower for word in ['add', 'create', 'new']):
-            return self._parse_add_expense_command(text)
-        elif any(word in text_lower for word in ['show', 'list', 'view']):
-            return self._parse_show_command(text)
-        elif any(word in text_lower for word in ['budget', 'limit']):
-            return self._parse_budget_command(text)
+        parsed = COMMAND_VOCABULARY.parse(text.strip())
+        
+        if parsed['intent'] == 'add_expense':
+            return self._parse_add_expense_command(parsed)
+        elif parsed['intent'] == 'show_expenses':
+            return self._parse_show_command(parsed)
+        elif parsed['intent'] == 'budget_info':
+            return self._parse_budget_command(parsed)
         else:
             return {
                 'intent': 'query',
@@ -93,148 +95,73 @@ class VoiceCommandService:
                 'confidence': 0.7
             }
     
-    def _parse_add_expense_command(self, text: str) -> Dict[str, Any]:
+    def _parse_add_expense_command(self, parsed: Dict[str, Any]) -> Dict[str, Any]:
         """Parse add expense command"""
-        # Extract amount
-        amount = self._extract_amount(text)
-        
-        # Extract category
-        category = self._extract_category(text)
-        
-        # Extract description
-        description = self._extract_description(text)
-        
-        # Extract merchant
-        merchant = self._extract_merchant(text)
-        
         return {
             'intent': 'add_expense',
-            'amount': amount,
-            'category': category,
-            'description': description,
-            'merchant': merchant,
+            'amount': parsed['amount'],
+            'category': parsed['category'],
+            'description': parsed['description'],
+            'merchant': parsed['merchant'],
             'confidence': 0.9
         }
     
-    def _parse_show_command(self, text: str) -> Dict[str, Any]:
+    def _parse_show_command(self, parsed: Dict[str, Any]) -> Dict[str, Any]:
         """Parse show command"""
         return {
             'intent': 'show_expenses',
-            'filters': self._extract_filters(text),
+            'filters': self._extract_filters(parsed),
             'confidence': 0.8
         }
     
-    def _parse_budget_command(self, text: str) -> Dict[str, Any]:
+    def _parse_budget_command(self, parsed: Dict[str, Any]) -> Dict[str, Any]:
         """Parse budget command"""
         return {
             'intent': 'budget_info',
-            'category': self._extract_category(text),
+            'category': parsed['category'],
             'confidence': 0.8
         }
     
-    def _extract_amount(self, text: str) -> float:
-        """Extract amount from text"""
-        import re
-        
-        # Look for dollar amounts
-        dollar_pattern = r'\$(\d+(?:\.\d{2})?)|(\d+(?:\.\d{2})?)\s*dollars?'
-        matches = re.findall(dollar_pattern, text, re.IGNORECASE)
-        
-        if matches:
-            amount_str = matches[0][0] if matches[0][0] else matches[0][1]
-            return float(amount_str)
-        
-        # Look for written numbers
-        number_words = {
-            'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
-            'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10,
-            'eleven': 11, 'twelve': 12, 'thirteen': 13, 'fourteen': 14, 'fifteen': 15,
-            'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19, 'twenty': 20,
-            'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60, 'seventy': 70,
-            'eighty': 80, 'ninety': 90, 'hundred': 100
-        }
-        
-        words = text.lower().split()
-        for word in words:
-            if word in number_words:
-                return float(number_words[word])
-        
-        return 0.0
-    
-    def _extract_category(self, text: str) -> str:
-        """Extract category from text"""
-        categories = {
-            'food': ['lunch', 'dinner', 'breakfast', 'restaurant', 'cafe', 'food', 'meal'],
-            'transport': ['gas', 'uber', 'taxi', 'bus', 'train', 'transport', 'travel'],
-            'shopping': ['amazon', 'store', 'shopping', 'clothes', 'electronics'],
-            'entertainment': ['movie', 'concert', 'entertainment', 'fun', 'leisure'],
-            'utilities': ['electricity', 'water', 'internet', 'phone', 'utilities'],
-            'health': ['doctor', 'pharmacy', 'medicine', 'health', 'medical']
-        }
-        
-        text_lower = text.lower()
-        for category, keywords in categories.items():
-            if any(keyword in text_lower for keyword in keywords):
-                return category
-        
-        return 'other'
-    
-    def _extract_description(self, text: str) -> str:
-        """Extract description from text"""
-        # Remove common phrases
-        phrases_to_remove = ['add expense', 'create expense', 'new expense', 'for']
-        description = text
-        
-        for phrase in phrases_to_remove:
-            description = description.replace(phrase, '')
-        
-        return description.strip()
-    
-    def _extract_merchant(self, text: str) -> str:
-        """Extract merchant from text"""
-        # Look for proper nouns or known merchants
-        words = text.split()
-        for word in words:
-            if word[0].isupper() and len(word) > 3:
-                return word
-        
-        return ''
-    
     def _create_expense_from_command(self, data: Dict[str, Any]) -> Expense:
         """Create expense from parsed command data"""
-        category, created = Category.objects.get_or_create(
-            name=data['category'],
-            defaults={'color': '#3498db'}
+        # A spoken category wins; otherwise ask the user's own model
+        prediction_service = CategoryPredictionService(self.user)
+        category, prediction = prediction_service.suggest_category(
+            data.get('description'), data.get('merchant'), data.get('amount')
         )
+        assigned = data['category'] == 'other' and category is not None
+        if not assigned:
+            category, created = Category.objects.get_or_create(
+                name=data['category'],
+                defaults={'color': '#3498db'}
+            )
         
         expense = Expense.objects.create(
             user=self.user,
-            title=data.get('description', 'Voice expense'),
+            title=data.get('description') or 'Voice expense',
+            description=f"Added via voice command: {data.get('description', '')}",
             amount=data['amount'],
             category=category,
-            merchant=data.get('merchant', ''),
-            transaction_date=timezone.now().date(),
-            notes=f"Added via voice command: {data.get('description', '')}"
+            location=canonical_name(data.get('merchant')) or '',
+            transaction_date=timezone.now().date()
         )
         
+        prediction_service.record_prediction(expense, prediction, assigned=assigned)
         return expense
     
-    def _extract_filters(self, text: str) -> Dict[str, Any]:
-        """Extract filters from text"""
+    def _extract_filters(self, parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """Extract filters from a parsed command"""
         filters = {}
         
         # Time filters
-        if 'today' in text.lower():
+        if parsed['period'] == 'today':
             filters['date'] = timezone.now().date()
-        elif 'this week' in text.lower():
-            filters['date_range'] = 'week'
-        elif 'this month' in text.lower():
-            filters['date_range'] = 'month'
+        elif parsed['period'] in ('week', 'month'):
+            filters['date_range'] = parsed['period']
         
         # Category filters
-        category = self._extract_category(text)
-        if category != 'other':
-            filters['category'] = category
+        if parsed['category'] != 'other':
+            filters['category'] = parsed['category']
         
         return filters
 
@@ -245,164 +172,219 @@ class OCRService:
     def __init__(self, user):
         self.user = user
     
-    def process_receipt_image(self, image_file) -> Dict[str, Any]:
-        """Process receipt image and extract data"""
+    def process_receipt_image(self, image_file, link_existing: bool = True) -> Dict[str, Any]:
+        """Queue a receipt image for OCR, or answer from an earlier upload of the same file"""
         try:
-            # Save the image
-            image_path = default_storage.save(
-                f'receipts/{datetime.now().strftime("%Y%m%d_%H%M%S")}_{image_file.name}',
-                image_file
-            )
-            
-            # Process the image
-            extracted_data = self._extract_receipt_data(image_path)
-            
-            # Create OCR receipt record
-            ocr_receipt = OCRReceipt.objects.create(
-                user=self.user,
-                image=image_path,
-                extracted_data=extracted_data,
-                confidence_score=extracted_data.get('confidence', 0.8),
-                is_processed=True
-            )
-            
-            # Create expense from extracted data
-            if extracted_data.get('amount') and extracted_data.get('merchant'):
-                expense = self._create_expense_from_ocr(extracted_data)
-                return {
-                    'success': True,
-                    'message': 'Receipt processed successfully',
-                    'expense_id': expense.id,
-                    'ocr_receipt_id': ocr_receipt.id,
-                    'extracted_data': extracted_data
-                }
-            
+            started = timezone.now()
+            ocr_receipt = self.enqueue_receipts([image_file], link_existing)[0]
+            if ocr_receipt.status == OCRReceipt.STATUS_DONE:
+                message = 'Receipt already processed'
+            elif ocr_receipt.processed_at < started:
+                message = 'Receipt is already being processed'
+            else:
+                message = 'Receipt queued for processing'
             return {
                 'success': True,
-                'message': 'Receipt processed but data incomplete',
+                'message': message,
                 'ocr_receipt_id': ocr_receipt.id,
-                'extracted_data': extracted_data
+                'status': ocr_receipt.status,
+                'duplicate_of': ocr_receipt.duplicate_of_id,
+                'expense_id': ocr_receipt.expense_id,
+                'extracted_data': ocr_receipt.extracted_data
             }
-            
         except Exception as e:
-            logger.error(f"Error processing receipt: {str(e)}")
+            logger.error(f"Error queueing receipt: {str(e)}")
             return {
                 'success': False,
                 'error': str(e)
             }
     
-    def _extract_receipt_data(self, image_path: str) -> Dict[str, Any]:
-        """Extract data from receipt image using OCR"""
-        try:
-            # Load image
-            image = Image.open(image_path)
-            
-            # Preprocess image
-            processed_image = self._preprocess_image(image)
-            
-            # Extract text using OCR
-            text = pytesseract.image_to_string(processed_image)
-            
-            # Parse extracted text
-            data = self._parse_receipt_text(text)
-            
-            return data
+    def enqueue_receipts(self, image_files, link_existing: bool = True) -> List[OCRReceipt]:
+        """
+        Store uploads as pending receipts and hand them to the OCR worker in chunks.
+        
+        Only a byte-identical re-upload skips OCR: one still in flight is
+        returned as is, a finished one is copied, linked to the original's
+        expense unless ``link_existing`` is False. A receipt that merely looks
+        like a recent one (two purchases at one merchant do) is still OCR'd and
+        gets ``duplicate_of`` set for the user to confirm.
+        """
+        receipts, pending_ids = [], []
+        with transaction.atomic():
+            for image_file in image_files:
+                image_bytes = image_file.read()
+                image_file.seek(0)
+                content_hash, perceptual_hash = ocr.fingerprint(image_bytes)
+                
+                original = self._find_exact_duplicate(content_hash)
+                if original is None:
+                    receipt = OCRReceipt.objects.create(
+                        user=self.user,
+                        image=image_file,
+                        content_hash=content_hash,
+                        perceptual_hash=perceptual_hash,
+                        duplicate_of_id=self._find_near_duplicate(perceptual_hash)
+                    )
+                    pending_ids.append(receipt.id)
+                elif original.status == OCRReceipt.STATUS_DONE:
+                    receipt = self._copy_receipt(original, content_hash, perceptual_hash, link_existing)
+                else:
+                    receipt = original
+                receipts.append(receipt)
             
-        except Exception as e:
-            logger.error(f"Error extracting receipt data: {str(e)}")
-            return {
-                'error': str(e),
-                'confidence': 0.0
-            }
-    
-    def _preprocess_image(self, image: Image.Image) -> Image.Image:
-        """Preprocess image for better OCR results"""
-        # Convert to grayscale
-        gray_image = image.convert('L')
+            chunk_size = settings.OCR_TASK_CHUNK_SIZE
+            for start in range(0, len(pending_ids), chunk_size):
+                chunk = pending_ids[start:start + chunk_size]
+                transaction.on_commit(lambda chunk=chunk: process_receipts.delay(chunk))
         
-        # Resize image if too small
-        width, height = gray_image.size
-        if width < 800:
-            new_width = 800
-            new_height = int(height * (800 / width))
-            gray_image = gray_image.resize((new_width, new_height), Image.LANCZOS)
+        return receipts
+    
+    def _find_exact_duplicate(self, content_hash: str) -> Optional[OCRReceipt]:
+        """Earliest not failed upload of the same file by this user"""
+        return OCRReceipt.objects.filter(
+            user=self.user, content_hash=content_hash
+        ).exclude(status=OCRReceipt.STATUS_FAILED).order_by('processed_at').first()
+    
+    def _find_near_duplicate(self, perceptual_hash: str) -> Optional[int]:
+        """Id of a recent upload that looks the same (re-encoded or resized copy, or a look-alike receipt)"""
+        if not perceptual_hash:
+            return None
+        window_start = timezone.now() - timedelta(hours=settings.OCR_NEAR_DUPLICATE_WINDOW_HOURS)
+        candidates = OCRReceipt.objects.filter(
+            user=self.user, processed_at__gte=window_start
+        ).exclude(status=OCRReceipt.STATUS_FAILED).exclude(perceptual_hash='').values_list('id', 'perceptual_hash')
+        
+        for receipt_id, candidate_hash in candidates:
+            if ocr.hash_distance(perceptual_hash, candidate_hash) <= settings.OCR_NEAR_DUPLICATE_MAX_BITS:
+                return receipt_id
+        return None
+    
+    def _copy_receipt(self, original: OCRReceipt, content_hash: str, perceptual_hash: str,
+                      link_existing: bool) -> OCRReceipt:
+        """Record a re-upload using the original's OCR result instead of running OCR again"""
+        receipt = OCRReceipt.objects.create(
+            user=self.user,
+            image=original.image.name,
+            extracted_data=original.extracted_data,
+            confidence_score=original.confidence_score,
+            status=OCRReceipt.STATUS_DONE,
+            is_processed=True,
+            completed_at=timezone.now(),
+            content_hash=content_hash,
+            perceptual_hash=perceptual_hash,
+            duplicate_of=original,
+            expense=original.expense if link_existing else None
+        )
         
-        # Apply threshold to get better contrast
-        import numpy as np
-        img_array = np.array(gray_image)
-        _, thresholded = cv2.threshold(img_array, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        data = original.extracted_data
+        if not link_existing and data.get('amount') and data.get('merchant'):
+            receipt.expense = self._create_expense_from_ocr(data, receipt)
+            receipt.save(update_fields=['expense'])
         
-        return Image.fromarray(thresholded)
+        return receipt
     
-    def _parse_receipt_text(self, text: str) -> Dict[str, Any]:
-        """Parse extracted text to find relevant data"""
-        lines = text.split('\n')
+    def complete_receipt(self, ocr_receipt: OCRReceipt, text: str) -> OCRReceipt:
+        """Store parsed OCR output, create the expense and notify the user, unless another attempt took over"""
+        extracted_data = parse_receipt_text(text)
+        
+        with transaction.atomic():
+            completed_at = timezone.now()
+            confidence_score = extracted_data.get('confidence', 0.8)
+            if not self._finish(ocr_receipt, extracted_data=extracted_data, confidence_score=confidence_score,
+                                status=OCRReceipt.STATUS_DONE, is_processed=True, completed_at=completed_at):
+                return ocr_receipt
+            ocr_receipt.extracted_data = extracted_data
+            ocr_receipt.confidence_score = confidence_score
+            ocr_receipt.status = OCRReceipt.STATUS_DONE
+            ocr_receipt.is_processed = True
+            ocr_receipt.completed_at = completed_at
+            
+            # Create expense from extracted data
+            expense = None
+            if extracted_data.get('amount') and extracted_data.get('merchant'):
+                expense = self._create_expense_from_ocr(extracted_data, ocr_receipt)
+                ocr_receipt.expense = expense
+                ocr_receipt.save(update_fields=['expense'])
+            
+            self._notify(ocr_receipt, expense)
         
-        data = {
-            'merchant': '',
-            'amount': 0.0,
-            'date': None,
-            'items': [],
-            'confidence': 0.8
+        return ocr_receipt
+    
+    def fail_receipt(self, ocr_receipt: OCRReceipt, error: Exception) -> OCRReceipt:
+        """Mark a receipt as failed and notify the user, unless another attempt took over"""
+        with transaction.atomic():
+            completed_at = timezone.now()
+            if not self._finish(ocr_receipt, status=OCRReceipt.STATUS_FAILED, error=str(error),
+                                completed_at=completed_at):
+                return ocr_receipt
+            ocr_receipt.status = OCRReceipt.STATUS_FAILED
+            ocr_receipt.error = str(error)
+            ocr_receipt.completed_at = completed_at
+            self._notify(ocr_receipt)
+        
+        return ocr_receipt
+    
+    def _finish(self, ocr_receipt: OCRReceipt, **fields) -> bool:
+        """
+        Write the outcome only if the receipt is still processing under the
+        attempt that claimed it. A late worker whose receipt was requeued,
+        re-claimed or already finished changes nothing.
+        """
+        finished = OCRReceipt.objects.filter(
+            id=ocr_receipt.id,
+            status=OCRReceipt.STATUS_PROCESSING,
+            processing_started_at=ocr_receipt.processing_started_at
+        ).update(**fields)
+        if not finished:
+            logger.warning(f"Receipt {ocr_receipt.id} was finished or re-claimed by another worker; dropping this result")
+        return bool(finished)
+    
+    def _notify(self, ocr_receipt: OCRReceipt, expense: Optional[Expense] = None):
+        """Push the finished receipt to the user's notification socket after commit"""
+        notification = {
+            'type': 'ocr_receipt',
+            'ocr_receipt_id': ocr_receipt.id,
+            'status': ocr_receipt.status,
+            'duplicate_of': ocr_receipt.duplicate_of_id,
+            'expense_id': expense.id if expense else None,
+            'extracted_data': ocr_receipt.extracted_data,
+            'error': ocr_receipt.error,
         }
         
-        # Extract merchant (usually first few lines)
-        for line in lines[:3]:
-            line = line.strip()
-            if line and len(line) > 3 and not line.startswith('$'):
-                data['merchant'] = line
-                break
-        
-        # Extract amount
-        import re
-        amount_pattern = r'\$?\d+\.\d{2}'
-        amounts = re.findall(amount_pattern, text)
-        
-        if amounts:
-            # Find the largest amount (likely total)
-            amounts_float = [float(amount.replace('$', '')) for amount in amounts]
-            data['amount'] = max(amounts_float)
-        
-        # Extract date
-        date_pattern = r'\d{1,2}/\d{1,2}/\d{2,4}'
-        date_match = re.search(date_pattern, text)
-        if date_match:
+        def _send():
             try:
-                data['date'] = datetime.strptime(date_match.group(), '%m/%d/%Y').date()
-            except:
-                pass
-        
-        # Extract items (lines with amounts)
-        for line in lines:
-            line = line.strip()
-            if any(keyword in line.lower() for keyword in ['item', 'product', 'service']):
-                item_amount = re.findall(amount_pattern, line)
-                if item_amount:
-                    data['items'].append({
-                        'description': line,
-                        'amount': float(item_amount[0].replace('$', ''))
-                    })
-        
-        return data
+                async_to_sync(get_channel_layer().group_send)(
+                    f"notifications_{self.user.id}",
+                    {'type': 'new_notification', 'notification': notification}
+                )
+            except Exception as e:
+                # Clients can still poll the receipt
+                logger.warning(f"Could not push OCR result for receipt {ocr_receipt.id}: {str(e)}")
+        
+        transaction.on_commit(_send)
     
-    def _create_expense_from_ocr(self, data: Dict[str, Any]) -> Expense:
+    def _create_expense_from_ocr(self, data: Dict[str, Any], ocr_receipt: OCRReceipt) -> Expense:
         """Create expense from OCR extracted data"""
-        category_name = 'Shopping'  # Default category
-        category, created = Category.objects.get_or_create(
-            name=category_name,
-            defaults={'color': '#e74c3c'}
-        )
+        title = f"Receipt from {canonical_name(data.get('merchant')) or 'Unknown'}"
+        prediction_service = CategoryPredictionService(self.user)
+        category, prediction = prediction_service.suggest_category(title, '', data.get('amount'))
+        if category is None:
+            category, created = Category.objects.get_or_create(
+                name='Shopping',  # Default category
+                defaults={'color': '#e74c3c'}
+            )
         
         expense = Expense.objects.create(
             user=self.user,
-            title=f"Receipt from {data.get('merchant', 'Unknown')}",
+            title=title,
+            description=f"Processed via OCR: {data.get('items', [])}",
             amount=data['amount'],
             category=category,
-            merchant=data.get('merchant', ''),
             transaction_date=data.get('date') or timezone.now().date(),
-            notes=f"Processed via OCR: {data.get('items', [])}"
+            receipt=ocr_receipt.image.name
         )
         
+        prediction_service.record_prediction(expense, prediction, assigned=True)
         return expense
 
 
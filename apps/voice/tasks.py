@@ -0,0 +1,81 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OCRReceipt
+from . import ocr
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def process_receipts(receipt_ids):
+    """OCR a chunk of pending receipts in parallel and store the results"""
+    from .services import OCRService
+
+    # Claim atomically: a redelivered chunk or a requeued slow receipt must not be OCR'd twice
+    claimed_at = timezone.now()
+    with transaction.atomic():
+        claimed_ids = list(
+            OCRReceipt.objects.select_for_update(skip_locked=True).filter(
+                id__in=receipt_ids,
+                status=OCRReceipt.STATUS_PENDING
+            ).values_list('id', flat=True)
+        )
+        OCRReceipt.objects.filter(id__in=claimed_ids).update(
+            status=OCRReceipt.STATUS_PROCESSING,
+            processing_started_at=claimed_at,
+            attempts=F('attempts') + 1
+        )
+    if not claimed_ids:
+        return 0
+    receipts = list(OCRReceipt.objects.filter(id__in=claimed_ids).select_related('user'))
+
+    images, readable = [], []
+    for receipt in receipts:
+        try:
+            with receipt.image.open('rb') as image_file:
+                images.append(image_file.read())
+            readable.append(receipt)
+        except Exception as e:
+            logger.error(f"Error reading receipt image {receipt.id}: {str(e)}")
+            OCRService(receipt.user).fail_receipt(receipt, e)
+
+    for receipt, (text, error) in zip(readable, ocr.extract_texts(images)):
+        service = OCRService(receipt.user)
+        if error is not None:
+            logger.error(f"Error extracting receipt data for {receipt.id}: {str(error)}")
+            service.fail_receipt(receipt, error)
+        else:
+            service.complete_receipt(receipt, text)
+
+    return len(receipts)
+
+
+@shared_task
+def requeue_stale_receipts():
+    """Recover receipts left in processing by a worker that died; give up after OCR_MAX_ATTEMPTS"""
+    from .services import OCRService
+
+    cutoff = timezone.now() - timedelta(minutes=settings.OCR_STALE_MINUTES)
+    stale = OCRReceipt.objects.filter(status=OCRReceipt.STATUS_PROCESSING, processing_started_at__lt=cutoff)
+
+    for receipt in stale.filter(attempts__gte=settings.OCR_MAX_ATTEMPTS).select_related('user'):
+        OCRService(receipt.user).fail_receipt(receipt, RuntimeError('OCR worker stopped responding'))
+
+    receipt_ids = list(stale.values_list('id', flat=True))
+    OCRReceipt.objects.filter(id__in=receipt_ids, status=OCRReceipt.STATUS_PROCESSING).update(
+        status=OCRReceipt.STATUS_PENDING
+    )
+    chunk_size = settings.OCR_TASK_CHUNK_SIZE
+    for start in range(0, len(receipt_ids), chunk_size):
+        process_receipts.delay(receipt_ids[start:start + chunk_size])
+
+    if receipt_ids:
+        logger.warning(f"Requeued {len(receipt_ids)} receipts stuck in processing")
+    return len(receipt_ids)
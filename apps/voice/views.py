@@ -5,7 +5,10 @@ from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
 
 from .models import VoiceCommand, OCRReceipt, VoiceAssistantSession
-from .serializers import VoiceCommandSerializer, OCRReceiptSerializer, VoiceAssistantSessionSerializer
+from .serializers import (
+    VoiceCommandSerializer, OCRReceiptSerializer, OCRReceiptUploadSerializer,
+    OCRReceiptBatchUploadSerializer, VoiceAssistantSessionSerializer
+)
 from .services import VoiceCommandService, OCRService, VoiceAssistantService
 
 
@@ -56,35 +59,55 @@ class OCRReceiptViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return OCRReceipt.objects.filter(user=self.request.user)
 
+    def perform_create(self, serializer):
+        service = OCRService(self.request.user)
+        serializer.instance = service.enqueue_receipts([serializer.validated_data['image']])[0]
+
     @action(detail=False, methods=['post'])
     def process_receipt(self, request):
-        """Process an OCR receipt"""
-        serializer = OCRReceiptSerializer(data=request.data)
+        """Queue a receipt image for OCR; poll the receipt or listen on the notification socket"""
+        serializer = OCRReceiptUploadSerializer(data=request.data)
         if serializer.is_valid():
-            image_file = request.FILES.get('image')
-            
-            if not image_file:
-                return Response(
-                    {'error': 'Image file is required'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
             service = OCRService(request.user)
-            result = service.process_receipt_image(image_file)
+            result = service.process_receipt_image(
+                serializer.validated_data['image'],
+                serializer.validated_data['link_existing']
+            )
             
             if result['success']:
-                return Response(result, status=status.HTTP_200_OK)
+                # Re-uploads of an already processed receipt are answered right away
+                if result['status'] == OCRReceipt.STATUS_DONE:
+                    return Response(result, status=status.HTTP_200_OK)
+                return Response(result, status=status.HTTP_202_ACCEPTED)
             else:
                 return Response(result, status=status.HTTP_400_BAD_REQUEST)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'])
+    def process_batch(self, request):
+        """Queue many receipt images for OCR at once"""
+        serializer = OCRReceiptBatchUploadSerializer(data=request.data)
+        if serializer.is_valid():
+            service = OCRService(request.user)
+            receipts = service.enqueue_receipts(
+                serializer.validated_data['images'],
+                serializer.validated_data['link_existing']
+            )
+            
+            return Response(
+                OCRReceiptSerializer(receipts, many=True, context={'request': request}).data,
+                status=status.HTTP_202_ACCEPTED
+            )
+        
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     @action(detail=False, methods=['get'])
     def recent_receipts(self, request):
         """Get recent OCR receipts"""
         recent_receipts = self.get_queryset().filter(
-            created_at__gte=timezone.now() - timezone.timedelta(days=7)
-        ).order_by('-created_at')[:10]
+            processed_at__gte=timezone.now() - timezone.timedelta(days=7)
+        ).order_by('-processed_at')[:10]
         
         serializer = self.get_serializer(recent_receipts, many=True)
         return Response(serializer.data)
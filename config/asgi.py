@@ -0,0 +1,25 @@
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+os.environ.setdefault('DJANGO_SERVER_INTERFACE', 'asgi')
+
+# Set up Django before importing consumers/middleware that touch models
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from apps.analytics.routing import websocket_urlpatterns  # noqa: E402
+from apps.users.authentication import JWTAuthMiddleware  # noqa: E402
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(
+            JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+        )
+    ),
+})
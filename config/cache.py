@@ -0,0 +1,190 @@
+"""
+Namespaced, generation-versioned caching with stampede protection.
+
+Keys look like ``<namespace>:g<generation>:<part>:<part>...``. Bumping a
+namespace's generation (``invalidate()``) orphans every key in it at once;
+stale entries simply expire. Per-user freshness is handled by callers putting
+the user's data version token into the key parts.
+
+``get_or_compute`` protects expensive recomputes (dashboards, forecasts):
+
+* threads in the same process that miss on the same key are coalesced behind a
+  striped lock, so only one of them recomputes;
+* across processes a short-lived ``cache.add`` lock elects a single
+  recomputing worker while the others wait briefly for its result.
+
+The namespace generation is memoized in process for ``GENERATION_TTL``
+seconds, so building keys costs no round trip of its own; an ``invalidate()``
+from another process is seen within that window.
+
+Hit/miss counters are kept in process and flushed to the shared cache in
+batches, so metrics cost no extra round trip on the hot path. Every
+namespace registers itself in ``namespaces``; ``all_metrics()`` reports them
+(served to admins by ``apps.analytics.views.CacheMetricsView``).
+"""
+import logging
+import threading
+import time
+import zlib
+from collections import Counter
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_LOCK_STRIPES = [threading.Lock() for _ in range(64)]
+
+METRICS_FLUSH_EVERY = 100
+METRIC_EVENTS = ('hits', 'misses', 'coalesced', 'computed', 'lock_waits')
+GENERATION_TTL = 5
+
+# Every CacheNamespace by name, for metrics reporting
+namespaces = {}
+
+
+class CacheNamespace:
+    """Cache helper scoped to one app namespace, e.g. ``CacheNamespace('analytics')``"""
+
+    def __init__(self, namespace, timeout=300, cache_alias='default'):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self._metrics = Counter()
+        self._metrics_lock = threading.Lock()
+        self._generation = (0.0, None)
+        namespaces[namespace] = self
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    # Keys and generations
+
+    def _generation_key(self):
+        return f'{self.namespace}:generation'
+
+    def generation(self):
+        fetched_at, generation = self._generation
+        if generation is not None and time.monotonic() - fetched_at < GENERATION_TTL:
+            return generation
+        generation = self.cache.get(self._generation_key())
+        if generation is None:
+            self.cache.add(self._generation_key(), 1, None)
+            generation = self.cache.get(self._generation_key(), 1)
+        self._generation = (time.monotonic(), generation)
+        return generation
+
+    def key(self, *parts):
+        return ':'.join([self.namespace, f'g{self.generation()}', *map(str, parts)])
+
+    def invalidate(self):
+        """Drop every key in the namespace by moving to the next generation"""
+        try:
+            generation = self.cache.incr(self._generation_key())
+        except ValueError:
+            # Generation key evicted: any fresh start is newer than what callers saw
+            generation = int(time.time())
+            self.cache.set(self._generation_key(), generation, None)
+        self._generation = (time.monotonic(), generation)
+        return generation
+
+    # Reads and writes
+
+    def get(self, *parts, default=None):
+        value = self.cache.get(self.key(*parts), _MISSING)
+        if value is _MISSING:
+            self._record('misses')
+            return default
+        self._record('hits')
+        return value
+
+    def set(self, *parts, value, timeout=None):
+        self.cache.set(self.key(*parts), value, self.timeout if timeout is None else timeout)
+
+    def get_or_compute(self, parts, compute, timeout=None, lock_timeout=30, wait_timeout=5):
+        """
+        Return the cached value for ``parts`` or compute it exactly once.
+
+        ``compute`` is called without arguments. Waiters that time out compute
+        the value themselves rather than fail the request.
+        """
+        key = self.key(*parts)
+        timeout = self.timeout if timeout is None else timeout
+
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self._record('hits')
+            return value
+        self._record('misses')
+
+        with _LOCK_STRIPES[zlib.crc32(key.encode()) % len(_LOCK_STRIPES)]:
+            # Another thread in this process may have filled it meanwhile
+            value = self.cache.get(key, _MISSING)
+            if value is not _MISSING:
+                self._record('coalesced')
+                return value
+
+            lock_key = f'{key}:lock'
+            if self.cache.add(lock_key, 1, lock_timeout):
+                try:
+                    value = compute()
+                    self.cache.set(key, value, timeout)
+                finally:
+                    self.cache.delete(lock_key)
+                self._record('computed')
+                return value
+
+            # Another process is recomputing: wait for its result
+            self._record('lock_waits')
+            deadline = time.monotonic() + wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = self.cache.get(key, _MISSING)
+                if value is not _MISSING:
+                    self._record('coalesced')
+                    return value
+
+            logger.warning(f"Timed out waiting for cache recompute of {key}")
+            self._record('computed')
+            return compute()
+
+    # Metrics
+
+    def _record(self, event):
+        with self._metrics_lock:
+            self._metrics[event] += 1
+            if sum(self._metrics.values()) < METRICS_FLUSH_EVERY:
+                return
+            pending, self._metrics = self._metrics, Counter()
+        self._flush(pending)
+
+    def _metric_key(self, event):
+        return f'cache_metrics:{self.namespace}:{event}'
+
+    def _flush(self, pending):
+        for event, count in pending.items():
+            key = self._metric_key(event)
+            if not self.cache.add(key, count, None):
+                try:
+                    self.cache.incr(key, count)
+                except ValueError:
+                    self.cache.set(key, count, None)
+
+    def metrics(self):
+        """Hit/miss counters across all workers, plus this process' unflushed ones"""
+        with self._metrics_lock:
+            pending = dict(self._metrics)
+        shared = self.cache.get_many([self._metric_key(event) for event in METRIC_EVENTS])
+        stats = {
+            event: shared.get(self._metric_key(event), 0) + pending.get(event, 0)
+            for event in METRIC_EVENTS
+        }
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+def all_metrics():
+    """{namespace: metrics} for every namespace created in this process"""
+    return {name: namespace.metrics() for name, namespace in sorted(namespaces.items())}
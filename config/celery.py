@@ -0,0 +1,13 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+app = Celery('config')
+
+# Read CELERY_* settings from Django settings. Celery's Django fixup closes
+# obsolete database connections before/after each task and after the worker
+# forks, so persistent connections (CONN_MAX_AGE) are safe in workers.
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,50 @@
+"""
+Database connection management.
+
+Connection handling depends on how the process serves requests:
+
+* WSGI web workers and Celery workers handle one request/task per thread at a
+  time, so they keep persistent connections (``CONN_MAX_AGE``) with health
+  checks. A broken connection is replaced at the start of the next request
+  instead of failing it. Celery's Django fixup closes obsolete connections
+  around every task, including after the worker forks.
+* ASGI workers run sync ORM code (DRF views, ``database_sync_to_async`` in the
+  consumers) in per-request thread contexts. A persistent connection would
+  outlive that context and leak, so ASGI uses ``CONN_MAX_AGE=0``. Pooling is
+  then done by PgBouncer in transaction mode (``DB_POOL_MODE=pgbouncer``),
+  which makes opening a connection a cheap local handshake. The Docker image
+  defaults to that mode and docker-compose runs the PgBouncer service.
+
+Django 4.2 has no built-in psycopg pool (``OPTIONS['pool']`` arrived in 5.1),
+so PgBouncer is the supported pooling path.
+"""
+import dj_database_url
+
+POOL_MODES = ('persistent', 'pgbouncer', 'none')
+
+
+def database_config(url, server_interface='wsgi', pool_mode='persistent',
+                    conn_max_age=600, health_checks=True):
+    """Build a ``DATABASES`` entry for ``url`` tuned for the current process"""
+    if pool_mode not in POOL_MODES:
+        raise ValueError(f"DB_POOL_MODE must be one of {', '.join(POOL_MODES)}, got {pool_mode!r}")
+
+    if pool_mode == 'none' or server_interface == 'asgi':
+        conn_max_age = 0
+
+    db = dj_database_url.parse(
+        url,
+        conn_max_age=conn_max_age,
+        conn_health_checks=health_checks and conn_max_age != 0,
+    )
+
+    if pool_mode == 'pgbouncer':
+        # Transaction pooling hands each transaction to whichever server
+        # connection is free, so named (server-side) cursors opened by
+        # .iterator() would not survive between fetches.
+        db['DISABLE_SERVER_SIDE_CURSORS'] = True
+
+    if db['ENGINE'] == 'django.db.backends.postgresql':
+        db.setdefault('OPTIONS', {}).setdefault('connect_timeout', 5)
+
+    return db
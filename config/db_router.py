@@ -0,0 +1,104 @@
+"""
+Read-replica routing for analytics and reporting queries.
+
+Nothing goes to the replica by default. Heavy read-only code opts in with
+``replica_reads(user)`` (or ``@reads_from_replica`` on a viewset action), and
+only ORM reads inside that block are routed to ``REPLICA_DATABASE_ALIAS``.
+Writes always go to the primary.
+
+The replica is skipped (reads stay on the primary) when:
+
+* no replica is configured (``REPLICA_DATABASE_URL`` unset),
+* the user wrote data within ``REPLICA_STICKY_SECONDS``, so they read their
+  own writes despite replication lag,
+* the replica failed a connection check within ``REPLICA_RETRY_SECONDS``.
+"""
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from apps.users.versioning import get_versions
+
+logger = logging.getLogger(__name__)
+
+# Resources whose writes make a user "sticky" to the primary
+STICKY_RESOURCES = ('expenses', 'analytics', 'insights', 'budgets', 'transactions')
+
+_read_alias = contextvars.ContextVar('replica_read_alias', default=None)
+_replica_down_until = {}
+
+
+def _replica_alias():
+    return getattr(settings, 'REPLICA_DATABASE_ALIAS', 'replica')
+
+
+def replica_available(alias):
+    """Check (and remember for a while) whether the replica accepts connections"""
+    if alias not in settings.DATABASES:
+        return False
+    if time.monotonic() < _replica_down_until.get(alias, 0):
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError as e:
+        logger.warning(f"Read replica '{alias}' unavailable, falling back to primary: {str(e)}")
+        _replica_down_until[alias] = time.monotonic() + getattr(settings, 'REPLICA_RETRY_SECONDS', 30)
+        return False
+    return True
+
+
+def recently_wrote(user):
+    """True if the user changed data inside the read-your-writes window"""
+    if user is None or not user.is_authenticated:
+        return False
+    window = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+    versions = get_versions(user.pk, STICKY_RESOURCES)
+    last_write = max(timestamp for _, timestamp in versions.values())
+    return time.time() - last_write < window
+
+
+@contextmanager
+def replica_reads(user=None):
+    """Route ORM reads inside the block to the replica when it is safe to do so"""
+    alias = _replica_alias()
+    if recently_wrote(user) or not replica_available(alias):
+        alias = None
+
+    token = _read_alias.set(alias)
+    try:
+        yield alias or DEFAULT_DB_ALIAS
+    finally:
+        _read_alias.reset(token)
+
+
+def reads_from_replica(view_method):
+    """Run a viewset action inside ``replica_reads(request.user)``"""
+    @wraps(view_method)
+    def inner(self, request, *args, **kwargs):
+        with replica_reads(request.user):
+            return view_method(self, request, *args, **kwargs)
+    return inner
+
+
+class ReplicaRouter:
+    """Route reads to the replica only inside ``replica_reads``; writes to the primary"""
+
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Explicit, otherwise Django would write instances loaded from the
+        # replica back to the replica (it falls back to instance._state.db).
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -1,7 +1,8 @@
 import os
 from pathlib import Path
+from celery.schedules import crontab
 from decouple import config
-import dj_database_url
+from config.database import database_config
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -27,6 +28,7 @@ THIRD_PARTY_APPS = [
     'django_filters',
     'drf_spectacular',
     'storages',
+    'channels',
 ]
 
 LOCAL_APPS = [
@@ -36,6 +38,7 @@ LOCAL_APPS = [
     'apps.analytics',
     'apps.notifications',
     'apps.ai',
+    'apps.voice',
     'apps.social',
     'apps.banking',
     'apps.investments',
@@ -75,14 +78,53 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+
+# Channels (WebSocket consumers in apps.analytics.consumers)
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': [config('REDIS_URL', default='redis://localhost:6379/0')],
+        },
+    },
+}
 
 # Database
+# See config/database.py for how connections are kept per server interface.
+# config/asgi.py sets DJANGO_SERVER_INTERFACE=asgi before settings load.
+DJANGO_SERVER_INTERFACE = os.environ.get('DJANGO_SERVER_INTERFACE', 'wsgi')
+
 DATABASES = {
-    'default': dj_database_url.config(
-        default=config('DATABASE_URL', default='sqlite:///db.sqlite3')
+    'default': database_config(
+        config('DATABASE_URL', default='sqlite:///db.sqlite3'),
+        server_interface=DJANGO_SERVER_INTERFACE,
+        pool_mode=config('DB_POOL_MODE', default='persistent'),
+        conn_max_age=config('DB_CONN_MAX_AGE', default=600, cast=int),
+        health_checks=config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
     )
 }
 
+# Optional read replica for analytics/report reads (see config/db_router.py).
+# For local testing both aliases can point at the same SQLite file.
+REPLICA_DATABASE_ALIAS = 'replica'
+REPLICA_DATABASE_URL = config('REPLICA_DATABASE_URL', default='')
+if REPLICA_DATABASE_URL:
+    DATABASES[REPLICA_DATABASE_ALIAS] = database_config(
+        REPLICA_DATABASE_URL,
+        server_interface=DJANGO_SERVER_INTERFACE,
+        pool_mode=config('DB_POOL_MODE', default='persistent'),
+        conn_max_age=config('DB_CONN_MAX_AGE', default=600, cast=int),
+        health_checks=config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+    )
+    DATABASES[REPLICA_DATABASE_ALIAS]['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['config.db_router.ReplicaRouter']
+# Seconds after a write during which the user's reads stay on the primary
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=5, cast=int)
+# Seconds to wait before retrying a replica that failed a connection check
+REPLICA_RETRY_SECONDS = config('REPLICA_RETRY_SECONDS', default=30, cast=int)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -178,6 +220,129 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    'generate-all-predictions': {
+        'task': 'apps.ai.tasks.generate_all_predictions',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    'record-category-model-metrics': {
+        'task': 'apps.ai.tasks.record_category_model_metrics',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'backtest-predictions': {
+        'task': 'apps.ai.tasks.backtest_predictions',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'rebuild-transaction-rollups': {
+        'task': 'apps.banking.tasks.rebuild_transaction_rollups',
+        'schedule': crontab(hour=1, minute=30),
+    },
+    'sync-due-bank-accounts': {
+        'task': 'apps.banking.tasks.sync_due_accounts',
+        'schedule': crontab(minute='*/5'),
+    },
+    'requeue-stale-receipts': {
+        'task': 'apps.voice.tasks.requeue_stale_receipts',
+        'schedule': crontab(minute='*/10'),
+    },
+    'refresh-exchange-rates': {
+        'task': 'apps.banking.tasks.refresh_exchange_rates',
+        'schedule': crontab(hour=0, minute=30),
+    },
+}
+CELERY_TASK_ROUTES = {
+    # OCR fans out to its own process pool, so it gets a dedicated worker
+    'apps.voice.tasks.*': {'queue': 'ocr'},
+}
+
+# Nightly spending predictions
+PREDICTION_CHUNK_SIZE = config('PREDICTION_CHUNK_SIZE', default=500, cast=int)
+
+# Streaming anomaly scoring of new expenses
+ANOMALY_Z_THRESHOLD = config('ANOMALY_Z_THRESHOLD', default=3.0, cast=float)
+ANOMALY_MIN_SAMPLES = config('ANOMALY_MIN_SAMPLES', default=5, cast=int)
+
+# AI chat insight snapshots
+AI_SNAPSHOT_REFRESH_DELAY = config('AI_SNAPSHOT_REFRESH_DELAY', default=30, cast=int)
+
+# Spend cube: seconds to batch expense writes before folding them in
+SPENDING_CUBE_UPDATE_DELAY = config('SPENDING_CUBE_UPDATE_DELAY', default=10, cast=int)
+
+# Bank transaction sync
+BANK_SYNC_PROVIDER = config(
+    'BANK_SYNC_PROVIDER',
+    default='apps.banking.providers.FakeSyncProvider' if DEBUG else 'apps.banking.providers.PlaidSyncProvider'
+)
+BANK_SYNC_TIMEOUT = config('BANK_SYNC_TIMEOUT', default=30, cast=int)
+BANK_SYNC_FAKE_LATENCY = config('BANK_SYNC_FAKE_LATENCY', default=0.0, cast=float)
+PLAID_CLIENT_ID = config('PLAID_CLIENT_ID', default='')
+PLAID_SECRET = config('PLAID_SECRET', default='')
+PLAID_ENV = config('PLAID_ENV', default='sandbox')
+BANK_SYNC_INTERVAL_MINUTES = config('BANK_SYNC_INTERVAL_MINUTES', default=360, cast=int)
+BANK_SYNC_JITTER = config('BANK_SYNC_JITTER', default=0.2, cast=float)  # Fraction of the interval
+BANK_SYNC_BATCH_SIZE = config('BANK_SYNC_BATCH_SIZE', default=500, cast=int)
+BANK_SYNC_CONCURRENCY = config('BANK_SYNC_CONCURRENCY', default=8, cast=int)
+BANK_SYNC_INSTITUTION_RATE = config('BANK_SYNC_INSTITUTION_RATE', default=2.0, cast=float)  # Pages per second
+BANK_SYNC_INSTITUTION_BURST = config('BANK_SYNC_INSTITUTION_BURST', default=5, cast=int)
+BANK_SYNC_BACKOFF_BASE_MINUTES = config('BANK_SYNC_BACKOFF_BASE_MINUTES', default=5, cast=int)
+BANK_SYNC_BACKOFF_MAX_MINUTES = config('BANK_SYNC_BACKOFF_MAX_MINUTES', default=360, cast=int)
+
+# Reconciliation of bank transactions with manual expenses
+RECONCILE_DATE_WINDOW_DAYS = config('RECONCILE_DATE_WINDOW_DAYS', default=3, cast=int)
+RECONCILE_DELAY = config('RECONCILE_DELAY', default=60, cast=int)
+
+# Currency conversion: daily rates against one pivot currency
+FX_PIVOT_CURRENCY = config('FX_PIVOT_CURRENCY', default='USD')
+# Fake rates only by default in development; elsewhere set a provider or a rates file
+FX_RATE_PROVIDER = config('FX_RATE_PROVIDER', default='apps.banking.fx.FakeRateProvider' if DEBUG else '')
+FX_RATES_FILE = config('FX_RATES_FILE', default='')  # CSV or JSON; replaces the provider when set
+FX_MAX_STALE_DAYS = config('FX_MAX_STALE_DAYS', default=7, cast=int)
+FX_CACHE_SIZE = config('FX_CACHE_SIZE', default=4096, cast=int)
+FX_CACHE_TTL = config('FX_CACHE_TTL', default=3600, cast=int)
+
+# Per-user expense categorizer
+CATEGORY_MODEL_MIN_CONFIDENCE = config('CATEGORY_MODEL_MIN_CONFIDENCE', default=0.6, cast=float)
+CATEGORY_MODEL_TRAIN_DELAY = config('CATEGORY_MODEL_TRAIN_DELAY', default=60, cast=int)
+CATEGORY_MODEL_CACHE_SIZE = config('CATEGORY_MODEL_CACHE_SIZE', default=256, cast=int)
+CATEGORY_MODEL_CACHE_TTL = config('CATEGORY_MODEL_CACHE_TTL', default=300, cast=int)
+
+# Receipt OCR
+OCR_WORKERS = config('OCR_WORKERS', default=0, cast=int)  # 0 = one per CPU core
+OCR_TASK_CHUNK_SIZE = config('OCR_TASK_CHUNK_SIZE', default=8, cast=int)
+OCR_BATCH_MAX_FILES = config('OCR_BATCH_MAX_FILES', default=50, cast=int)
+OCR_TIMEOUT_SECONDS = config('OCR_TIMEOUT_SECONDS', default=60, cast=int)
+OCR_STALE_MINUTES = config('OCR_STALE_MINUTES', default=15, cast=int)  # Processing longer than this is a dead worker
+OCR_MAX_ATTEMPTS = config('OCR_MAX_ATTEMPTS', default=3, cast=int)
+OCR_NEAR_DUPLICATE_MAX_BITS = config('OCR_NEAR_DUPLICATE_MAX_BITS', default=4, cast=int)
+OCR_NEAR_DUPLICATE_WINDOW_HOURS = config('OCR_NEAR_DUPLICATE_WINDOW_HOURS', default=24, cast=int)
+
+# Cache
+# Shared across all workers: per-user data versions (ETag / Last-Modified)
+# must be visible to every process or a stale 304 could be served.
+# Shared Redis cache; set CACHE_REDIS_URL=locmem:// for tests and local runs
+# without Redis. Keys are namespaced per app (see config/cache.py).
+CACHE_REDIS_URL = config('CACHE_REDIS_URL', default='redis://localhost:6379/1')
+
+if CACHE_REDIS_URL.startswith('locmem://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='expense-tracker'),
+            'TIMEOUT': 300,
+            'OPTIONS': {
+                'socket_connect_timeout': 2,
+                'socket_timeout': 2,
+            },
+        }
+    }
 
 # Email Configuration
 EMAIL_BACKEND = config(
@@ -9,6 +9,7 @@ from apps.analytics.views import AnalyticsReportViewSet, UserInsightViewSet, Cat
 from apps.users.views import UserViewSet
 from apps.expenses.views import ExpenseViewSet
 from apps.budgets.views import BudgetViewSet
+from apps.banking.views import BankAccountViewSet, TransactionViewSet, TransactionCategoryViewSet, SyncLogViewSet
 
 # Create a router and register our viewsets with it
 router = DefaultRouter()
@@ -18,7 +19,13 @@ router.register(r'categories', CategoryAnalyticsViewSet, basename='category-anal
 router.register(r'users', UserViewSet)
 router.register(r'expenses', ExpenseViewSet)
 router.register(r'budgets', BudgetViewSet)
+router.register(r'bank-accounts', BankAccountViewSet, basename='bank-account')
+router.register(r'transactions', TransactionViewSet, basename='transaction')
+router.register(r'transaction-categories', TransactionCategoryViewSet)
+router.register(r'sync-logs', SyncLogViewSet, basename='sync-log')
 
+# WebSocket routes live in config/asgi.py (apps.analytics.routing), not here:
+# they are served by the ASGI ProtocolTypeRouter, not by the HTTP URLconf.
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include(router.urls)),
@@ -28,48 +35,9 @@ urlpatterns = [
     path('api/v1/budgets/', include('apps.budgets.urls')),
     path('api/v1/notifications/', include('apps.notifications.urls')),
     path('api/v1/social/', include('apps.social.urls')),
-    pathNow let me update the main URLs configuration to include the WebSocket routing for the analytics app:
-
-<edit_file>
-<path>C:/Users/nupur/Desktop/expense-tracker-api/config/urls.py</path>
-<content>
-<<<<<<< SEARCH
-from django.urls import path, include
-=======
-from django.urls import path, include, re_path
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from channels.security.websocket import AllowedHostsOriginValidator
-from apps.analytics.routing import websocket_urlpatterns
->>>>>>> REPLACE
-# Import viewsets
-from apps.banking.views import BankAccountViewSet, TransactionViewSet, TransactionCategoryViewSet, SyncLogViewSet
-from apps.investments.views import InvestmentAccountViewSet, AssetViewSet, PortfolioViewSet, TransactionViewSet as InvestmentTransactionViewSet, PerformanceViewSet, GoalViewSet
-from apps.crypto.views import ExchangeViewSet, CryptoAssetViewSet, WalletViewSet, CryptoHoldingViewSet, CryptoTransactionViewSet, StakingRewardViewSet, PriceHistoryViewSet
-
-# Create a router and register viewsets
-router = DefaultRouter()
-router.register(r'bank-accounts', BankAccountViewSet)
-router.register(r'transactions', TransactionViewSet)
-router.register(r'transaction-categories', TransactionCategoryViewSet)
-router.register(r'sync-logs', SyncLogViewSet)
-router.register(r'investment-accounts', InvestmentAccountViewSet)
-router.register(r'assets', AssetViewSet)
-router.register(r'portfolios', PortfolioViewSet)
-router.register(r'investment-transactions', InvestmentTransactionViewSet)
-router.register(r'performances', PerformanceViewSet)
-router.register(r'goals', GoalViewSet)
-router.register(r'exchanges', ExchangeViewSet)
-router.register(r'crypto-assets', CryptoAssetViewSet)
-router.register(r'wallets', WalletViewSet)
-router.register(r'crypto-holdings', CryptoHoldingViewSet)
-router.register(r'crypto-transactions', CryptoTransactionViewSet)
-router.register(r'staking-rewards', StakingRewardViewSet)
-router.register(r'price-history', PriceHistoryViewSet)
-
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('api/v1/', include(router.urls)),
-    # WebSocket URLs
-    re_path(r'ws/analytics/', include(websocket_urlpatterns)),
+    path('api/v1/ai/', include('apps.ai.urls')),
+    path('api/v1/voice/', include('apps.voice.urls')),
 ]
+
+if settings.DEBUG:
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)